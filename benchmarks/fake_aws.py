@@ -0,0 +1,261 @@
+"""An in-process stand-in for the AWS APIs Sigrun calls. It hooks botocore's
+event system, so real clients are used end to end (parameter validation,
+pagination, waiters, resources, error handling) and only the HTTP round trip
+is replaced by a lookup against a seeded fleet. Every call is counted."""
+
+import fnmatch
+import itertools
+import json
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# DescribeInstances returns at most this many instances per page
+PAGE_SIZE = 1000
+LAUNCH_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeAwsError(Exception):
+
+    def __init__(self, code: str, message: str = ""):
+        super().__init__(message or code)
+        self.code = code
+
+
+class FakeAws:
+
+    def __init__(self, public_key: str):
+        self.public_key = public_key
+        self.instances: Dict[str, dict] = {}
+        self.security_groups: Dict[str, dict] = {}
+        self.invocations: List[dict] = []
+        self.calls: Counter = Counter()
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def seed(self, size: int, games: List[str]):
+        """Add `size` Sigrun servers spread over `games`. A quarter of them are
+        running. Running servers get loopback addresses so agent queries are
+        refused immediately instead of timing out."""
+        for i in range(size):
+            running = i % 4 == 0
+            tags = {
+                "game": games[i % len(games)],
+                "pretty_game": games[i % len(games)].title(),
+                "server_name": f"server-{i}",
+                "password": f"password-{i}",
+                "sigrun": "",
+            }
+            if running:
+                tags["start_time"] = LAUNCH_TIME.isoformat()
+            self.add_instance(
+                "running" if running else "stopped",
+                tags,
+                f"127.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" if running else None,
+            )
+
+    def add_instance(self, state: str, tags: Dict[str, str], public_ip: Optional[str]):
+        instance_id = f"i-{next(self.ids):017x}"
+        self.instances[instance_id] = {
+            "InstanceId": instance_id,
+            "State": {"Name": state},
+            "LaunchTime": LAUNCH_TIME,
+            "InstanceType": "t3.medium",
+            "Tags": [{"Key": key, "Value": value} for key, value in tags.items()],
+            **({"PublicIpAddress": public_ip} if public_ip else {}),
+        }
+        return instance_id
+
+    def instance_ids(self, state: str) -> List[str]:
+        return [
+            instance_id
+            for instance_id, instance in self.instances.items()
+            if instance["State"]["Name"] == state
+        ]
+
+    def tags(self, instance_id: str) -> Dict[str, str]:
+        return {t["Key"]: t["Value"] for t in self.instances[instance_id]["Tags"]}
+
+    def install(self):
+        """Route every client created from boto3's default session through the
+        fake. Must be called before any client is created."""
+        import boto3
+
+        boto3.setup_default_session(region_name="us-east-1")
+        events = boto3.DEFAULT_SESSION.events
+        events.register("before-parameter-build", self.capture_params)
+        events.register("before-call", self.respond)
+
+    @staticmethod
+    def capture_params(params, context, **kwargs):
+        # before-call only sees the serialized request, so keep the originals
+        context["fake_params"] = dict(params)
+
+    def respond(self, model, context, **kwargs):
+        from botocore.awsrequest import AWSResponse
+
+        service = model.service_model.service_name
+        operation = model.name
+        with self.lock:
+            self.calls[f"{service}.{operation}"] += 1
+            handler = getattr(self, f"{service}_{operation}", None)
+            if handler is None:
+                raise NotImplementedError(f"The fake doesn't support {service}.{operation}")
+            try:
+                parsed = handler(context.get("fake_params", {}))
+                status = 200
+            except FakeAwsError as e:
+                parsed = {"Error": {"Code": e.code, "Message": str(e)}}
+                status = 400
+        parsed.setdefault("ResponseMetadata", {"HTTPStatusCode": status})
+        return AWSResponse("https://fake.amazonaws.com", status, {}, None), parsed
+
+    # EC2
+
+    def ec2_DescribeInstances(self, params):
+        instances = self.instances.values()
+        if params.get("InstanceIds"):
+            missing = [i for i in params["InstanceIds"] if i not in self.instances]
+            if missing:
+                raise FakeAwsError("InvalidInstanceID.NotFound", f"{missing} not found")
+            instances = [self.instances[i] for i in params["InstanceIds"]]
+        for f in params.get("Filters", []):
+            instances = [i for i in instances if matches(i, f["Name"], f["Values"])]
+
+        start = int(params.get("NextToken") or 0)
+        page_size = params.get("MaxResults", PAGE_SIZE)
+        page = list(instances)[start : start + page_size]
+        response = {"Reservations": [{"Instances": page}] if page else []}
+        if start + page_size < len(instances):
+            response["NextToken"] = str(start + page_size)
+        return response
+
+    def ec2_RunInstances(self, params):
+        tags = {
+            tag["Key"]: tag["Value"]
+            for spec in params.get("TagSpecifications", [])
+            for tag in spec["Tags"]
+        }
+        instance_ids = [
+            self.add_instance("pending", tags, None) for _ in range(params["MaxCount"])
+        ]
+        return {
+            "ReservationId": "r-fake",
+            "Instances": [self.instances[i] for i in instance_ids],
+        }
+
+    def ec2_StartInstances(self, params):
+        return self.transition(params["InstanceIds"], "pending", "StartingInstances")
+
+    def ec2_StopInstances(self, params):
+        return self.transition(params["InstanceIds"], "stopping", "StoppingInstances")
+
+    def ec2_TerminateInstances(self, params):
+        return self.transition(
+            params["InstanceIds"], "shutting-down", "TerminatingInstances"
+        )
+
+    def ec2_ModifyInstanceAttribute(self, params):
+        return {}
+
+    def transition(self, instance_ids, state, key):
+        for instance_id in instance_ids:
+            self.instances[instance_id]["State"] = {"Name": state}
+        return {key: [{"InstanceId": i} for i in instance_ids]}
+
+    def ec2_CreateTags(self, params):
+        for instance_id in params["Resources"]:
+            tags = self.tags(instance_id)
+            tags.update({t["Key"]: t["Value"] for t in params["Tags"]})
+            self.instances[instance_id]["Tags"] = [
+                {"Key": k, "Value": v} for k, v in tags.items()
+            ]
+        return {}
+
+    def ec2_DeleteTags(self, params):
+        keys = {t["Key"] for t in params["Tags"]}
+        for instance_id in params["Resources"]:
+            self.instances[instance_id]["Tags"] = [
+                t for t in self.instances[instance_id]["Tags"] if t["Key"] not in keys
+            ]
+        return {}
+
+    def ec2_DescribeInstanceTypes(self, params):
+        return {
+            "InstanceTypes": [
+                {
+                    "InstanceType": instance_type,
+                    "MemoryInfo": {"SizeInMiB": 8192},
+                    "HibernationSupported": True,
+                }
+                for instance_type in params["InstanceTypes"]
+            ]
+        }
+
+    def ec2_DescribeImages(self, params):
+        return {"Images": []}
+
+    def ec2_DescribeSecurityGroups(self, params):
+        names = next(
+            (f["Values"] for f in params.get("Filters", []) if f["Name"] == "group-name"),
+            None,
+        )
+        groups = [
+            group
+            for group in self.security_groups.values()
+            if names is None or group["GroupName"] in names
+        ]
+        return {"SecurityGroups": groups}
+
+    def ec2_CreateSecurityGroup(self, params):
+        group_id = f"sg-{len(self.security_groups):017x}"
+        self.security_groups[group_id] = {
+            "GroupId": group_id,
+            "GroupName": params["GroupName"],
+            "IpPermissions": [],
+        }
+        return {"GroupId": group_id}
+
+    def ec2_AuthorizeSecurityGroupIngress(self, params):
+        self.security_groups[params["GroupId"]]["IpPermissions"].extend(
+            params["IpPermissions"]
+        )
+        return {"Return": True}
+
+    def ec2_RevokeSecurityGroupIngress(self, params):
+        group = self.security_groups[params["GroupId"]]
+        group["IpPermissions"] = [
+            p for p in group["IpPermissions"] if p not in params["IpPermissions"]
+        ]
+        return {"Return": True}
+
+    # Everything else
+
+    def secretsmanager_GetSecretValue(self, params):
+        return {"SecretString": json.dumps({"APPLICATION_PUBLIC_KEY": self.public_key})}
+
+    def lambda_Invoke(self, params):
+        self.invocations.append(json.loads(params["Payload"]))
+        return {"StatusCode": 202}
+
+    def ssm_SendCommand(self, params):
+        return {"Command": {"CommandId": str(uuid.uuid4())}}
+
+    def ssm_GetCommandInvocation(self, params):
+        return {"Status": "Success", "StatusDetails": "Success"}
+
+
+def matches(instance: dict, name: str, values: List[str]) -> bool:
+    tags = {t["Key"]: t["Value"] for t in instance["Tags"]}
+    if name == "instance-id":
+        return instance["InstanceId"] in values
+    if name == "instance-state-name":
+        return instance["State"]["Name"] in values
+    if name == "tag-key":
+        return any(key in tags for key in values)
+    if name.startswith("tag:"):
+        value = tags.get(name[len("tag:") :])
+        return value is not None and any(fnmatch.fnmatchcase(value, v) for v in values)
+    raise NotImplementedError(f"The fake doesn't support the {name} filter")
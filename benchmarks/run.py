@@ -0,0 +1,269 @@
+"""End-to-end benchmarks for the Lambda handlers.
+
+Every command in `sigrun.commands.COMMANDS` is sent to `lambda_/initial.main`
+as a signed Discord interaction, and deferred to `lambda_/deferred.main`
+when the initial handler hands it off. AWS is replaced by an in-process fake
+seeded with a fleet of servers, and Discord by a local webhook receiver.
+
+Each (fleet, command) pair runs in a fresh interpreter so the first
+interaction measures a cold start. The rest are warm. Results are compared
+against `baseline.json`, and regressions in the guarded commands fail the run:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --fleets 10 --commands list-servers
+    python -m benchmarks.run --update-baseline
+"""
+
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import click
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+GAMES = sorted(
+    p.parent.name for p in (REPO_ROOT / "sigrun" / "games").glob("*/metadata.json")
+)
+FLEETS = (10, 1_000, 10_000)
+# Regressions in these fail the run, the rest are only reported
+GUARDED_COMMANDS = ("list-servers", "create-server")
+# Fast commands are noisy, so regressions need to clear both of these
+LATENCY_TOLERANCE = 0.25
+LATENCY_SLACK_MS = 5.0
+
+# What the handlers see in place of the deployed stack's configuration
+ENVIRONMENT = {
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "DEFERRED_LAMBDA_NAME": "sigrun-deferred",
+    "WORLD_BUCKET": "sigrun-worlds",
+    "SIGRUN_RESOURCE_CACHE": "memory",
+    "SIGRUN_IDEMPOTENCY": "memory",
+    "SIGRUN_NOTIFICATIONS": "memory",
+    "SIGRUN_EVENT_LOG_SAMPLE_RATE": "0",
+    "LOGURU_LEVEL": "WARNING",
+}
+
+
+def first_instance(aws, state: str) -> str:
+    """The first seeded instance in `state`, put back in it for each iteration."""
+    index = 0 if state == "running" else 1
+    instance_id = list(aws.instances)[index]
+    aws.instances[instance_id]["State"] = {"Name": state}
+    return instance_id
+
+
+def copy_world_options(aws, iteration: int) -> dict:
+    tags = aws.tags(first_instance(aws, "running"))
+    return {"game": tags["game"], "server_name": tags["server_name"]}
+
+
+# The options each command is invoked with on a given iteration
+SCENARIOS = {
+    "copy-world": copy_world_options,
+    "create-server": lambda aws, i: {
+        "game": GAMES[0],
+        "server_name": f"benchmark-{i}",
+        "password": "benchmark",
+    },
+    "list-games": lambda aws, i: {},
+    "list-servers": lambda aws, i: {},
+    "server-status": lambda aws, i: {"game": GAMES[0], "server_name": "server-0"},
+    "start-server": lambda aws, i: {"instance_ids": first_instance(aws, "stopped")},
+    "stop-server": lambda aws, i: {"instance_ids": first_instance(aws, "running")},
+}
+
+
+def sign_interaction(signing_key, command: str, options: dict, iteration: int) -> dict:
+    body = json.dumps(
+        {
+            "type": 2,
+            "id": f"interaction-{iteration}",
+            "application_id": "benchmark",
+            "token": f"token-{iteration}",
+            "data": {
+                "name": command,
+                "options": [{"name": k, "value": v} for k, v in options.items()],
+            },
+        }
+    )
+    timestamp = str(int(time.time()))
+    signature = signing_key.sign(f"{timestamp}{body}".encode()).signature.hex()
+    return {
+        "headers": {
+            "x-signature-ed25519": signature,
+            "x-signature-timestamp": timestamp,
+        },
+        "body": body,
+    }
+
+
+def interact(aws, discord, signing_key, command: str, iteration: int) -> dict:
+    event = sign_interaction(
+        signing_key, command, SCENARIOS[command](aws, iteration), iteration
+    )
+    calls, received = sum(aws.calls.values()), discord.bytes_received
+
+    start = time.perf_counter()
+    # The first import is part of the cold start, later ones are free
+    response = importlib.import_module("initial").main(event, None)
+    initial_ms = (time.perf_counter() - start) * 1000
+    if response.get("statusCode") != 200:
+        raise RuntimeError(f"{command} was rejected: {response}")
+    deferred = bool(aws.invocations)
+    if deferred:
+        importlib.import_module("deferred").main(aws.invocations.pop(), None)
+    total_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "initial_ms": initial_ms,
+        "total_ms": total_ms,
+        "deferred": deferred,
+        "aws_calls": sum(aws.calls.values()) - calls,
+        "discord_bytes": len(response["body"]) + discord.bytes_received - received,
+    }
+
+
+def summarize(samples: List[dict]) -> dict:
+    cold, warm = samples[0], samples[1:] or samples
+
+    def p50(key):
+        return round(statistics.median(s[key] for s in warm), 2)
+
+    return {
+        "cold_initial_ms": round(cold["initial_ms"], 2),
+        "cold_total_ms": round(cold["total_ms"], 2),
+        "warm_initial_ms_p50": p50("initial_ms"),
+        "warm_total_ms_p50": p50("total_ms"),
+        "warm_total_ms_max": round(max(s["total_ms"] for s in warm), 2),
+        "cold_aws_calls": cold["aws_calls"],
+        "warm_aws_calls": max(s["aws_calls"] for s in warm),
+        "discord_bytes": max(s["discord_bytes"] for s in warm),
+        "deferred": any(s["deferred"] for s in warm),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict]) -> List[str]:
+    """Regressions in the guarded commands, as readable lines."""
+    regressions = []
+    for key, result in results.items():
+        command = key.split("/", 1)[1]
+        if command not in GUARDED_COMMANDS or key not in baseline:
+            continue
+        before = baseline[key]
+        limit = before["warm_total_ms_p50"] * (1 + LATENCY_TOLERANCE) + LATENCY_SLACK_MS
+        if result["warm_total_ms_p50"] > limit:
+            regressions.append(
+                f"{key}: warm p50 {result['warm_total_ms_p50']}ms, "
+                f"baseline {before['warm_total_ms_p50']}ms"
+            )
+        for metric in ("cold_aws_calls", "warm_aws_calls"):
+            if result[metric] > before[metric]:
+                regressions.append(
+                    f"{key}: {metric} {result[metric]}, baseline {before[metric]}"
+                )
+    return regressions
+
+
+@click.group(invoke_without_command=True)
+@click.option("--fleets", default=",".join(map(str, FLEETS)), help="Fleet sizes to seed.")
+@click.option("--commands", default="", help="Commands to run, all by default.")
+@click.option("--iterations", default=5, help="Warm interactions per command.")
+@click.option("--update-baseline", is_flag=True, help="Save the results as the baseline.")
+@click.pass_context
+def benchmark(ctx, fleets: str, commands: str, iterations: int, update_baseline: bool):
+    if ctx.invoked_subcommand is not None:
+        return
+
+    from sigrun.commands import COMMANDS
+
+    missing = set(COMMANDS) - set(SCENARIOS)
+    if missing:
+        raise click.ClickException(f"No benchmark scenario for {sorted(missing)}.")
+    selected = commands.split(",") if commands else sorted(COMMANDS)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        for fleet in (int(f) for f in fleets.split(",")):
+            for command in selected:
+                out = Path(scratch) / f"{fleet}-{command}.json"
+                subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.run",
+                        "worker",
+                        str(fleet),
+                        command,
+                        str(iterations),
+                        str(out),
+                    ],
+                    cwd=REPO_ROOT,
+                    env={**os.environ, **ENVIRONMENT},
+                    check=True,
+                )
+                key = f"{fleet}/{command}"
+                results[key] = summarize(json.loads(out.read_text()))
+                click.echo(f"{key}: {json.dumps(results[key])}")
+
+    if update_baseline:
+        baseline = {}
+        if BASELINE_PATH.exists():
+            baseline = json.loads(BASELINE_PATH.read_text())
+        baseline.update(results)
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        click.echo(f"Saved the baseline to {BASELINE_PATH}.")
+        return
+    if not BASELINE_PATH.exists():
+        click.echo("There's no baseline to compare against, save one with --update-baseline.")
+        return
+
+    regressions = compare(results, json.loads(BASELINE_PATH.read_text()))
+    if regressions:
+        click.echo("Performance regressions:\n" + "\n".join(regressions))
+        sys.exit(1)
+    click.echo("No regressions against the baseline.")
+
+
+@benchmark.command(hidden=True)
+@click.argument("fleet", type=int)
+@click.argument("command")
+@click.argument("iterations", type=int)
+@click.argument("out", type=click.Path())
+def worker(fleet: int, command: str, iterations: int, out: str):
+    """Run one command against one fleet in this interpreter."""
+    from nacl.signing import SigningKey
+
+    from benchmarks.fake_aws import FakeAws
+    from benchmarks.fake_discord import FakeDiscord
+
+    discord = FakeDiscord()
+    discord.start()
+    # Read by the messenger when it's imported, so this has to come first
+    os.environ["DISCORD_API_URL"] = discord.url
+
+    signing_key = SigningKey.generate()
+    aws = FakeAws(signing_key.verify_key.encode().hex())
+    aws.install()
+    aws.seed(fleet, GAMES)
+    sys.path.insert(0, str(REPO_ROOT / "lambda_"))
+
+    samples = [
+        interact(aws, discord, signing_key, command, iteration)
+        for iteration in range(iterations + 1)
+    ]
+    discord.stop()
+    Path(out).write_text(json.dumps(samples))
+
+
+if __name__ == "__main__":
+    benchmark()
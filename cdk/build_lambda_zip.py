@@ -1,44 +1,447 @@
-import zipfile
+"""Builds the Lambda artifact. Only what the handlers can actually import goes
+in: the sigrun package, plus each third-party package in the handlers' import
+closure. Tests, type stubs, packaging metadata, caches and the AWS service
+models Sigrun never calls are left out. Sources are precompiled to bytecode
+for the Lambda runtime so cold starts don't pay for it.
 
-import loguru
+Builds are deterministic: entries are sorted and carry fixed timestamps and
+permissions, so an unchanged tree produces a byte-identical archive and CDK
+has nothing to upload. Compressed entries are cached by content hash under
+BUILD_CACHE and misses are compressed across a process pool, so an edit only
+recompresses the files it touched. If nothing that goes into an archive
+changed since it was last written, it isn't rewritten at all.
 
+With `--layer`, third-party packages go into a separate `sigrun-layer.zip`,
+which the stack deploys as a Lambda layer when it's present."""
+
+import ast
+import hashlib
+import json
+import marshal
+import pickle
+import re
+import struct
+import sys
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from importlib import metadata
+from importlib.util import MAGIC_NUMBER, source_hash
+from modulefinder import ModuleFinder
 from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+import click
+import loguru
 from loguru import logger
 
+PACKAGE_ROOT = Path(__file__).resolve().parents[1]
+HANDLERS = ("initial", "deferred", "inventory", "watchdog", "pool")
+ARTIFACT = PACKAGE_ROOT / "sigrun.zip"
+LAYER_ARTIFACT = PACKAGE_ROOT / "sigrun-layer.zip"
+BUILD_CACHE = Path.home() / ".cache" / "sigrun" / "build"
+# Keep in step with the runtime in sigrun_construct.py
+LAMBDA_PYTHON = (3, 10)
+# Lambda rejects zipped uploads larger than this
+SIZE_BUDGET_BYTES = 50 * 1024 * 1024
+COMPRESSION_LEVEL = 9
+
+# The project's dependencies the Lambdas need, as in pyproject.toml. Packages
+# outside their dependency tree are never bundled, even if modulefinder follows
+# an optional import into them.
+RUNTIME_DEPENDENCIES = ("aws-lambda-typing", "boto3", "httpx", "loguru", "PyNaCl")
+# Loaded by compiled extensions, which modulefinder can't see into
+EXTRA_MODULES = ("_cffi_backend",)
+# botocore and boto3 ship models for every AWS service. Only these are kept, so
+# a client for any other service has to be added here first.
+AWS_SERVICES = {
+    "cloudwatch",
+    "dynamodb",
+    "ec2",
+    "lambda",
+    "s3",
+    "secretsmanager",
+    "ssm",
+}
+SERVICE_MODEL_DIRS = ("botocore/data", "boto3/data")
+EXCLUDED_DIRS = {"__pycache__", "tests", "test"}
+EXCLUDED_SUFFIXES = {".pyc", ".pyi"}
+
+# Zip records, written by hand so cached compressed data can be reused as is
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+ZIP_VERSION = 20
+ZIP_UTF8_FLAG = 0x800
+ZIP_DEFLATED = 8
+# Midnight on 1980-01-01, the earliest time a zip entry can have
+ZIP_TIME, ZIP_DATE = 0, (0 << 9) | (1 << 5) | 1
+ZIP_UNIX_SYSTEM = 3
+ZIP_FILE_MODE = 0o100644 << 16
+
+
+@dataclass(frozen=True, slots=True)
+class Entry:
+    arcname: str
+    crc: int
+    size: int
+    compressed: bytes
+
+
+def get_site_packages() -> Path:
+    return Path(loguru.__file__).resolve().parents[1]
+
+
+def dependency_top_levels() -> Set[str]:
+    """The top-level site-packages entries installed by the runtime
+    dependencies and everything they require, ignoring optional extras."""
+    pending, seen = list(RUNTIME_DEPENDENCIES), set()
+    top_levels = set()
+    while pending:
+        name = pending.pop().lower().replace("_", "-")
+        if name in seen:
+            continue
+        seen.add(name)
+        try:
+            distribution = metadata.distribution(name)
+        except metadata.PackageNotFoundError:
+            # Requirements gated on another Python version may well be missing
+            if name in {d.lower() for d in RUNTIME_DEPENDENCIES}:
+                logger.warning(f"{name} isn't installed, it can't be bundled.")
+            continue
+        for requirement in distribution.requires or []:
+            if "extra ==" not in requirement:
+                pending.append(re.match(r"[A-Za-z0-9_.-]+", requirement).group())
+        for file in distribution.files or []:
+            top = file.parts[0]
+            if not top.endswith((".dist-info", ".egg-info")) and top != "..":
+                top_levels.add(top)
+    return top_levels
 
-def main():
-    site_packages = Path(loguru.__file__).resolve().parents[1]
-    package_root = Path(__file__).resolve().parents[1]
-    initial_handler_source = package_root / "lambda_" / "initial.py"
-    deferred_handler_source = package_root / "lambda_" / "deferred.py"
-    sigrun_source = package_root / "sigrun"
-    zipf = zipfile.ZipFile(package_root / "sigrun.zip", mode="w")
 
-    logger.info(
-        "Constructing a zip archive out of sigrun source "
-        "code and its dependencies. Using loguru to "
-        "determine dependency location."
+def find_third_party(site_packages: Path) -> Set[str]:
+    """The top-level site-packages entries the handlers import, directly or
+    through sigrun, including imports made lazily inside functions."""
+    finder = ModuleFinder(
+        path=[str(PACKAGE_ROOT / "lambda_"), str(PACKAGE_ROOT), *sys.path]
     )
-    logger.info(f"Site packages are located at {site_packages}.")
-    logger.info(f"Sigrun source code is located at {sigrun_source}.")
+    for handler in HANDLERS:
+        finder.run_script(str(PACKAGE_ROOT / "lambda_" / f"{handler}.py"))
 
-    for path in site_packages.rglob("*"):
-        # CDK is not needed for Lambda code and is so big it
-        # consumes the handler size quota
-        if str(path.relative_to(site_packages).parent).startswith("aws_cdk"):
+    imported = set()
+    for module in finder.modules.values():
+        if module.__file__ is None:
             continue
-        if path.is_file():
-            zipf.write(path, arcname=path.relative_to(site_packages))
+        path = Path(module.__file__).resolve()
+        if path.is_relative_to(site_packages):
+            imported.add(path.relative_to(site_packages).parts[0])
+    for name in EXTRA_MODULES:
+        imported.update(
+            p.name for p in site_packages.glob(f"{name}*") if not p.name.endswith("-info")
+        )
+    return imported & dependency_top_levels()
+
+
+def closure_key() -> str:
+    """What the import closure depends on: the imports our own code makes and
+    the installed distributions. Editing a function body doesn't change it."""
+    digest = hashlib.sha256()
+    sources = sorted((PACKAGE_ROOT / "sigrun").rglob("*.py")) + [
+        PACKAGE_ROOT / "lambda_" / f"{handler}.py" for handler in HANDLERS
+    ]
+    for source in sources:
+        for node in ast.walk(ast.parse(source.read_bytes())):
+            if isinstance(node, ast.Import):
+                digest.update(repr([alias.name for alias in node.names]).encode())
+            elif isinstance(node, ast.ImportFrom):
+                names = [alias.name for alias in node.names]
+                digest.update(repr((node.level, node.module, names)).encode())
+    for distribution in sorted(
+        f"{d.metadata['Name']}=={d.version}" for d in metadata.distributions()
+    ):
+        digest.update(distribution.encode())
+    digest.update(repr((RUNTIME_DEPENDENCIES, EXTRA_MODULES)).encode())
+    return digest.hexdigest()
+
+
+def get_third_party(site_packages: Path) -> List[str]:
+    """The import closure, reused from the last build when its key matches."""
+    cache = BUILD_CACHE / "closure.json"
+    key = closure_key()
+    try:
+        cached = json.loads(cache.read_text())
+        if cached["key"] == key:
+            return cached["packages"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    packages = sorted(find_third_party(site_packages))
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    cache.write_text(json.dumps({"key": key, "packages": packages}))
+    return packages
+
+
+def is_excluded(relative: Path) -> bool:
+    if EXCLUDED_DIRS.intersection(relative.parts[:-1]):
+        return True
+    if relative.suffix in EXCLUDED_SUFFIXES:
+        return True
+    for models in SERVICE_MODEL_DIRS:
+        parts = Path(models).parts
+        if relative.parts[: len(parts)] == parts and len(relative.parts) > len(parts) + 1:
+            if relative.parts[len(parts)] not in AWS_SERVICES:
+                return True
+    return False
+
+
+def collect(root: Path, entries: Iterable[Path], prefix: str = "") -> Dict[str, Path]:
+    """Map archive names to the files under `entries`, relative to `root`."""
+    files = {}
+    for entry in entries:
+        paths = entry.rglob("*") if entry.is_dir() else [entry]
+        for path in paths:
+            relative = path.relative_to(root)
+            if path.is_file() and not is_excluded(relative):
+                files[prefix + relative.as_posix()] = path
+    return files
+
+
+def bytecode(source: bytes, arcname: str) -> bytes:
+    """An unchecked-hash pyc, which the interpreter loads without comparing
+    timestamps against the (fixed) ones in the archive."""
+    code = compile(source, arcname, "exec", dont_inherit=True)
+    flags = (0b01).to_bytes(4, "little")
+    return MAGIC_NUMBER + flags + source_hash(source) + marshal.dumps(code)
+
+
+def pyc_name(arcname: str) -> str:
+    path = Path(arcname)
+    tag = f"cpython-{LAMBDA_PYTHON[0]}{LAMBDA_PYTHON[1]}"
+    return (path.parent / "__pycache__" / f"{path.stem}.{tag}.pyc").as_posix()
+
 
-    for path in sigrun_source.rglob("*"):
-        if path.is_file():
-            zipf.write(path, arcname=path.relative_to(package_root))
+def entry_keys(arcname: str, digest: str, precompile: bool) -> List[Tuple[str, str]]:
+    """The (archive name, cache key) of each entry a source file produces. Plain
+    entries are keyed by content alone. Bytecode also embeds the file's name and
+    depends on the interpreter."""
+    keys = [(arcname, digest)]
+    if precompile and arcname.endswith(".py"):
+        pyc_key = hashlib.sha256(
+            f"{digest}:{arcname}:{MAGIC_NUMBER.hex()}".encode()
+        ).hexdigest()
+        keys.append((pyc_name(arcname), pyc_key))
+    return keys
+
+
+def cache_path(key: str) -> Path:
+    return BUILD_CACHE / "entries" / key[:2] / key
+
+
+def compress(data: bytes) -> Tuple[int, int, bytes]:
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return zlib.crc32(data), len(data), compressor.compress(data) + compressor.flush()
+
+
+def build_entries(job: Tuple[str, str, str, bool]) -> int:
+    """Compress a source file's missing entries into the cache. Runs in a pool
+    worker. Returns how many entries were written."""
+    path, digest, arcname, precompile = job
+    data = Path(path).read_bytes()
+    written = 0
+    for name, key in entry_keys(arcname, digest, precompile):
+        target = cache_path(key)
+        if target.exists():
+            continue
+        if name == arcname:
+            contents = data
+        else:
+            try:
+                contents = bytecode(data, arcname)
+            except SyntaxError as e:
+                logger.warning(f"Not precompiling {arcname}: {e}")
+                continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temporary = target.with_suffix(".tmp")
+        temporary.write_bytes(pickle.dumps(compress(contents)))
+        temporary.replace(target)
+        written += 1
+    return written
+
+
+def digest_files(files: Dict[str, Path]) -> Dict[str, str]:
+    return {
+        arcname: hashlib.sha256(path.read_bytes()).hexdigest()
+        for arcname, path in files.items()
+    }
+
+
+def load_entries(
+    files: Dict[str, Path], digests: Dict[str, str], precompile: bool
+) -> List[Entry]:
+    """Every entry of an archive, compressing whatever isn't cached yet."""
+    jobs = [
+        (str(files[arcname]), digest, arcname, precompile)
+        for arcname, digest in digests.items()
+        if not all(
+            cache_path(key).exists() for _, key in entry_keys(arcname, digest, precompile)
+        )
+    ]
+    if jobs:
+        with ProcessPoolExecutor() as pool:
+            written = sum(pool.map(build_entries, jobs, chunksize=16))
+        logger.info(f"Compressed {written} new entries.")
+
+    entries = []
+    for arcname, digest in digests.items():
+        for name, key in entry_keys(arcname, digest, precompile):
+            if cache_path(key).exists():
+                entries.append(Entry(name, *pickle.loads(cache_path(key).read_bytes())))
+    return sorted(entries, key=lambda entry: entry.arcname)
+
+
+def write_zip(path: Path, entries: List[Entry]):
+    """Write a zip with fixed timestamps and permissions, in entry order."""
+    if len(entries) > 0xFFFF:
+        raise RuntimeError("Too many entries for a zip without ZIP64 extensions.")
+    central_directory = bytearray()
+    with path.open("wb") as f:
+        for entry in entries:
+            name = entry.arcname.encode()
+            if max(f.tell(), entry.size) >= 0xFFFF_FFFF:
+                raise RuntimeError("The archive is too large for a zip without ZIP64.")
+            central_directory += CENTRAL_HEADER.pack(
+                0x02014B50,
+                (ZIP_UNIX_SYSTEM << 8) | ZIP_VERSION,
+                ZIP_VERSION,
+                ZIP_UTF8_FLAG,
+                ZIP_DEFLATED,
+                ZIP_TIME,
+                ZIP_DATE,
+                entry.crc,
+                len(entry.compressed),
+                entry.size,
+                len(name),
+                0,
+                0,
+                0,
+                0,
+                ZIP_FILE_MODE,
+                f.tell(),
+            )
+            central_directory += name
+            f.write(
+                LOCAL_HEADER.pack(
+                    0x04034B50,
+                    ZIP_VERSION,
+                    ZIP_UTF8_FLAG,
+                    ZIP_DEFLATED,
+                    ZIP_TIME,
+                    ZIP_DATE,
+                    entry.crc,
+                    len(entry.compressed),
+                    entry.size,
+                    len(name),
+                    0,
+                )
+            )
+            f.write(name)
+            f.write(entry.compressed)
+
+        offset = f.tell()
+        f.write(central_directory)
+        f.write(
+            END_OF_CENTRAL_DIRECTORY.pack(
+                0x06054B50,
+                0,
+                0,
+                len(entries),
+                len(entries),
+                len(central_directory),
+                offset,
+                0,
+            )
+        )
+
+
+def inputs_hash(digests: Dict[str, str], precompile: bool) -> str:
+    digest = hashlib.sha256()
+    digest.update(Path(__file__).read_bytes())
+    digest.update(repr((precompile, MAGIC_NUMBER if precompile else b"")).encode())
+    for arcname, file_digest in sorted(digests.items()):
+        digest.update(f"{arcname}\0{file_digest}\n".encode())
+    return digest.hexdigest()
+
+
+def build(path: Path, files: Dict[str, Path], precompile: bool) -> bool:
+    """Build one archive unless its inputs are unchanged since it was last
+    written. Returns whether it's within the size budget."""
+    digests = digest_files(files)
+    inputs = inputs_hash(digests, precompile)
+    record = BUILD_CACHE / f"{path.name}.inputs"
+    if path.exists() and record.exists() and record.read_text() == inputs:
+        logger.info(f"{path.name} is up to date.")
+    else:
+        entries = load_entries(files, digests, precompile)
+        write_zip(path, entries)
+        record.parent.mkdir(parents=True, exist_ok=True)
+        record.write_text(inputs)
+    return report(path)
+
+
+def report(path: Path) -> bool:
+    compressed = path.stat().st_size
+    with zipfile.ZipFile(path) as zipf:
+        uncompressed = sum(info.file_size for info in zipf.infolist())
+    within = compressed <= SIZE_BUDGET_BYTES
+    log = logger.info if within else logger.error
+    log(
+        f"{path.name}: {compressed / 2**20:.1f} MiB zipped, "
+        f"{uncompressed / 2**20:.1f} MiB unzipped, "
+        f"budget {SIZE_BUDGET_BYTES / 2**20:.0f} MiB."
+    )
+    return within
+
+
+@click.command()
+@click.option("--layer", is_flag=True, help="Put third-party packages in a layer.")
+def main(layer: bool = False):
+    site_packages = get_site_packages()
+    logger.info(f"Site packages are located at {site_packages}.")
+
+    # Bytecode is specific to the interpreter version that wrote it
+    precompile = sys.version_info[:2] == LAMBDA_PYTHON
+    if not precompile:
+        runtime = ".".join(map(str, LAMBDA_PYTHON))
+        logger.warning(f"Not precompiling, the Lambda runtime is Python {runtime}.")
+
+    third_party = get_third_party(site_packages)
+    logger.info(f"The handlers import {', '.join(third_party)}.")
+
+    first_party_files = collect(PACKAGE_ROOT, [PACKAGE_ROOT / "sigrun"])
+    first_party_files.update(
+        {
+            f"{handler}.py": PACKAGE_ROOT / "lambda_" / f"{handler}.py"
+            for handler in HANDLERS
+        }
+    )
+    third_party_files = collect(
+        site_packages,
+        [site_packages / name for name in third_party],
+        # Layers are extracted to /opt, and /opt/python is on the path
+        prefix="python/" if layer else "",
+    )
 
-    zipf.write(initial_handler_source, arcname="initial.py")
-    zipf.write(deferred_handler_source, arcname="deferred.py")
+    within_budget = True
+    if layer:
+        within_budget &= build(LAYER_ARTIFACT, third_party_files, precompile)
+    else:
+        first_party_files.update(third_party_files)
+        LAYER_ARTIFACT.unlink(missing_ok=True)
+    within_budget &= build(ARTIFACT, first_party_files, precompile)
 
-    zipf.close()
-    logger.info(f"Created zip archive at {zipfile.Path(zipf)}")
+    if not within_budget:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,16 @@
 import os
 from pathlib import Path
 
-from aws_cdk import Duration, SecretValue
+from aws_cdk import Duration, RemovalPolicy, SecretValue
 from aws_cdk import aws_apigatewayv2 as apigateway
 from aws_cdk import aws_apigatewayv2_integrations as apigateway_integrations
+from aws_cdk import aws_dynamodb as dynamodb
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
 from aws_cdk import aws_iam as iam
 from aws_cdk import aws_lambda as lambda_
 from aws_cdk import aws_logs as logs
+from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_secretsmanager as secretsmanager
 from constructs import Construct
 
@@ -34,43 +38,297 @@ class SigrunConstruct(Construct):
                 "You must expose your Discord application pub key as an environment variable named APPLICATION_PUBLIC_KEY"
             )
 
+        # build_lambda_zip.py --layer splits third-party packages into a layer
+        artifact_root = Path(sigrun.__file__).resolve().parents[1]
+        layers = []
+        if (artifact_root / "sigrun-layer.zip").exists():
+            layers.append(
+                lambda_.LayerVersion(
+                    self,
+                    "DependenciesLayer",
+                    code=lambda_.Code.from_asset(
+                        str(artifact_root / "sigrun-layer.zip")
+                    ),
+                    compatible_runtimes=[lambda_.Runtime.PYTHON_3_10],
+                )
+            )
+
+        inventory_table = dynamodb.Table(
+            self,
+            "InventoryTable",
+            partition_key=dynamodb.Attribute(
+                name="instance_id", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+        )
+        # Every Lambda needs to know which regions the fleet spans
+        region_environment = {}
+        if os.environ.get("SIGRUN_REGIONS"):
+            region_environment["SIGRUN_REGIONS"] = os.environ["SIGRUN_REGIONS"]
+        # Readers trust the inventory for a few sweeps, see sigrun/cloud/inventory.py
+        reconcile_interval = Duration.minutes(5)
+        inventory_environment = {
+            "SIGRUN_INVENTORY": f"dynamodb:{inventory_table.table_name}",
+            "INVENTORY_RECONCILE_INTERVAL_SECONDS": str(
+                int(reconcile_interval.to_seconds())
+            ),
+            **region_environment,
+        }
+
+        # Conditional writes here dedupe retried interactions and coalesce
+        # identical deferred commands, see sigrun/cloud/idempotency.py
+        idempotency_table = dynamodb.Table(
+            self,
+            "IdempotencyTable",
+            partition_key=dynamodb.Attribute(
+                name="key", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+        )
+
+        # Interactions waiting to hear that the servers they started are up
+        notification_table = dynamodb.Table(
+            self,
+            "NotificationTable",
+            partition_key=dynamodb.Attribute(
+                name="instance_id", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+        )
+        notification_environment = {
+            "SIGRUN_NOTIFICATIONS": f"dynamodb:{notification_table.table_name}"
+        }
+
+        world_bucket = s3.Bucket(
+            self,
+            "WorldBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            lifecycle_rules=[s3.LifecycleRule(expiration=Duration.days(7))],
+            removal_policy=RemovalPolicy.RETAIN,
+        )
+
+        # Game servers run with this role so Sigrun can reach them over SSM
+        server_role = iam.Role(
+            self,
+            "GameServerRole",
+            assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "AmazonSSMManagedInstanceCore"
+                )
+            ],
+        )
+        world_bucket.grant_put(server_role)
+        # The player agent publishes its roster as tags on its own server
+        server_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["ec2:CreateTags"],
+                resources=["*"],
+                conditions={
+                    "StringLike": {"ec2:ResourceTag/sigrun": "*"},
+                    "ForAllValues:StringEquals": {
+                        "aws:TagKeys": ["sigrun-players", "sigrun-player-names"]
+                    },
+                },
+            )
+        )
+        server_instance_profile = iam.CfnInstanceProfile(
+            self, "GameServerInstanceProfile", roles=[server_role.role_name]
+        )
+
         deferred_handler = lambda_.Function(
             self,
             "DeferredLambdaHandler",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset(
-                str(Path(sigrun.__file__).resolve().parents[1] / "sigrun.zip")
-            ),
+            code=lambda_.Code.from_asset(str(artifact_root / "sigrun.zip")),
+            layers=layers,
             handler="deferred.main",
             timeout=Duration.minutes(5),
             log_retention=logs.RetentionDays.TWO_WEEKS,
+            environment={
+                "WORLD_BUCKET": world_bucket.bucket_name,
+                "WORLD_BUCKET_REGION": world_bucket.env.region,
+                "SERVER_INSTANCE_PROFILE": server_instance_profile.ref,
+                "SIGRUN_RESOURCE_CACHE": "ssm",
+                "SIGRUN_IDEMPOTENCY": f"dynamodb:{idempotency_table.table_name}",
+                **inventory_environment,
+                **notification_environment,
+            },
         )
 
         initial_handler = lambda_.Function(
             self,
             "DiscordLambdaHandler",
             runtime=lambda_.Runtime.PYTHON_3_10,
-            code=lambda_.Code.from_asset(
-                str(Path(sigrun.__file__).resolve().parents[1] / "sigrun.zip")
-            ),
+            code=lambda_.Code.from_asset(str(artifact_root / "sigrun.zip")),
+            layers=layers,
             handler="initial.main",
             timeout=Duration.seconds(10),
             log_retention=logs.RetentionDays.TWO_WEEKS,
-            environment={"DEFERRED_LAMBDA_NAME": deferred_handler.function_name},
+            environment={
+                "DEFERRED_LAMBDA_NAME": deferred_handler.function_name,
+                **inventory_environment,
+            },
+        )
+
+        inventory_handler = lambda_.Function(
+            self,
+            "InventoryLambdaHandler",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(str(artifact_root / "sigrun.zip")),
+            layers=layers,
+            handler="inventory.main",
+            timeout=Duration.minutes(1),
+            log_retention=logs.RetentionDays.TWO_WEEKS,
+            environment={**inventory_environment, **notification_environment},
+        )
+
+        events.Rule(
+            self,
+            "InstanceStateChangeRule",
+            event_pattern=events.EventPattern(
+                source=["aws.ec2"],
+                detail_type=["EC2 Instance State-change Notification"],
+            ),
+            targets=[targets.LambdaFunction(inventory_handler)],
+        )
+        watchdog_handler = lambda_.Function(
+            self,
+            "WatchdogLambdaHandler",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(str(artifact_root / "sigrun.zip")),
+            layers=layers,
+            handler="watchdog.main",
+            timeout=Duration.minutes(2),
+            log_retention=logs.RetentionDays.TWO_WEEKS,
+            environment={
+                "WATCHDOG_WEBHOOK_URL": os.environ.get("WATCHDOG_WEBHOOK_URL", ""),
+                **region_environment,
+            },
+        )
+        events.Rule(
+            self,
+            "WatchdogRule",
+            schedule=events.Schedule.rate(Duration.minutes(15)),
+            targets=[targets.LambdaFunction(watchdog_handler)],
+        )
+
+        # Keeps the games' warm pools of spare servers topped up
+        pool_handler = lambda_.Function(
+            self,
+            "PoolLambdaHandler",
+            runtime=lambda_.Runtime.PYTHON_3_10,
+            code=lambda_.Code.from_asset(str(artifact_root / "sigrun.zip")),
+            layers=layers,
+            handler="pool.main",
+            timeout=Duration.minutes(2),
+            log_retention=logs.RetentionDays.TWO_WEEKS,
+            environment={
+                "SERVER_INSTANCE_PROFILE": server_instance_profile.ref,
+                "SIGRUN_RESOURCE_CACHE": "ssm",
+                "SIGRUN_IDEMPOTENCY": f"dynamodb:{idempotency_table.table_name}",
+                **region_environment,
+            },
+        )
+        events.Rule(
+            self,
+            "PoolRule",
+            schedule=events.Schedule.rate(Duration.minutes(10)),
+            targets=[targets.LambdaFunction(pool_handler)],
+        )
+
+        events.Rule(
+            self,
+            "InventoryReconcileRule",
+            schedule=events.Schedule.rate(reconcile_interval),
+            targets=[targets.LambdaFunction(inventory_handler)],
         )
 
         describe_instances_policy = iam.PolicyStatement(
             actions=[
                 "ec2:DescribeInstances",
+                "ec2:DescribeImages",
+                "ec2:DescribeInstanceTypes",
                 "ec2:StartInstances",
                 "ec2:StopInstances",
                 "ec2:RunInstances",
                 "ec2:CreateTags",
                 "ec2:DeleteTags",
+                "ec2:ModifyInstanceAttribute",
+            ],
+            resources=["*"],
+        )
+
+        # Cheap read-only commands are answered inline by the initial handler
+        read_instances_policy = iam.PolicyStatement(
+            actions=["ec2:DescribeInstances"],
+            resources=["*"],
+        )
+
+        copy_world_policy = iam.PolicyStatement(
+            actions=["ssm:SendCommand", "ssm:GetCommandInvocation"],
+            resources=["*"],
+        )
+
+        # Per-game security groups are reconciled on cache misses, and their
+        # IDs cached in Parameter Store
+        infrastructure_policy = iam.PolicyStatement(
+            actions=[
+                "ec2:DescribeSecurityGroups",
+                "ec2:CreateSecurityGroup",
+                "ec2:AuthorizeSecurityGroupIngress",
+                "ec2:RevokeSecurityGroupIngress",
+            ],
+            resources=["*"],
+        )
+        resource_cache_policy = iam.PolicyStatement(
+            actions=[
+                "ssm:GetParameter",
+                "ssm:PutParameter",
+                "ssm:DeleteParameter",
+            ],
+            resources=[
+                self.format_arn(
+                    service="ssm", resource="parameter", resource_name="sigrun/cache/*"
+                )
+            ],
+        )
+
+        # Servers in other regions are installed on the stock Ubuntu image there
+        base_image_policy = iam.PolicyStatement(
+            actions=["ssm:GetParameter"],
+            resources=["arn:aws:ssm:*::parameter/aws/service/canonical/*"],
+        )
+
+        watchdog_policy = iam.PolicyStatement(
+            actions=[
+                "ec2:DescribeInstances",
+                "ec2:StopInstances",
+                "ec2:DeleteTags",
+                "cloudwatch:GetMetricData",
             ],
             resources=["*"],
         )
 
+        pool_policy = iam.PolicyStatement(
+            actions=[
+                "ec2:DescribeInstances",
+                "ec2:DescribeImages",
+                "ec2:DescribeInstanceTypes",
+                "ec2:RunInstances",
+                "ec2:CreateTags",
+            ],
+            resources=["*"],
+        )
+        # Only spares are ever retired
+        retire_spares_policy = iam.PolicyStatement(
+            actions=["ec2:TerminateInstances"],
+            resources=["*"],
+            conditions={"StringLike": {"ec2:ResourceTag/sigrun-pool": "*"}},
+        )
+
         lambda_integration = apigateway_integrations.HttpLambdaIntegration(
             "HttpLambdaIntegration", handler=initial_handler
         )
@@ -84,4 +342,26 @@ class SigrunConstruct(Construct):
 
         secret.grant_read(initial_handler.role)
         deferred_handler.grant_invoke(initial_handler)
+        initial_handler.add_to_role_policy(read_instances_policy)
+        inventory_handler.add_to_role_policy(read_instances_policy)
+        watchdog_handler.add_to_role_policy(watchdog_policy)
+        inventory_table.grant_read_write_data(initial_handler)
+        inventory_table.grant_read_write_data(deferred_handler)
+        inventory_table.grant_read_write_data(inventory_handler)
+        idempotency_table.grant_read_write_data(deferred_handler)
+        notification_table.grant_read_write_data(deferred_handler)
+        notification_table.grant_read_write_data(inventory_handler)
         deferred_handler.add_to_role_policy(describe_instances_policy)
+        deferred_handler.add_to_role_policy(copy_world_policy)
+        deferred_handler.add_to_role_policy(base_image_policy)
+        deferred_handler.add_to_role_policy(infrastructure_policy)
+        deferred_handler.add_to_role_policy(resource_cache_policy)
+        world_bucket.grant_read(deferred_handler)
+        server_role.grant_pass_role(deferred_handler)
+        idempotency_table.grant_read_write_data(pool_handler)
+        pool_handler.add_to_role_policy(pool_policy)
+        pool_handler.add_to_role_policy(retire_spares_policy)
+        pool_handler.add_to_role_policy(base_image_policy)
+        pool_handler.add_to_role_policy(infrastructure_policy)
+        pool_handler.add_to_role_policy(resource_cache_policy)
+        server_role.grant_pass_role(pool_handler)
@@ -1,33 +1,47 @@
 import pprint
 from loguru import logger
-import httpx
 
-from sigrun.model.messenger import set_messenger
+from sigrun import telemetry
+from sigrun.cloud import idempotency
+from sigrun.model.messenger import (
+    Interaction,
+    WebhookMessenger,
+    set_interaction,
+    set_messenger,
+)
 from sigrun.commands import COMMANDS
 
+telemetry.install_emf_sink()
+
 
 def main(event, context):
     """The handler for deferred commands placed on the SQS queue.
     This is for longer-running activities.
     """
-    logger.info(f"Event is {event}")
+    if telemetry.sampled():
+        logger.info(f"Event is {event}")
     command_name = event["command"]
     application_id = event["application_id"]
     interaction_token = event["interaction_token"]
     options = event["options"]
 
-    set_messenger(
-        lambda content: send_followup(content, application_id, interaction_token)
-    )
+    telemetry.begin(command_name)
+    messenger = WebhookMessenger(application_id, interaction_token)
+    set_messenger(messenger)
+    set_interaction(Interaction(application_id, interaction_token))
 
     command = COMMANDS.get(command_name)
 
     logger.info("Command: " + command_name)
     logger.info("Options: " + pprint.pformat(options))
-    command(**options).handler()
-
-
-def send_followup(content: str, application_id: str, interaction_token: str):
-    url = f"https://discord.com/api/v10/webhooks/{application_id}/{interaction_token}"
-    r = httpx.post(url, data={"content": content})
-    logger.info(f"Https response: {r}")
+    try:
+        with telemetry.span("dispatch"), telemetry.profiled(command_name):
+            # Drops repeats of this interaction and shares the run with
+            # identical requests already in flight
+            idempotency.run_once(
+                command, event, lambda: command(**options).handler()
+            )
+    finally:
+        # Anything still buffered must go out before the Lambda freezes.
+        messenger.flush()
+        telemetry.flush()
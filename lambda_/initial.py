@@ -1,20 +1,104 @@
+import time
+
+IMPORT_START = time.perf_counter()
+
+import contextvars
+import functools
 import json
 import os
 import pprint
+import threading
 
-import boto3
 from aws_lambda_typing import events
 from loguru import logger
 from nacl.exceptions import BadSignatureError
 from nacl.signing import VerifyKey
 
-from sigrun.commands import COMMANDS
-
-secrets_manager = boto3.client("secretsmanager")
-lambda_client = boto3.client("lambda")
+from sigrun import telemetry
 
 CHANNEL_MESSAGE_WITH_SOURCE = 4
+DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE = 5
 PING_TYPE = 1
+MAX_MESSAGE_LENGTH = 2000
+
+# Commands whose expected cost is at most this are run inline. They must
+# finish within INLINE_DEADLINE_SECONDS of the request arriving, which leaves
+# headroom under Discord's 3 second limit to fall back to deferring them.
+INLINE_MAX_COST = os.environ.get("INLINE_MAX_COST", "MODERATE").upper()
+INLINE_DEADLINE_SECONDS = float(os.environ.get("INLINE_DEADLINE_SECONDS", 2.0))
+
+# Set SIGRUN_EAGER_INIT to build AWS clients and import the commands during
+# the Lambda init phase, e.g. under provisioned concurrency. By default
+# everything is deferred until the first request that needs it.
+EAGER_INIT = os.environ.get("SIGRUN_EAGER_INIT", "").lower() in ("1", "true")
+
+# How long the application public key is trusted before it's fetched again, and
+# the minimum gap between refreshes forced by a failed signature check. The
+# latter keeps a stream of bad signatures from hammering Secrets Manager.
+PUBLIC_KEY_TTL_SECONDS = float(os.environ.get("PUBLIC_KEY_TTL_SECONDS", 3600))
+PUBLIC_KEY_MIN_REFRESH_SECONDS = float(
+    os.environ.get("PUBLIC_KEY_MIN_REFRESH_SECONDS", 60)
+)
+
+# Milliseconds spent importing this module and building each lazy resource.
+init_timings = {}
+cold_start = True
+
+
+def timed_init(name: str):
+    """Memoize a resource factory and record how long it took to build."""
+
+    def decorator(factory):
+        @functools.cache
+        @functools.wraps(factory)
+        def wrapper():
+            start = time.perf_counter()
+            resource = factory()
+            init_timings[name] = round((time.perf_counter() - start) * 1000, 2)
+            return resource
+
+        return wrapper
+
+    return decorator
+
+
+@timed_init("secrets_manager_ms")
+def get_secrets_manager():
+    import boto3
+
+    return telemetry.instrument(boto3.client("secretsmanager"))
+
+
+@timed_init("lambda_client_ms")
+def get_lambda_client():
+    import boto3
+
+    return telemetry.instrument(boto3.client("lambda"))
+
+
+@timed_init("commands_import_ms")
+def get_commands() -> dict:
+    from sigrun.commands import COMMANDS
+
+    return COMMANDS
+
+
+def log_init_timings(request_type: str):
+    """Emit one structured line per cold start describing where init time went."""
+    global cold_start
+    if not cold_start:
+        return
+    cold_start = False
+    logger.info(
+        json.dumps(
+            {
+                "event": "sigrun_init",
+                "eager_init": EAGER_INIT,
+                "request_type": request_type,
+                **init_timings,
+            }
+        )
+    )
 
 
 # Context object
@@ -24,27 +108,39 @@ def main(event: events.APIGatewayProxyEventV2, context):
     This is invoked for any `ANY \`. In other words, any request to
     the API flows through this method, but we assume the shape Discord
     emits."""
-    logger.info(f"Received an event!: {event}")
+    telemetry.begin()
+    try:
+        return handle(event)
+    finally:
+        telemetry.flush()
+
+
+def handle(event: events.APIGatewayProxyEventV2):
+    request_start = time.perf_counter()
+    if telemetry.sampled():
+        logger.info(f"Received an event!: {event}")
 
     headers = event["headers"]
     raw_body = event["body"]
     body = json.loads(raw_body)
-    logger.info(f"Headers: {headers}")
-    logger.info(f"Message body: {body}")
 
-    if not validate_signature(
-        headers["x-signature-ed25519"], headers["x-signature-timestamp"], raw_body
-    ):
+    with telemetry.span("signature"):
+        valid = validate_signature(
+            headers["x-signature-ed25519"], headers["x-signature-timestamp"], raw_body
+        )
+    if not valid:
         logger.warning("Signature not valid.")
         return {"statusCode": 401}
     logger.info("Signature valid.")
 
     if body["type"] == PING_TYPE:
         logger.info("Acking a ping.")
+        log_init_timings("ping")
         return build_response(200, {"type": PING_TYPE})
 
     command_name = body["data"]["name"]
-    command = COMMANDS.get(command_name)
+    telemetry.set_command(command_name)
+    command = get_commands().get(command_name)
     if command is None:
         logger.error(f"Command {command_name} is not supported.")
         return {"statusCode": 400}
@@ -57,46 +153,159 @@ def main(event: events.APIGatewayProxyEventV2, context):
 
     logger.info("Command: " + command_name)
     logger.info("Options: " + pprint.pformat(options))
-    # TODO: The EC2 implementation is much faster, try
-    #       calling directly again insted of deferring
-    invoke_deferred(
-        {
-            "command": command_name,
-            "application_id": body["application_id"],
-            "interaction_id": body["id"],
-            "interaction_token": body["token"],
-            "options": options,
-        }
-    )
 
-    return build_response(200, {"type": 5})
+    if is_inline(command):
+        deadline = request_start + INLINE_DEADLINE_SECONDS
+        with telemetry.span("dispatch"):
+            content = run_inline(command, options, deadline)
+        if content is not None:
+            log_init_timings("inline_command")
+            return build_response(
+                200,
+                {"type": CHANNEL_MESSAGE_WITH_SOURCE, "data": {"content": content}},
+            )
+        logger.info(f"Falling back to deferring {command_name}.")
+
+    with telemetry.span("dispatch"):
+        invoke_deferred(
+            {
+                "command": command_name,
+                "application_id": body["application_id"],
+                "interaction_id": body["id"],
+                "interaction_token": body["token"],
+                "options": options,
+            }
+        )
+    log_init_timings("command")
+
+    return build_response(200, {"type": DEFERRED_CHANNEL_MESSAGE_WITH_SOURCE})
+
+
+def is_inline(command) -> bool:
+    from sigrun.commands.base import Cost
+
+    return command.get_expected_cost() <= Cost[INLINE_MAX_COST]
+
+
+class InlineStopped(Exception):
+    """Raised out of the messenger to stop an inline command whose output can no
+    longer be sent inline, so it doesn't keep working for nothing."""
+
+
+def run_inline(command, options: dict, deadline: float):
+    """Run a command on a worker thread, collecting what it sends to the messenger.
+    Returns the collected content, or None if the command failed, missed the
+    deadline, or produced more than fits in a single message. The command is
+    stopped at its next message once its output overflows, and at its next
+    message or AWS call once it's missed the deadline. It has its own messenger
+    and deadline so they can't leak into later requests."""
+    from sigrun.cloud.concurrency import set_deadline
+    from sigrun.exceptions import DeadlineExceededError
+    from sigrun.model.messenger import set_messenger
+
+    messages = []
+    errors = []
+    abandoned = threading.Event()
+    length = 0
+
+    def collect(message: str):
+        nonlocal length
+        if abandoned.is_set():
+            raise InlineStopped("abandoned after missing its deadline")
+        length += len(message) + (1 if messages else 0)
+        messages.append(message)
+        if length > MAX_MESSAGE_LENGTH:
+            raise InlineStopped("output doesn't fit in a single message")
+
+    def target():
+        set_messenger(collect)
+        set_deadline(deadline)
+        try:
+            with telemetry.profiled(command.get_discord_name()):
+                command(**options).handler()
+        except Exception as e:
+            errors.append(e)
+
+    context = contextvars.copy_context()
+    worker = threading.Thread(target=context.run, args=(target,), daemon=True)
+    worker.start()
+    worker.join(max(deadline - time.perf_counter(), 0))
+
+    if worker.is_alive():
+        abandoned.set()
+        logger.warning("Inline command missed its deadline.")
+        return None
+    if errors and isinstance(errors[0], (InlineStopped, DeadlineExceededError)):
+        logger.info(f"Inline command stopped: {errors[0]}.")
+        return None
+    if errors:
+        logger.opt(exception=errors[0]).error("Inline command failed.")
+        return None
+
+    content = "\n".join(messages)
+    if not content:
+        return None
+    return content
 
 
 def invoke_deferred(payload: dict):
-    logger.info(f"Invoking deferred handler with {payload}")
+    logger.info(f"Invoking deferred handler for {payload['command']}")
     deferred_function_name = os.environ.get("DEFERRED_LAMBDA_NAME")
-    lambda_client.invoke(
+    get_lambda_client().invoke(
         FunctionName=deferred_function_name,
         InvocationType="Event",
         Payload=json.dumps(payload).encode("utf-8"),
     )
 
 
+verify_key_cache = {"key": None, "fetched_at": 0.0}
+
+
 def validate_signature(signature: str, timestamp: str, body: str):
-    verify_key = VerifyKey(bytes.fromhex(get_application_public_key()))
+    message = f"{timestamp}{body}".encode()
     try:
-        verify_key.verify(f"{timestamp}{body}".encode(), bytes.fromhex(signature))
+        signature_bytes = bytes.fromhex(signature)
+    except ValueError:
+        return False
+
+    if verify(get_verify_key(), message, signature_bytes):
+        return True
+
+    # The key may have been rotated since we cached it. Refresh once and retry.
+    since_fetch = time.monotonic() - verify_key_cache["fetched_at"]
+    if since_fetch < PUBLIC_KEY_MIN_REFRESH_SECONDS:
+        return False
+    logger.info("Signature check failed against the cached key, refreshing it.")
+    return verify(get_verify_key(refresh=True), message, signature_bytes)
+
+
+def verify(verify_key: VerifyKey, message: bytes, signature: bytes) -> bool:
+    try:
+        verify_key.verify(message, signature)
         return True
     except BadSignatureError:
         return False
 
 
+def get_verify_key(refresh: bool = False) -> VerifyKey:
+    """The application's VerifyKey, cached for the life of the process until it
+    expires or a refresh is requested."""
+    now = time.monotonic()
+    expired = now - verify_key_cache["fetched_at"] >= PUBLIC_KEY_TTL_SECONDS
+    if refresh or expired or verify_key_cache["key"] is None:
+        verify_key_cache["key"] = VerifyKey(
+            bytes.fromhex(get_application_public_key())
+        )
+        verify_key_cache["fetched_at"] = now
+    return verify_key_cache["key"]
+
+
 def get_application_public_key():
-    secret_string = json.loads(
-        secrets_manager.get_secret_value(SecretId="APPLICATION_PUBLIC_KEY")[
-            "SecretString"
-        ]
-    )
+    with telemetry.span("secret_fetch"):
+        secret = get_secrets_manager().get_secret_value(
+            SecretId="APPLICATION_PUBLIC_KEY"
+        )
+    secret_string = json.loads(secret["SecretString"])
     return secret_string["APPLICATION_PUBLIC_KEY"]
 
 
@@ -110,5 +319,15 @@ def build_response(status_code: int, body: dict):
         "body": json.dumps(body),
     }
 
-    logger.info(f"Response object: {response}")
+    if telemetry.sampled():
+        logger.info(f"Response object: {response}")
     return response
+
+
+telemetry.install_emf_sink()
+init_timings["import_ms"] = round((time.perf_counter() - IMPORT_START) * 1000, 2)
+
+if EAGER_INIT:
+    get_verify_key()
+    get_lambda_client()
+    get_commands()
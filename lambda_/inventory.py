@@ -0,0 +1,23 @@
+from loguru import logger
+
+from sigrun.cloud import inventory, notifications
+
+STATE_CHANGE_TYPE = "EC2 Instance State-change Notification"
+
+
+def main(event, context):
+    """The handler that keeps the server inventory current. It's invoked by
+    EventBridge for every EC2 state change, and on a schedule to reconcile the
+    whole fleet in case an event was missed. Either way, servers that came up
+    are announced to whoever started them."""
+    logger.info(f"Event is {event}")
+
+    if event.get("detail-type") == STATE_CHANGE_TYPE:
+        instance_id = event["detail"]["instance-id"]
+        logger.info(f"{instance_id} is now {event['detail']['state']}.")
+        record = inventory.refresh_instance(instance_id, event.get("region"))
+        if record is not None and event["detail"]["state"] == "running":
+            notifications.notify_ready([record])
+        return
+
+    notifications.notify_ready(inventory.reconcile())
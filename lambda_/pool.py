@@ -0,0 +1,9 @@
+from loguru import logger
+
+from sigrun.cloud import pool
+
+
+def main(event, context):
+    """The handler for the scheduled warm pool top-up."""
+    logger.info(f"Event is {event}")
+    pool.replenish()
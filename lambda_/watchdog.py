@@ -0,0 +1,23 @@
+import os
+
+from loguru import logger
+
+from sigrun import watchdog
+from sigrun.model.messenger import post_with_rate_limit, split_message
+
+
+def main(event, context):
+    """The handler for the scheduled idle-shutdown sweep. A summary of stopped
+    servers is posted to the Discord channel webhook in WATCHDOG_WEBHOOK_URL,
+    if one is configured."""
+    logger.info(f"Event is {event}")
+    summary = watchdog.sweep()
+    if not summary:
+        return
+
+    content = "I stopped these servers to save you money:\n" + "\n".join(summary)
+    logger.info(content)
+    webhook_url = os.environ.get("WATCHDOG_WEBHOOK_URL")
+    if webhook_url:
+        for chunk in split_message(content):
+            post_with_rate_limit(webhook_url, {"content": chunk})
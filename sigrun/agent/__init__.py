@@ -0,0 +1,132 @@
+"""Installing the on-server player activity agent and reading what it
+publishes. The agent itself is `player_agent.py`, which is shipped to servers
+in their user data."""
+
+import base64
+import gzip
+import json
+from concurrent.futures import wait
+from importlib import resources
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from sigrun.cloud import concurrency, ec2
+from sigrun.cloud.ec2 import ServerRecord
+from sigrun.cloud.session import default_region
+from sigrun.model.game import Game
+
+AGENT_ROOT = "/opt/sigrun"
+QUERY_TIMEOUT_SECONDS = 1.0
+# How much of a command's deadline is left for it once the rosters are in
+QUERY_RESERVE_SECONDS = 0.25
+# The tags agents publish their rosters to. They must match player_agent.py.
+PLAYERS_TAG = "sigrun-players"
+PLAYER_NAMES_TAG = "sigrun-player-names"
+NAME_SEPARATOR = ", "
+
+
+def render_installer(game: Game, server_name: str) -> str:
+    """Shell that installs the agent as a systemd service, or nothing if the
+    game doesn't say how to read its logs. The agent is compressed to keep user
+    data under EC2's size limit."""
+    if game.player_log is None:
+        return ""
+
+    source = resources.read_binary("sigrun.agent", "player_agent.py")
+    encoded = base64.b64encode(gzip.compress(source)).decode()
+    config = json.dumps(
+        {
+            "path": game.player_log.path.replace("{server_name}", server_name),
+            "join": game.player_log.join,
+            "leave": game.player_log.leave,
+        }
+    )
+    return f"""echo ">>> Installing the Sigrun player agent <<<"
+mkdir -p {AGENT_ROOT}
+echo {encoded} | base64 -d | gunzip > {AGENT_ROOT}/player_agent.py
+cat <<'EOF' > {AGENT_ROOT}/player_agent.json
+{config}
+EOF
+cat <<'EOF' > /etc/systemd/system/sigrun-player-agent.service
+[Unit]
+Description=Sigrun player activity agent
+
+[Service]
+Type=simple
+ExecStart=/usr/bin/python3 {AGENT_ROOT}/player_agent.py {AGENT_ROOT}/player_agent.json
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+EOF
+systemctl daemon-reload
+systemctl enable --now sigrun-player-agent.service"""
+
+
+def get_players(
+    servers: List[ServerRecord], games: Dict[str, Game], refresh: bool = True
+) -> Dict[str, dict]:
+    """The agent's roster for each running server that has one, keyed by
+    instance ID. Agents publish their rosters as tags on their own instance.
+    The inventory doesn't hear about tag changes, so unless the servers were
+    just described the tags are read afresh. Regions that don't answer quickly
+    are left out."""
+    queryable = [
+        server
+        for server in servers
+        if server.state == "running"
+        and server.game in games
+        and games[server.game].player_log is not None
+    ]
+    if not queryable:
+        return {}
+    if not refresh:
+        return read_rosters(queryable)
+
+    # A command with a deadline, e.g. one run inline, keeps enough of it back
+    # to answer with. Without the time to spare the counts are skipped.
+    timeout = (
+        concurrency.remaining(QUERY_TIMEOUT_SECONDS * 2 + QUERY_RESERVE_SECONDS)
+        - QUERY_RESERVE_SECONDS
+    )
+    if timeout <= 0:
+        logger.info("No time left to read the player rosters.")
+        return {}
+
+    futures = [
+        concurrency.submit(ec2.describe_by_id, ids, region or default_region())
+        for region, ids in ec2.group_by_region(queryable).items()
+    ]
+    done, not_done = wait(futures, timeout=timeout)
+    for future in not_done:
+        future.cancel()
+    if not_done:
+        logger.info(f"{len(not_done)} regions didn't answer with rosters in time.")
+    rosters = {}
+    for future in done:
+        if future.exception() is not None:
+            logger.debug(f"Couldn't read player rosters: {future.exception()}")
+            continue
+        rosters.update(read_rosters(future.result()))
+    return rosters
+
+
+def read_rosters(servers: List[ServerRecord]) -> Dict[str, dict]:
+    rosters = {}
+    for server in servers:
+        roster = read_roster(server.tags)
+        if roster is not None:
+            rosters[server.instance_id] = roster
+    return rosters
+
+
+def read_roster(tags: Dict[str, str]) -> Optional[dict]:
+    """The roster an agent published to its instance's tags, if it has."""
+    if PLAYERS_TAG not in tags:
+        return None
+    names = tags.get(PLAYER_NAMES_TAG, "")
+    return {
+        "count": int(tags[PLAYERS_TAG]),
+        "players": names.split(NAME_SEPARATOR) if names else [],
+    }
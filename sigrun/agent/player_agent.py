@@ -0,0 +1,274 @@
+"""Sigrun's on-server player activity agent.
+
+This runs on the game server itself, so it only uses the standard library. It
+tails the game's log incrementally, keeps a roster of connected players, and
+publishes it as tags on its own instance whenever it changes:
+
+    sigrun-players = "2", sigrun-player-names = "alice, bob"
+
+Sigrun reads them along with the rest of the instance, so nothing on the
+server listens on the network and the roster is only visible in the account.
+The tags are written with the server's instance profile, signed by hand.
+
+Byte offsets and the roster are persisted after every batch of lines, so a
+restarted agent resumes where it left off instead of re-scanning the log. A
+log that shrinks, or a newer log file matching the configured glob, means the
+game restarted and the roster is cleared.
+
+The config is a JSON file with the game's `player_log` metadata:
+    {"path": "<log path or glob>", "join": "<regex>", "leave": "<regex>"}
+The join and leave regexes must capture an `id` group and may capture `name`.
+"""
+
+import datetime
+import glob
+import hashlib
+import hmac
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+STATE_PATH = "/var/lib/sigrun/player_agent_state.json"
+POLL_SECONDS = 2.0
+READ_CHUNK_BYTES = 1 << 20
+
+# These must match sigrun.agent
+PLAYERS_TAG = "sigrun-players"
+PLAYER_NAMES_TAG = "sigrun-player-names"
+NAME_SEPARATOR = ", "
+MAX_TAG_VALUE_LENGTH = 256
+
+METADATA_URL = "http://169.254.169.254/latest"
+EC2_API_VERSION = "2016-11-15"
+REQUEST_TIMEOUT_SECONDS = 5.0
+
+
+class Roster:
+
+    def __init__(self, players=None):
+        self.players = dict(players or {})
+
+    def join(self, player_id, name):
+        self.players[player_id] = name or self.players.get(player_id) or player_id
+
+    def leave(self, player_id):
+        self.players.pop(player_id, None)
+
+    def clear(self):
+        self.players = {}
+
+    def tags(self):
+        """The roster as instance tags. Names that don't fit in a tag are cut."""
+        names = NAME_SEPARATOR.join(sorted(self.players.values()))
+        return {
+            PLAYERS_TAG: str(len(self.players)),
+            PLAYER_NAMES_TAG: names[:MAX_TAG_VALUE_LENGTH],
+        }
+
+
+class LogTailer:
+
+    def __init__(self, config, roster, state):
+        self.pattern = config["path"]
+        self.join = re.compile(config["join"])
+        self.leave = re.compile(config["leave"])
+        self.roster = roster
+        self.path = state.get("path")
+        self.offset = state.get("offset", 0)
+        self.partial = b""
+
+    def current_log(self):
+        matches = glob.glob(self.pattern)
+        return max(matches, key=os.path.getmtime) if matches else None
+
+    def poll(self) -> bool:
+        """Read whatever was appended since the last poll. Returns whether
+        anything was consumed."""
+        path = self.current_log()
+        if path is None:
+            return False
+        size = os.path.getsize(path)
+        if path != self.path or size < self.offset:
+            # A new or truncated log means the server restarted
+            self.path, self.offset, self.partial = path, 0, b""
+            self.roster.clear()
+        if size == self.offset:
+            return False
+
+        with open(path, "rb") as f:
+            f.seek(self.offset)
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                lines = (self.partial + chunk).split(b"\n")
+                self.partial = lines.pop()
+                for line in lines:
+                    self.parse(line.decode("utf-8", errors="replace"))
+        return True
+
+    def parse(self, line):
+        match = self.join.search(line)
+        if match:
+            self.roster.join(match.group("id"), match.groupdict().get("name"))
+            return
+        match = self.leave.search(line)
+        if match:
+            self.roster.leave(match.group("id"))
+
+    def state(self):
+        # Offsets only count whole lines, so a partial line is re-read on resume
+        return {
+            "path": self.path,
+            "offset": self.offset - len(self.partial),
+            "players": self.roster.players,
+        }
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    temporary = STATE_PATH + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(state, f)
+    os.replace(temporary, STATE_PATH)
+
+
+class Publisher:
+    """Writes the roster to the instance's tags when it's changed since it was
+    last written. A failed write is retried on the next poll."""
+
+    def __init__(self):
+        self.published = None
+
+    def publish(self, roster):
+        tags = roster.tags()
+        if tags == self.published:
+            return
+        try:
+            token = metadata_token()
+            create_tags(
+                get_metadata("meta-data/instance-id", token),
+                get_metadata("meta-data/placement/region", token),
+                tags,
+                get_credentials(token),
+            )
+            self.published = tags
+        except (OSError, ValueError) as e:
+            print(f"Couldn't publish the roster: {e}", file=sys.stderr)
+
+
+def metadata_token():
+    request = urllib.request.Request(
+        f"{METADATA_URL}/api/token",
+        method="PUT",
+        headers={"X-aws-ec2-metadata-token-ttl-seconds": "300"},
+    )
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_SECONDS) as r:
+        return r.read().decode()
+
+
+def get_metadata(path, token):
+    request = urllib.request.Request(
+        f"{METADATA_URL}/{path}", headers={"X-aws-ec2-metadata-token": token}
+    )
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_SECONDS) as r:
+        return r.read().decode()
+
+
+def get_credentials(token):
+    """The instance profile's temporary credentials."""
+    path = "meta-data/iam/security-credentials/"
+    role = get_metadata(path, token).splitlines()[0]
+    return json.loads(get_metadata(path + role, token))
+
+
+def create_tags(instance_id, region, tags, credentials, now=None):
+    host = f"ec2.{region}.amazonaws.com"
+    params = {"Action": "CreateTags", "Version": EC2_API_VERSION}
+    params["ResourceId.1"] = instance_id
+    for i, (key, value) in enumerate(sorted(tags.items()), 1):
+        params[f"Tag.{i}.Key"] = key
+        params[f"Tag.{i}.Value"] = value
+    body = urllib.parse.urlencode(sorted(params.items()), quote_via=urllib.parse.quote)
+    headers = sign(
+        "POST", host, region, "ec2", body.encode(), credentials, now or time.time()
+    )
+    request = urllib.request.Request(
+        f"https://{host}/", data=body.encode(), headers=headers, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_SECONDS) as r:
+        r.read()
+
+
+def sign(method, host, region, service, body, credentials, now):
+    """Headers for an AWS Signature Version 4 request to the service's root."""
+    moment = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+    amz_date = moment.strftime("%Y%m%dT%H%M%SZ")
+    date = amz_date[:8]
+    headers = {
+        "content-type": "application/x-www-form-urlencoded; charset=utf-8",
+        "host": host,
+        "x-amz-date": amz_date,
+    }
+    if credentials.get("Token"):
+        headers["x-amz-security-token"] = credentials["Token"]
+    signed_headers = ";".join(sorted(headers))
+    canonical_request = "\n".join(
+        [
+            method,
+            "/",
+            "",
+            "".join(f"{key}:{headers[key]}\n" for key in sorted(headers)),
+            signed_headers,
+            hashlib.sha256(body).hexdigest(),
+        ]
+    )
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ]
+    )
+    key = ("AWS4" + credentials["SecretAccessKey"]).encode()
+    for part in (date, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    headers["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={credentials['AccessKeyId']}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return headers
+
+
+def main(config_path):
+    with open(config_path) as f:
+        config = json.load(f)
+    state = load_state()
+    roster = Roster(state.get("players"))
+    tailer = LogTailer(config, roster, state)
+    publisher = Publisher()
+    while True:
+        if tailer.poll():
+            save_state(tailer.state())
+        publisher.publish(roster)
+        time.sleep(POLL_SECONDS)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
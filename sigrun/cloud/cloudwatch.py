@@ -0,0 +1,82 @@
+"""Batched activity metrics for Sigrun's servers. Every instance's CPU and
+network samples are fetched with as few GetMetricData calls as the API's
+per-call query limit allows, rather than one call per server. Metrics are
+regional, so each call covers the instances of one region."""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sigrun.cloud.session import get_cloudwatch_client
+
+MAX_QUERIES_PER_CALL = 500
+PERIOD_SECONDS = 300  # Basic EC2 monitoring resolution
+
+
+@dataclass(slots=True)
+class Activity:
+    """Samples keyed by the start of their period."""
+
+    cpu_percent: Dict[datetime, float] = field(default_factory=dict)
+    network_in_bytes: Dict[datetime, float] = field(default_factory=dict)
+
+    def since(self, start: datetime) -> "Activity":
+        return Activity(
+            {t: v for t, v in self.cpu_percent.items() if t >= start},
+            {t: v for t, v in self.network_in_bytes.items() if t >= start},
+        )
+
+
+def get_activity(
+    instance_ids: List[str],
+    start: datetime,
+    end: datetime,
+    region: Optional[str] = None,
+) -> Dict[str, Activity]:
+    """CPU utilization and inbound network samples for each instance between
+    `start` and `end`, one sample per period."""
+    queries = []
+    for index, instance_id in enumerate(instance_ids):
+        queries.append(
+            metric_query(f"cpu{index}", instance_id, "CPUUtilization", "Average")
+        )
+        queries.append(metric_query(f"net{index}", instance_id, "NetworkIn", "Sum"))
+
+    activity = {instance_id: Activity() for instance_id in instance_ids}
+    for offset in range(0, len(queries), MAX_QUERIES_PER_CALL):
+        batch = queries[offset : offset + MAX_QUERIES_PER_CALL]
+        for result in get_metric_data(batch, start, end, region):
+            kind, index = result["Id"][:3], int(result["Id"][3:])
+            samples = activity[instance_ids[index]]
+            values = dict(zip(result["Timestamps"], result["Values"]))
+            if kind == "cpu":
+                samples.cpu_percent.update(values)
+            else:
+                samples.network_in_bytes.update(values)
+    return activity
+
+
+def get_metric_data(
+    queries: List[dict], start: datetime, end: datetime, region: Optional[str] = None
+):
+    paginator = get_cloudwatch_client(region).get_paginator("get_metric_data")
+    for page in paginator.paginate(
+        MetricDataQueries=queries, StartTime=start, EndTime=end
+    ):
+        yield from page["MetricDataResults"]
+
+
+def metric_query(query_id: str, instance_id: str, metric: str, stat: str) -> dict:
+    return {
+        "Id": query_id,
+        "MetricStat": {
+            "Metric": {
+                "Namespace": "AWS/EC2",
+                "MetricName": metric,
+                "Dimensions": [{"Name": "InstanceId", "Value": instance_id}],
+            },
+            "Period": PERIOD_SECONDS,
+            "Stat": stat,
+        },
+        "ReturnData": True,
+    }
@@ -0,0 +1,169 @@
+"""A shared thread pool for issuing independent AWS calls in parallel. boto3
+clients are thread safe, so handlers can fan out reads and join the results
+instead of paying for each round trip in turn.
+
+A command can also be given a deadline, e.g. when it's run inline and has to
+answer Discord in time. Every AWS client checks it before each call (and so
+before each page), and fan-out waits no longer than it, so a command that's
+out of time stops at its next call instead of working on for nothing. Calls
+submitted to the pool inherit the deadline of whoever submitted them.
+
+Fan-out nests, e.g. a gather whose calls each look across every region. A
+call already running on the pool runs whatever it submits itself, in turn,
+rather than queueing it behind the workers it may be holding up."""
+
+import contextvars
+import functools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+from sigrun.exceptions import DeadlineExceededError
+
+MAX_WORKERS = int(os.environ.get("SIGRUN_MAX_WORKERS", 8))
+DEFAULT_DEADLINE_SECONDS = 30.0
+
+# When the current command has to be done by, on the time.perf_counter clock
+deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+def set_deadline(value: Optional[float]):
+    deadline.set(value)
+
+
+def remaining(default: float) -> float:
+    """Seconds left before the deadline, capped at `default`. Never negative."""
+    value = deadline.get()
+    if value is None:
+        return default
+    return max(min(default, value - time.perf_counter()), 0.0)
+
+
+def check_deadline(**kwargs):
+    """Raise DeadlineExceededError if the current command is out of time. Takes
+    and ignores keyword arguments so it can be a botocore event handler."""
+    value = deadline.get()
+    if value is not None and time.perf_counter() >= value:
+        raise DeadlineExceededError("the command ran out of time")
+
+
+# Set on the pool's own threads
+worker = threading.local()
+
+
+def mark_worker():
+    worker.active = True
+
+
+def on_worker() -> bool:
+    return getattr(worker, "active", False)
+
+
+@functools.cache
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=MAX_WORKERS, thread_name_prefix="sigrun", initializer=mark_worker
+    )
+
+
+def submit(call: Callable[..., Any], *args, **kwargs) -> Future:
+    if on_worker():
+        # Every worker could be waiting on calls like this one, so queueing it
+        # could deadlock the pool
+        return run_now(call, *args, **kwargs)
+    # Run in a copy of the caller's context so the call sees its deadline
+    context = contextvars.copy_context()
+    return get_executor().submit(context.run, call, *args, **kwargs)
+
+
+def run_now(call: Callable[..., Any], *args, **kwargs) -> Future:
+    """Run a call on this thread and return its outcome as a finished future."""
+    future: Future = Future()
+    try:
+        future.set_result(call(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def gather(
+    *calls: Callable[[], Any], timeout: float = DEFAULT_DEADLINE_SECONDS
+) -> List[Any]:
+    """Run each call concurrently and return their results in order. Raises the
+    first call's exception if any failed, or TimeoutError if they didn't all
+    finish within `timeout` seconds, or before the deadline."""
+    futures = [submit(call) for call in calls]
+    timeout = remaining(timeout)
+    done, not_done = wait(futures, timeout=timeout)
+    if not_done:
+        for future in not_done:
+            future.cancel()
+        raise FutureTimeoutError(
+            f"{len(not_done)} of {len(futures)} calls missed their {timeout}s deadline."
+        )
+    return [future.result() for future in futures]
+
+
+def stream(
+    *producers: Callable[[], Iterable[Any]],
+    timeout: float = DEFAULT_DEADLINE_SECONDS,
+) -> Iterator[Any]:
+    """Run each producer concurrently and yield their items as they arrive,
+    interleaved in arrival order. Raises the first producer's exception, or
+    TimeoutError if nothing arrives for `timeout` seconds or before the deadline."""
+    if len(producers) == 1:
+        yield from producers[0]()
+        return
+
+    arrivals: queue.Queue = queue.Queue()
+    finished = object()
+
+    def drain(producer):
+        try:
+            for item in producer():
+                arrivals.put((item, None))
+        except Exception as e:
+            arrivals.put((None, e))
+        finally:
+            arrivals.put((finished, None))
+
+    for producer in producers:
+        submit(drain, producer)
+    remaining = len(producers)
+    while remaining:
+        try:
+            item, error = arrivals.get(timeout=remaining(timeout))
+        except queue.Empty:
+            raise FutureTimeoutError(f"Nothing arrived within {timeout}s.")
+        if error is not None:
+            raise error
+        if item is finished:
+            remaining -= 1
+            continue
+        yield item
+
+
+def for_each_region(
+    call: Callable[[str], List[Any]],
+    regions: Optional[Iterable[str]] = None,
+    timeout: float = DEFAULT_DEADLINE_SECONDS,
+) -> List[Any]:
+    """Call `call(region)` for every region Sigrun uses, concurrently, and
+    concatenate the results in region order. Takes as long as the slowest
+    region rather than the sum of them."""
+    from sigrun.cloud.session import get_regions
+
+    regions = list(regions or get_regions())
+    if len(regions) == 1:
+        return call(regions[0])
+    results = gather(
+        *[functools.partial(call, region) for region in regions], timeout=timeout
+    )
+    return [item for result in results for item in result]
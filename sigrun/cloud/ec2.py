@@ -1,24 +1,303 @@
-from typing import List
+"""The query layer for Sigrun's game servers. Every lookup is pushed down to
+EC2 as filters and paged through `describe_instances`, and each instance is
+reduced to a compact `ServerRecord` with its tags parsed once.
 
-from sigrun.cloud.session import ec2_resource
+Lookups without a region fan out across every region Sigrun uses and merge
+the results. Mutations go to one region, or are grouped by region when given
+records."""
+
+import functools
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+import jmespath
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from sigrun.cloud import concurrency
+from sigrun.cloud.session import get_ec2_client, get_regions
+
+SIGRUN_TAG = "sigrun"
+NON_TERMINATED_STATES = ("pending", "running", "shutting-down", "stopping", "stopped")
+MISSING_INSTANCE_ERRORS = ("InvalidInstanceID.Malformed", "InvalidInstanceID.NotFound")
+# Servers launched to hibernate carry this tag
+HIBERNATE_TAG = "hibernate"
+# Raised when an instance can't hibernate right now, e.g. while the hibernation
+# agent is still being set up after launch
+HIBERNATION_ERRORS = (
+    "UnsupportedHibernationConfiguration",
+    "UnsupportedOperation",
+    "InvalidParameterCombination",
+)
+
+# Only the fields a ServerRecord is built from are kept from each page.
+INSTANCE_PROJECTION = (
+    "Reservations[].Instances[].{"
+    "InstanceId: InstanceId, "
+    "State: State.Name, "
+    "LaunchTime: LaunchTime, "
+    "PublicIpAddress: PublicIpAddress, "
+    "InstanceType: InstanceType, "
+    "Tags: Tags}"
+)
+PAGE_PROJECTION = jmespath.compile(INSTANCE_PROJECTION)
+
+
+@dataclass(frozen=True, slots=True)
+class ServerRecord:
+    instance_id: str
+    state: str
+    launch_time: datetime
+    public_ip: Optional[str]
+    instance_type: str
+    tags: Dict[str, str]
+    region: str = ""
+
+    @classmethod
+    def from_description(cls, description: dict, region: str = "") -> "ServerRecord":
+        return cls(
+            instance_id=description["InstanceId"],
+            state=description["State"],
+            launch_time=description["LaunchTime"],
+            public_ip=description.get("PublicIpAddress"),
+            instance_type=description["InstanceType"],
+            tags={tag["Key"]: tag["Value"] for tag in description.get("Tags") or []},
+            region=region,
+        )
+
+    @property
+    def game(self) -> str:
+        return self.tags.get("game", "")
+
+    @property
+    def pretty_game(self) -> str:
+        return self.tags.get("pretty_game", self.game)
+
+    @property
+    def server_name(self) -> str:
+        return self.tags.get("server_name", "")
+
+    @property
+    def password(self) -> str:
+        return self.tags.get("password", "")
+
+    @property
+    def hibernates(self) -> bool:
+        return self.tags.get(HIBERNATE_TAG) == "true"
+
+    @property
+    def start_time(self) -> Optional[datetime]:
+        if "start_time" not in self.tags:
+            return None
+        return datetime.fromisoformat(self.tags["start_time"])
 
 
 def get_non_terminated_instances(
-    game: str = "", server_name: str = "", password: str = ""
-) -> List:
+    game: str = "",
+    server_name: str = "",
+    password: str = "",
+    region: Optional[str] = None,
+) -> List[ServerRecord]:
+    filters = server_filters(game, server_name=server_name, password=password)
+    return describe_servers(region, Filters=filters)
+
 
-    filters = []
+def server_filters(
+    game: str = "",
+    states: Sequence[str] = NON_TERMINATED_STATES,
+    server_name: str = "",
+    name_prefix: str = "",
+    password: str = "",
+) -> List[dict]:
+    """EC2 filters selecting Sigrun servers. Tag filters accept `*` wildcards,
+    which is how name prefixes are matched."""
+    filters = [
+        {"Name": "instance-state-name", "Values": list(states)},
+        {"Name": "tag-key", "Values": [SIGRUN_TAG]},
+    ]
     if game:
         filters.append({"Name": "tag:game", "Values": [game]})
     if server_name:
         filters.append({"Name": "tag:server_name", "Values": [server_name]})
+    elif name_prefix:
+        filters.append({"Name": "tag:server_name", "Values": [f"{name_prefix}*"]})
     if password:
-        filters.append({"Name": "tag:Password", "Values": [password]})
+        filters.append({"Name": "tag:password", "Values": [password]})
+    return filters
+
+
+def get_running_instances(region: Optional[str] = None) -> List[ServerRecord]:
+    return describe_servers(
+        region,
+        Filters=[
+            {"Name": "instance-state-name", "Values": ["running"]},
+            {"Name": "tag-key", "Values": [SIGRUN_TAG]},
+        ]
+    )
+
+
+def get_instance_by_id(
+    instance_id: str, region: Optional[str] = None
+) -> List[ServerRecord]:
+    return get_instances_by_id([instance_id], region)
+
+
+def get_instances_by_id(
+    instance_ids: Iterable[str], region: Optional[str] = None
+) -> List[ServerRecord]:
+    """Sigrun servers with the given IDs. Malformed or unknown IDs are treated
+    as not found rather than raised."""
+    instance_ids = list(instance_ids)
+    if region is not None:
+        return describe_by_id(instance_ids, region)
+    # Each ID lives in exactly one region, so filter rather than name them,
+    # which would fail in every other region
+    return describe_servers(
+        Filters=[
+            {"Name": "instance-id", "Values": instance_ids},
+            {"Name": "instance-state-name", "Values": list(NON_TERMINATED_STATES)},
+            {"Name": "tag-key", "Values": [SIGRUN_TAG]},
+        ],
+    )
+
+
+def describe_by_id(instance_ids: List[str], region: str) -> List[ServerRecord]:
+    try:
+        return describe_servers(
+            region,
+            InstanceIds=instance_ids,
+            Filters=[
+                {"Name": "instance-state-name", "Values": list(NON_TERMINATED_STATES)},
+                {"Name": "tag-key", "Values": [SIGRUN_TAG]},
+            ],
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in MISSING_INSTANCE_ERRORS:
+            raise e
+        return []
+
+
+def describe_servers(region: Optional[str] = None, **kwargs) -> List[ServerRecord]:
+    """Sigrun servers matching `describe_instances` kwargs, in `region` or in
+    every region concurrently."""
+    if region is None:
+        return concurrency.for_each_region(lambda r: describe_servers(r, **kwargs))
+
+    return [record for page in iter_server_pages(region, **kwargs) for record in page]
+
+
+def iter_server_pages(
+    region: Optional[str] = None, **kwargs
+) -> Iterator[List[ServerRecord]]:
+    """Like `describe_servers`, but yields each page as soon as EC2 returns
+    it. Without a region, every region is paged concurrently and their pages
+    are interleaved as they arrive."""
+    if region is None:
+        yield from concurrency.stream(
+            *[partial(iter_server_pages, r, **kwargs) for r in get_regions()]
+        )
+        return
+
+    paginator = get_ec2_client(region).get_paginator("describe_instances")
+    for page in paginator.paginate(**kwargs):
+        yield [
+            ServerRecord.from_description(description, region)
+            for description in PAGE_PROJECTION.search(page) or []
+        ]
+
+
+def group_by_region(records: Iterable[ServerRecord]) -> Dict[str, List[str]]:
+    """Instance IDs keyed by the region they're in."""
+    grouped = defaultdict(list)
+    for record in records:
+        grouped[record.region or None].append(record.instance_id)
+    return dict(grouped)
+
+
+def start_servers(records: Iterable[ServerRecord]):
+    """Start servers wherever they are, one call per region, concurrently."""
+    concurrency.gather(
+        *[
+            partial(start_instances, ids, region)
+            for region, ids in group_by_region(records).items()
+        ]
+    )
+
+
+def stop_servers(records: Iterable[ServerRecord]) -> Set[str]:
+    """Stop servers wherever they are, one call per region, concurrently.
+    Servers launched to hibernate are hibernated. Returns the IDs of the
+    servers that actually hibernated."""
+    batches = defaultdict(list)
+    for record in records:
+        batches[(record.region or None, record.hibernates)].append(record.instance_id)
+    batches = list(batches.items())
+    hibernated = concurrency.gather(
+        *[
+            partial(stop_instances, ids, region, hibernate)
+            for (region, hibernate), ids in batches
+        ]
+    )
+    return {
+        instance_id
+        for (_, ids), did_hibernate in zip(batches, hibernated)
+        if did_hibernate
+        for instance_id in ids
+    }
+
+
+def start_instances(instance_ids: List[str], region: Optional[str] = None):
+    get_ec2_client(region).start_instances(InstanceIds=instance_ids)
+    tag_instances(
+        instance_ids,
+        {"start_time": datetime.now(timezone.utc).isoformat()},
+        region,
+    )
+
+
+def stop_instances(
+    instance_ids: List[str], region: Optional[str] = None, hibernate: bool = False
+) -> bool:
+    """Stop instances, hibernating them if asked. If they can't hibernate,
+    they're stopped normally instead. Returns whether they hibernated."""
+    client = get_ec2_client(region)
+    hibernated = hibernate
+    try:
+        client.stop_instances(InstanceIds=instance_ids, Hibernate=hibernate)
+    except ClientError as e:
+        if not hibernate or e.response["Error"]["Code"] not in HIBERNATION_ERRORS:
+            raise e
+        logger.warning(f"Couldn't hibernate {instance_ids}, stopping them instead: {e}")
+        client.stop_instances(InstanceIds=instance_ids)
+        hibernated = False
+    client.delete_tags(
+        Resources=instance_ids, Tags=[{"Key": "start_time"}]
+    )
+    return hibernated
+
 
-    instances = ec2_resource.instances.filter(Filters=filters)
-    return [i for i in instances if i.state["Name"] != "terminated"]
+@functools.cache
+def get_hibernation_memory(
+    instance_type: str, region: Optional[str] = None
+) -> Optional[int]:
+    """The memory in GiB an instance type hibernates to disk, or None if it
+    can't hibernate."""
+    response = get_ec2_client(region).describe_instance_types(
+        InstanceTypes=[instance_type]
+    )
+    description = response["InstanceTypes"][0]
+    if not description.get("HibernationSupported"):
+        return None
+    return -(-description["MemoryInfo"]["SizeInMiB"] // 1024)
 
 
-def get_instance_by_id(instance_id: str):
-    instances = ec2_resource.instances.filter(InstanceIds=[instance_id])
-    return [i for i in instances if i.state["Name"] != "terminated"]
+def tag_instances(
+    instance_ids: List[str], tags: Dict[str, str], region: Optional[str] = None
+):
+    get_ec2_client(region).create_tags(
+        Resources=instance_ids,
+        Tags=[{"Key": key, "Value": value} for key, value in tags.items()],
+    )
@@ -0,0 +1,273 @@
+"""Idempotency and coalescing for deferred commands.
+
+Discord retries interactions it didn't hear back about in time, and Lambda
+retries failed asynchronous invocations, so the same interaction can reach
+the deferred handler more than once. Each interaction ID is claimed on
+arrival and repeats are dropped.
+
+Separately, identical requests from different interactions, e.g. two people
+starting the same server at once, are coalesced. Commands opt in with
+`Command.get_coalescing_options`. The first request claims a key built from
+the command and those options and runs. Requests that arrive while it's in
+flight attach themselves to the claim and exit; when the first finishes, its
+messages are relayed to each of them.
+
+Claims are conditional writes, so exactly one request wins. The store is
+chosen with `SIGRUN_IDEMPOTENCY`:
+- unset: no idempotency, every request runs
+- `memory`: a process-local dict, the stand-in for local runs
+- `dynamodb:<table>`: a DynamoDB table shared by the Lambdas
+"""
+
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from sigrun.cloud import concurrency, notifications
+from sigrun.cloud.session import default_region, get_resource
+from sigrun.model.messenger import (
+    Interaction,
+    WebhookMessenger,
+    get_messenger,
+    set_messenger,
+)
+
+# Interaction tokens are valid for 15 minutes, retries can't come later
+INTERACTION_TTL_SECONDS = 15 * 60
+# Longer than the deferred Lambda may run, so a crashed run's claim lapses
+LEASE_SECONDS = 6 * 60
+MAX_CLAIM_ATTEMPTS = 3
+
+# Set while a deferred command runs, for APIs with their own idempotency
+# tokens, e.g. RunInstances' ClientToken.
+request_token: ContextVar[Optional[str]] = ContextVar("request_token", default=None)
+
+
+class IdempotencyStore:
+    """The interface every idempotency backend implements."""
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """Take `key` for `owner` unless someone holds an unexpired claim on it."""
+        raise NotImplementedError
+
+    def attach(self, key: str, waiter: Interaction) -> bool:
+        """Wait on an unexpired claim. False if there's no claim to wait on."""
+        raise NotImplementedError
+
+    def finish(self, key: str, owner: str) -> List[Interaction]:
+        """Drop `owner`'s claim, returning whoever attached to it."""
+        raise NotImplementedError
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+
+    def __init__(self):
+        self.claims: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        with self.lock:
+            current = self.claims.get(key)
+            if current is not None and current["expires_at"] > time.time():
+                return False
+            self.claims[key] = {
+                "owner": owner,
+                "expires_at": time.time() + ttl,
+                "waiters": [],
+            }
+            return True
+
+    def attach(self, key: str, waiter: Interaction) -> bool:
+        with self.lock:
+            current = self.claims.get(key)
+            if current is None or current["expires_at"] <= time.time():
+                return False
+            current["waiters"].append(waiter)
+            return True
+
+    def finish(self, key: str, owner: str) -> List[Interaction]:
+        with self.lock:
+            current = self.claims.get(key)
+            if current is None or current["owner"] != owner:
+                return []
+            del self.claims[key]
+            return current["waiters"]
+
+
+class DynamoIdempotencyStore(IdempotencyStore):
+    """Claims are items keyed by `key`. The table should expire items through
+    a TTL on `expires_at`; expired claims are also ignored when reading."""
+
+    def __init__(self, table_name: str):
+        self.table = get_resource("dynamodb", default_region()).Table(table_name)
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        return self.conditionally(
+            self.table.put_item,
+            Item={"key": key, "owner": owner, "expires_at": int(now + ttl)},
+            ConditionExpression="attribute_not_exists(#key) OR expires_at <= :now",
+            ExpressionAttributeNames={"#key": "key"},
+            ExpressionAttributeValues={":now": int(now)},
+        )
+
+    def attach(self, key: str, waiter: Interaction) -> bool:
+        return self.conditionally(
+            self.table.update_item,
+            Key={"key": key},
+            UpdateExpression="SET waiters = list_append(if_not_exists(waiters, :none), :waiter)",
+            ConditionExpression="attribute_exists(#key) AND expires_at > :now",
+            ExpressionAttributeNames={"#key": "key"},
+            ExpressionAttributeValues={
+                ":none": [],
+                ":waiter": [
+                    {
+                        "application_id": waiter.application_id,
+                        "interaction_token": waiter.interaction_token,
+                    }
+                ],
+                ":now": int(time.time()),
+            },
+        )
+
+    def finish(self, key: str, owner: str) -> List[Interaction]:
+        try:
+            response = self.table.delete_item(
+                Key={"key": key},
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":owner": owner},
+                ReturnValues="ALL_OLD",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+            return []
+        return [
+            Interaction(**w) for w in response.get("Attributes", {}).get("waiters", [])
+        ]
+
+    @staticmethod
+    def conditionally(write: Callable, **kwargs) -> bool:
+        try:
+            write(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+            return False
+        return True
+
+
+@functools.cache
+def get_store() -> Optional[IdempotencyStore]:
+    """The configured idempotency backend, or None if there isn't one."""
+    setting = os.environ.get("SIGRUN_IDEMPOTENCY", "")
+    backend, _, location = setting.partition(":")
+    if not backend:
+        return None
+    if backend == "memory":
+        return MemoryIdempotencyStore()
+    if backend == "dynamodb":
+        return DynamoIdempotencyStore(location)
+    raise RuntimeError(f"Unsupported idempotency backend {backend}.")
+
+
+def coalescing_key(command_name: str, options: dict) -> str:
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+    return f"command/{command_name}/{digest[:32]}"
+
+
+def run_once(command, event: dict, run: Callable[[], None]):
+    """Run a deferred command's `run` unless its interaction was already
+    handled, sharing the run with identical requests in flight."""
+    store = get_store()
+    interaction_id = event.get("interaction_id")
+    if store is None or interaction_id is None:
+        run()
+        return
+
+    interaction_key = f"interaction/{interaction_id}"
+    if not store.claim(interaction_key, interaction_id, INTERACTION_TTL_SECONDS):
+        logger.info(f"Interaction {interaction_id} was already handled, dropping it.")
+        return
+
+    token = request_token.set(interaction_id)
+    try:
+        coalesce(command, event, run, store)
+    except Exception:
+        # Let a retry of this interaction through
+        store.finish(interaction_key, interaction_id)
+        raise
+    finally:
+        request_token.reset(token)
+
+
+def coalesce(command, event: dict, run: Callable[[], None], store: IdempotencyStore):
+    options = command.get_coalescing_options(event["options"])
+    if options is None:
+        run()
+        return
+
+    owner = event["interaction_id"]
+    key = coalescing_key(command.get_discord_name(), options)
+    waiter = Interaction(event["application_id"], event["interaction_token"])
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        if store.claim(key, owner, LEASE_SECONDS):
+            break
+        if store.attach(key, waiter):
+            logger.info(f"Attached to the {key} request in flight.")
+            get_messenger()("Someone asked for that already, I'll tell you how it goes.")
+            return
+        # The claim was finished between the two calls, so try to take it
+    else:
+        logger.warning(f"Couldn't claim or attach to {key}, running uncoalesced.")
+        run()
+        return
+
+    messages = []
+    messenger = get_messenger()
+
+    def recording_messenger(content: str):
+        messages.append(content)
+        messenger(content)
+
+    # Servers the run waits on are waited on for everyone who attached too
+    started = []
+    set_messenger(recording_messenger)
+    registered = notifications.registered.set(started)
+    try:
+        run()
+    except Exception:
+        messages.append("Something went wrong there, please try again.")
+        raise
+    finally:
+        set_messenger(messenger)
+        notifications.registered.reset(registered)
+        waiters = store.finish(key, owner)
+        for waiter in waiters:
+            notifications.register(started, waiter)
+        relay(waiters, messages)
+
+
+def relay(waiters: List[Interaction], messages: List[str]):
+    """Send a finished request's messages to everyone who waited on it."""
+    if not waiters or not messages:
+        return
+    logger.info(f"Relaying the result to {len(waiters)} waiting interactions.")
+    concurrency.gather(*[partial(relay_to, waiter, messages) for waiter in waiters])
+
+
+def relay_to(waiter: Interaction, messages: List[str]):
+    messenger = WebhookMessenger(waiter.application_id, waiter.interaction_token)
+    for message in messages:
+        messenger(message)
+    messenger.flush()
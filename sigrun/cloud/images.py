@@ -0,0 +1,167 @@
+"""Per-game golden images. Baking runs the install section of a game's
+startup script once on a builder instance and registers the result as an
+AMI, so new servers only have to run the per-server configuration. Images
+are found again through their tags, so there's no separate registry to keep
+in sync. Images are regional, so each region gets its own bake."""
+
+import functools
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from loguru import logger
+
+from sigrun.cloud.session import default_region, get_ec2_client, get_ssm_client
+from sigrun.model.game import Game
+
+# Ubuntu 22.04 in the default region. Other regions look it up by name.
+BASE_IMAGE_ID = "ami-008fe2fc65df48dac"
+BASE_IMAGE_PARAMETER = (
+    "/aws/service/canonical/ubuntu/server/22.04/stable/current/amd64/hvm/ebs-gp2/ami-id"
+)
+IMAGE_TAG = "sigrun-image"
+IMAGES_TO_KEEP = 2
+# Baking includes a full game download, which can take a while
+BAKE_WAITER_CONFIG = {"Delay": 15, "MaxAttempts": 240}
+
+
+@dataclass(frozen=True, slots=True)
+class GameImage:
+    image_id: str
+    game: str
+    created: datetime
+    snapshot_ids: tuple
+
+    def is_stale(self, max_age_days: int) -> bool:
+        age = datetime.now(timezone.utc) - self.created
+        return age > timedelta(days=max_age_days)
+
+
+@functools.cache
+def get_base_image_id(region: Optional[str] = None) -> str:
+    """The stock image servers are installed on from scratch."""
+    if region is None or region == default_region():
+        return BASE_IMAGE_ID
+    response = get_ssm_client(region).get_parameter(Name=BASE_IMAGE_PARAMETER)
+    return response["Parameter"]["Value"]
+
+
+def get_images(game_name: str, region: Optional[str] = None) -> List[GameImage]:
+    """A game's available images in a region, newest first."""
+    response = get_ec2_client(region).describe_images(
+        Owners=["self"],
+        Filters=[
+            {"Name": f"tag:{IMAGE_TAG}", "Values": [game_name]},
+            {"Name": "state", "Values": ["available"]},
+        ],
+    )
+    images = [
+        GameImage(
+            image_id=image["ImageId"],
+            game=game_name,
+            created=datetime.fromisoformat(
+                image["CreationDate"].replace("Z", "+00:00")
+            ),
+            snapshot_ids=tuple(
+                mapping["Ebs"]["SnapshotId"]
+                for mapping in image.get("BlockDeviceMappings", [])
+                if "SnapshotId" in mapping.get("Ebs", {})
+            ),
+        )
+        for image in response["Images"]
+    ]
+    return sorted(images, key=lambda image: image.created, reverse=True)
+
+
+def get_latest_image(
+    game: Game, region: Optional[str] = None
+) -> Optional[GameImage]:
+    """The image new servers of this game should launch from, if there is one."""
+    if not game.supports_image:
+        return None
+    images = get_images(game.name, region)
+    if not images:
+        return None
+    if images[0].is_stale(game.image_max_age_days):
+        logger.warning(
+            f"The {game} image {images[0].image_id} is older than "
+            f"{game.image_max_age_days} days. Consider re-baking it."
+        )
+    return images[0]
+
+
+def needs_bake(game: Game, region: Optional[str] = None) -> bool:
+    if not game.supports_image:
+        return False
+    images = get_images(game.name, region)
+    return not images or images[0].is_stale(game.image_max_age_days)
+
+
+def bake_image(game: Game, region: Optional[str] = None) -> str:
+    """Install the game on a builder instance, register an image from it, and
+    clean up. Blocks until the image is available. Returns the new image ID."""
+    client = get_ec2_client(region)
+    builder_id = client.run_instances(
+        BlockDeviceMappings=[
+            {
+                "DeviceName": "/dev/sda1",
+                "Ebs": {
+                    "DeleteOnTermination": True,
+                    "VolumeSize": game.storage,
+                    "VolumeType": "gp3",
+                },
+            }
+        ],
+        ImageId=get_base_image_id(region),
+        InstanceType=game.instance_type,
+        MaxCount=1,
+        MinCount=1,
+        # The builder powers itself off once the install finishes
+        UserData=game.install_script + "\nshutdown -h now\n",
+        InstanceInitiatedShutdownBehavior="stop",
+        TagSpecifications=[
+            {
+                "ResourceType": "instance",
+                "Tags": [{"Key": "Name", "Value": f"{game.pretty_name}-image-builder"}],
+            }
+        ],
+    )["Instances"][0]["InstanceId"]
+    logger.info(f"Baking {game} on builder {builder_id}.")
+
+    try:
+        client.get_waiter("instance_stopped").wait(
+            InstanceIds=[builder_id], WaiterConfig=BAKE_WAITER_CONFIG
+        )
+        created = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+        image_id = client.create_image(
+            InstanceId=builder_id,
+            Name=f"sigrun-{game.name}-{created}",
+            Description=f"{game} installed by Sigrun",
+            TagSpecifications=[
+                {
+                    "ResourceType": "image",
+                    "Tags": [{"Key": IMAGE_TAG, "Value": game.name}],
+                }
+            ],
+        )["ImageId"]
+        client.get_waiter("image_available").wait(
+            ImageIds=[image_id], WaiterConfig=BAKE_WAITER_CONFIG
+        )
+    finally:
+        client.terminate_instances(InstanceIds=[builder_id])
+
+    logger.info(f"Registered {game} image {image_id}.")
+    prune_images(game.name, region=region)
+    return image_id
+
+
+def prune_images(
+    game_name: str, keep: int = IMAGES_TO_KEEP, region: Optional[str] = None
+):
+    """Deregister all but the newest images of a game, and their snapshots."""
+    client = get_ec2_client(region)
+    for image in get_images(game_name, region)[keep:]:
+        logger.info(f"Deregistering old {game_name} image {image.image_id}.")
+        client.deregister_image(ImageId=image.image_id)
+        for snapshot_id in image.snapshot_ids:
+            client.delete_snapshot(SnapshotId=snapshot_id)
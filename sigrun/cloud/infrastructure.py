@@ -0,0 +1,274 @@
+"""Reconciles the per-game infrastructure servers depend on, currently each
+game's security group and its ingress rules in every region it's used in.
+Resolved IDs are cached with a TTL in a persistent store, together with a
+fingerprint of the rules they were reconciled against, so EC2 is only asked
+when the cache misses, expires, or the game's ports change. The rules
+themselves are kept too: only ports Sigrun opened before are ever closed,
+so rules added to a group by hand survive.
+
+The store is chosen with `SIGRUN_RESOURCE_CACHE`:
+- unset or `file:<path>`: a local JSON file, for the CLI
+- `ssm`: SSM Parameter Store, shared by the Lambdas
+- `memory`: a process-local dict, and the default inside Lambda
+A file that can't be written, e.g. on a read-only filesystem, is given up on
+and the cache is kept in memory instead.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from loguru import logger
+
+from sigrun.cloud.session import default_region, get_ec2_client, get_ssm_client
+from sigrun.model.game import Game
+
+CACHE_TTL_SECONDS = float(os.environ.get("RESOURCE_CACHE_TTL_SECONDS", 24 * 3600))
+DEFAULT_CACHE_FILE = Path.home() / ".cache" / "sigrun" / "resources.json"
+SSM_PREFIX = "/sigrun/cache"
+OPEN_CIDR = "0.0.0.0/0"
+SSH_RULE = ("tcp", 22)
+
+# (protocol, port) pairs open to the world
+Rules = FrozenSet[Tuple[str, int]]
+
+
+class ResourceCache:
+    """The interface every resource cache backend implements."""
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def put(self, key: str, value: dict):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryResourceCache(ResourceCache):
+
+    def __init__(self):
+        self.entries: Dict[str, dict] = {}
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.entries.get(key)
+
+    def put(self, key: str, value: dict):
+        self.entries[key] = value
+
+    def delete(self, key: str):
+        self.entries.pop(key, None)
+
+
+class FileResourceCache(ResourceCache):
+
+    def __init__(self, path: Path):
+        self.path = path
+        # The entries, once the file turns out not to be writable
+        self.in_memory: Optional[Dict[str, dict]] = None
+
+    def read(self) -> Dict[str, dict]:
+        if self.in_memory is not None:
+            return dict(self.in_memory)
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, entries: Dict[str, dict]):
+        if self.in_memory is None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                temporary = self.path.with_suffix(".tmp")
+                temporary.write_text(json.dumps(entries))
+                temporary.replace(self.path)
+                return
+            except OSError as e:
+                logger.warning(
+                    f"Can't write the resource cache {self.path}, keeping it in memory: {e}"
+                )
+        self.in_memory = dict(entries)
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.read().get(key)
+
+    def put(self, key: str, value: dict):
+        entries = self.read()
+        entries[key] = value
+        self.write(entries)
+
+    def delete(self, key: str):
+        entries = self.read()
+        if entries.pop(key, None) is not None:
+            self.write(entries)
+
+
+class SsmResourceCache(ResourceCache):
+
+    def __init__(self):
+        self.client = get_ssm_client()
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            response = self.client.get_parameter(Name=f"{SSM_PREFIX}/{key}")
+        except self.client.exceptions.ParameterNotFound:
+            return None
+        return json.loads(response["Parameter"]["Value"])
+
+    def put(self, key: str, value: dict):
+        self.client.put_parameter(
+            Name=f"{SSM_PREFIX}/{key}",
+            Value=json.dumps(value),
+            Type="String",
+            Overwrite=True,
+        )
+
+    def delete(self, key: str):
+        try:
+            self.client.delete_parameter(Name=f"{SSM_PREFIX}/{key}")
+        except self.client.exceptions.ParameterNotFound:
+            pass
+
+
+@functools.cache
+def get_cache() -> ResourceCache:
+    setting = os.environ.get("SIGRUN_RESOURCE_CACHE", "")
+    if not setting and os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        # Home is read-only in Lambda
+        setting = "memory"
+    backend, _, location = setting.partition(":")
+    if not backend or backend == "file":
+        return FileResourceCache(Path(location) if location else DEFAULT_CACHE_FILE)
+    if backend == "ssm":
+        return SsmResourceCache()
+    if backend == "memory":
+        return MemoryResourceCache()
+    raise RuntimeError(f"Unsupported resource cache backend {backend}.")
+
+
+def desired_rules(game: Game) -> Rules:
+    """The ingress rules a game's security group should have. SSH is always
+    open so the server can be debugged."""
+    return frozenset(
+        {(p["protocol"], p["port"]) for p in game.ports} | {SSH_RULE}
+    )
+
+
+def current_rules(permissions: list) -> Rules:
+    """The single-port, open-to-the-world rules in a group, the only kind
+    Sigrun opens."""
+    return frozenset(
+        (p["IpProtocol"], p["FromPort"])
+        for p in permissions
+        if p.get("FromPort") is not None
+        and p["FromPort"] == p.get("ToPort")
+        and any(r.get("CidrIp") == OPEN_CIDR for r in p.get("IpRanges", []))
+    )
+
+
+def ingress_diff(
+    current: Rules, desired: Rules, managed: Rules = frozenset()
+) -> Tuple[Rules, Rules]:
+    """The rules to authorize and to revoke to get from `current` to `desired`.
+    Only `managed` rules, the ones Sigrun opened before, are ever revoked;
+    anything else was added by hand and is left alone."""
+    return desired - current, (current - desired) & managed
+
+
+def fingerprint(rules: Rules) -> str:
+    return hashlib.sha256(json.dumps(sorted(rules)).encode()).hexdigest()
+
+
+def to_permissions(rules: Rules) -> list:
+    return [
+        {
+            "IpProtocol": protocol,
+            "FromPort": port,
+            "ToPort": port,
+            "IpRanges": [{"CidrIp": OPEN_CIDR}],
+        }
+        for protocol, port in sorted(rules)
+    ]
+
+
+def security_group_key(game: Game, region: Optional[str] = None) -> str:
+    return f"security-group/{region or default_region()}/{game.name}"
+
+
+def ensure_security_group(game: Game, region: Optional[str] = None) -> str:
+    """The ID of the game's security group in a region, creating it or fixing
+    its ingress rules if needed. A warm cache answers without calling EC2."""
+    desired = desired_rules(game)
+    key = security_group_key(game, region)
+    cached = get_cache().get(key)
+    if (
+        cached
+        and cached["fingerprint"] == fingerprint(desired)
+        and time.time() - cached["cached_at"] < CACHE_TTL_SECONDS
+    ):
+        return cached["group_id"]
+
+    # The rules opened last time are the ones that may need closing now
+    managed = frozenset(tuple(rule) for rule in (cached or {}).get("rules", []))
+    group_id = reconcile_security_group(game.pretty_name, desired, region, managed)
+    get_cache().put(
+        key,
+        {
+            "group_id": group_id,
+            "fingerprint": fingerprint(desired),
+            "rules": sorted(desired),
+            "cached_at": time.time(),
+        },
+    )
+    return group_id
+
+
+def invalidate_security_group(game: Game, region: Optional[str] = None):
+    """Forget the cached group, e.g. after EC2 says it no longer exists."""
+    get_cache().delete(security_group_key(game, region))
+
+
+def reconcile_security_group(
+    name: str,
+    desired: Rules,
+    region: Optional[str] = None,
+    managed: Rules = frozenset(),
+) -> str:
+    client = get_ec2_client(region)
+    response = client.describe_security_groups(
+        Filters=[{"Name": "group-name", "Values": [name]}]
+    )
+
+    if not response["SecurityGroups"]:
+        group_id = client.create_security_group(
+            GroupName=name,
+            Description="Security group for allowing inbound traffic",
+        )["GroupId"]
+        logger.info(f"Security Group Created: {group_id}")
+        client.authorize_security_group_ingress(
+            GroupId=group_id, IpPermissions=to_permissions(desired)
+        )
+        return group_id
+
+    group = response["SecurityGroups"][0]
+    group_id = group["GroupId"]
+    logger.info(f"Found existing security group {group_id}")
+    to_authorize, to_revoke = ingress_diff(
+        current_rules(group["IpPermissions"]), desired, managed
+    )
+    if to_authorize:
+        logger.info(f"Opening {sorted(to_authorize)} on {group_id}")
+        client.authorize_security_group_ingress(
+            GroupId=group_id, IpPermissions=to_permissions(to_authorize)
+        )
+    if to_revoke:
+        logger.info(f"Closing {sorted(to_revoke)} on {group_id}")
+        client.revoke_security_group_ingress(
+            GroupId=group_id, IpPermissions=to_permissions(to_revoke)
+        )
+    return group_id
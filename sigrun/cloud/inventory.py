@@ -0,0 +1,355 @@
+"""A cached inventory of Sigrun's servers, so reads don't have to hit
+DescribeInstances every time.
+
+The inventory is kept current by EC2 state-change events and a periodic
+reconciliation sweep (see `lambda_/inventory.py`). Commands that start or stop
+servers also write the state they caused straight through. Readers accept it as long
+as the last sweep is younger than `MAX_STALENESS_SECONDS`, and otherwise
+query EC2 live and reconcile on the way out.
+
+The backend is chosen with `SIGRUN_INVENTORY`:
+- unset: no inventory, every read goes to EC2
+- `memory`: a process-local dict
+- `sqlite:<path>`: a local SQLite database, handy for the CLI
+- `dynamodb:<table>`: a DynamoDB table shared by the Lambdas
+"""
+
+import functools
+import json
+import os
+import sqlite3
+import time
+from dataclasses import replace
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from sigrun.cloud import ec2
+from sigrun.cloud.ec2 import ServerRecord
+from sigrun.cloud.session import default_region, get_resource
+
+# How often the deployed stack reconciles the inventory. The staleness limit
+# is a few sweeps, so a sweep that runs a little late doesn't send every read
+# to EC2.
+RECONCILE_INTERVAL_SECONDS = int(
+    os.environ.get("INVENTORY_RECONCILE_INTERVAL_SECONDS", 300)
+)
+MAX_STALENESS_SECONDS = float(
+    os.environ.get("INVENTORY_MAX_STALENESS_SECONDS", 3 * RECONCILE_INTERVAL_SECONDS)
+)
+RECONCILED_AT_KEY = "__reconciled_at__"
+
+
+class InventoryStore:
+    """The interface every inventory backend implements."""
+
+    def get(self, instance_id: str) -> Optional[ServerRecord]:
+        raise NotImplementedError
+
+    def list(self) -> List[ServerRecord]:
+        raise NotImplementedError
+
+    def put(self, record: ServerRecord):
+        raise NotImplementedError
+
+    def delete(self, instance_id: str):
+        raise NotImplementedError
+
+    def replace_all(self, records: Iterable[ServerRecord]):
+        """Make the inventory exactly `records` and mark it reconciled."""
+        raise NotImplementedError
+
+    def reconciled_at(self) -> float:
+        """Epoch seconds of the last full reconciliation, 0 if never."""
+        raise NotImplementedError
+
+
+class MemoryInventoryStore(InventoryStore):
+
+    def __init__(self):
+        self.records: Dict[str, ServerRecord] = {}
+        self.last_reconciled = 0.0
+
+    def get(self, instance_id: str) -> Optional[ServerRecord]:
+        return self.records.get(instance_id)
+
+    def list(self) -> List[ServerRecord]:
+        return list(self.records.values())
+
+    def put(self, record: ServerRecord):
+        self.records[record.instance_id] = record
+
+    def delete(self, instance_id: str):
+        self.records.pop(instance_id, None)
+
+    def replace_all(self, records: Iterable[ServerRecord]):
+        self.records = {record.instance_id: record for record in records}
+        self.last_reconciled = time.time()
+
+    def reconciled_at(self) -> float:
+        return self.last_reconciled
+
+
+class SqliteInventoryStore(InventoryStore):
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS servers (instance_id TEXT PRIMARY KEY, item TEXT)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)"
+            )
+
+    def get(self, instance_id: str) -> Optional[ServerRecord]:
+        row = self.connection.execute(
+            "SELECT item FROM servers WHERE instance_id = ?", (instance_id,)
+        ).fetchone()
+        return from_item(json.loads(row[0])) if row else None
+
+    def list(self) -> List[ServerRecord]:
+        rows = self.connection.execute("SELECT item FROM servers").fetchall()
+        return [from_item(json.loads(row[0])) for row in rows]
+
+    def put(self, record: ServerRecord):
+        with self.connection:
+            self.upsert(record)
+
+    def delete(self, instance_id: str):
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM servers WHERE instance_id = ?", (instance_id,)
+            )
+
+    def replace_all(self, records: Iterable[ServerRecord]):
+        with self.connection:
+            self.connection.execute("DELETE FROM servers")
+            for record in records:
+                self.upsert(record)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                (RECONCILED_AT_KEY, time.time()),
+            )
+
+    def reconciled_at(self) -> float:
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (RECONCILED_AT_KEY,)
+        ).fetchone()
+        return row[0] if row else 0.0
+
+    def upsert(self, record: ServerRecord):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO servers VALUES (?, ?)",
+            (record.instance_id, json.dumps(to_item(record))),
+        )
+
+
+class DynamoInventoryStore(InventoryStore):
+
+    def __init__(self, table_name: str):
+        self.table = get_resource("dynamodb", default_region()).Table(table_name)
+
+    def get(self, instance_id: str) -> Optional[ServerRecord]:
+        item = self.table.get_item(Key={"instance_id": instance_id}).get("Item")
+        return from_item(item) if item else None
+
+    def list(self) -> List[ServerRecord]:
+        return [
+            from_item(item)
+            for item in self.scan()
+            if item["instance_id"] != RECONCILED_AT_KEY
+        ]
+
+    def put(self, record: ServerRecord):
+        self.table.put_item(Item=to_item(record))
+
+    def delete(self, instance_id: str):
+        self.table.delete_item(Key={"instance_id": instance_id})
+
+    def replace_all(self, records: Iterable[ServerRecord]):
+        records = {record.instance_id: record for record in records}
+        stale = {
+            item["instance_id"]
+            for item in self.scan()
+            if item["instance_id"] not in records
+            and item["instance_id"] != RECONCILED_AT_KEY
+        }
+        with self.table.batch_writer() as batch:
+            for record in records.values():
+                batch.put_item(Item=to_item(record))
+            for instance_id in stale:
+                batch.delete_item(Key={"instance_id": instance_id})
+        self.table.put_item(
+            Item={"instance_id": RECONCILED_AT_KEY, "value": str(time.time())}
+        )
+
+    def reconciled_at(self) -> float:
+        item = self.table.get_item(Key={"instance_id": RECONCILED_AT_KEY}).get("Item")
+        return float(item["value"]) if item else 0.0
+
+    def scan(self):
+        kwargs = {}
+        while True:
+            response = self.table.scan(**kwargs)
+            yield from response["Items"]
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def to_item(record: ServerRecord) -> dict:
+    return {
+        "instance_id": record.instance_id,
+        "state": record.state,
+        "launch_time": record.launch_time.isoformat(),
+        "public_ip": record.public_ip or "",
+        "instance_type": record.instance_type,
+        "tags": record.tags,
+        "region": record.region,
+    }
+
+
+def from_item(item: dict) -> ServerRecord:
+    return ServerRecord(
+        instance_id=item["instance_id"],
+        state=item["state"],
+        launch_time=datetime.fromisoformat(item["launch_time"]),
+        public_ip=item["public_ip"] or None,
+        instance_type=item["instance_type"],
+        tags=dict(item["tags"]),
+        region=item.get("region", ""),
+    )
+
+
+@functools.cache
+def get_store() -> Optional[InventoryStore]:
+    """The configured inventory backend, or None if there isn't one."""
+    setting = os.environ.get("SIGRUN_INVENTORY", "")
+    backend, _, location = setting.partition(":")
+    if not backend:
+        return None
+    if backend == "memory":
+        return MemoryInventoryStore()
+    if backend == "sqlite":
+        return SqliteInventoryStore(location or "sigrun_inventory.db")
+    if backend == "dynamodb":
+        return DynamoInventoryStore(location)
+    raise RuntimeError(f"Unsupported inventory backend {backend}.")
+
+
+def is_fresh(store: InventoryStore) -> bool:
+    return time.time() - store.reconciled_at() < MAX_STALENESS_SECONDS
+
+
+def reconcile() -> List[ServerRecord]:
+    """Replace the inventory with a live view of the fleet."""
+    records = ec2.get_non_terminated_instances()
+    store = get_store()
+    if store is not None:
+        store.replace_all(records)
+        logger.info(f"Reconciled inventory with {len(records)} servers.")
+    return records
+
+
+def refresh_instance(
+    instance_id: str, region: Optional[str] = None
+) -> Optional[ServerRecord]:
+    """Bring a single server's entry up to date, e.g. after a state change.
+    Returns the server, or None if it's gone or not Sigrun's."""
+    store = get_store()
+    records = ec2.get_instance_by_id(instance_id, region)
+    if store is not None:
+        if records:
+            store.put(records[0])
+        else:
+            store.delete(instance_id)
+    return records[0] if records else None
+
+
+def record_state(records: Iterable[ServerRecord], state: str):
+    """Write a state change Sigrun just made through to the inventory, so reads
+    don't serve the old state until EC2's event for it arrives."""
+    store = get_store()
+    if store is None:
+        return
+    for record in records:
+        store.put(replace(record, state=state))
+
+
+def get_servers(game: str = "", fresh: bool = False) -> List[ServerRecord]:
+    """Sigrun's non-terminated servers, optionally only those of one game. Served
+    from the inventory unless it's too stale or `fresh` is requested."""
+    store = get_store()
+    if store is None:
+        return ec2.get_non_terminated_instances(game)
+
+    if fresh or not is_fresh(store):
+        records = reconcile()
+    else:
+        records = store.list()
+
+    return [r for r in records if not game or r.game == game]
+
+
+def stream_servers(
+    game: str = "",
+    states: Sequence[str] = ec2.NON_TERMINATED_STATES,
+    name_prefix: str = "",
+    fresh: bool = False,
+) -> Iterator[List[ServerRecord]]:
+    """Like `get_servers`, but yields servers a page at a time, filtered by
+    state and name prefix as well. A live query is paged straight from EC2
+    with the filters applied there; an unfiltered one reconciles the
+    inventory once the last page is in."""
+    store = get_store()
+    if store is not None and not fresh and is_fresh(store):
+        yield [
+            r
+            for r in store.list()
+            if (not game or r.game == game)
+            and r.state in states
+            and r.server_name.startswith(name_prefix)
+        ]
+        return
+
+    filters = ec2.server_filters(game, states, name_prefix=name_prefix)
+    unfiltered = not (game or name_prefix) and set(states) >= set(
+        ec2.NON_TERMINATED_STATES
+    )
+    records = []
+    for page in ec2.iter_server_pages(Filters=filters):
+        if store is not None and unfiltered:
+            records.extend(page)
+        yield page
+    if store is not None and unfiltered:
+        store.replace_all(records)
+        logger.info(f"Reconciled inventory with {len(records)} servers.")
+
+
+def get_servers_by_id(
+    instance_ids: List[str], fresh: bool = False
+) -> List[ServerRecord]:
+    store = get_store()
+    if store is None or fresh or not is_fresh(store):
+        return ec2.get_instances_by_id(instance_ids)
+
+    records = [store.get(instance_id) for instance_id in instance_ids]
+    if any(record is None for record in records):
+        # Servers created since the last sweep won't be in the inventory yet.
+        return ec2.get_instances_by_id(instance_ids)
+    return records
+
+
+def select_servers(
+    instance_ids: List[str], game: str = "", fresh: bool = False
+) -> Tuple[List[ServerRecord], List[str]]:
+    """Servers picked by ID, by game, or by ID within a game. Returns the
+    matching servers and any requested IDs that weren't found."""
+    if instance_ids:
+        records = get_servers_by_id(instance_ids, fresh=fresh)
+        found = {record.instance_id for record in records}
+        missing = [i for i in instance_ids if i not in found]
+        return [r for r in records if not game or r.game == game], missing
+    return get_servers(game, fresh=fresh), []
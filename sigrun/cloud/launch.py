@@ -0,0 +1,127 @@
+"""How game servers are launched. New servers and the warm pool's spares
+share everything but their user data and tags, so both build their
+RunInstances arguments here."""
+
+import os
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from sigrun import agent
+from sigrun.cloud import ec2, infrastructure
+from sigrun.cloud.session import default_region, get_ec2_client
+from sigrun.model.game import Game
+
+
+def render_user_data(script: str, game: Game, server_name: str, password: str) -> str:
+    """Fill in a startup script's per-server placeholders."""
+    return (
+        script.replace("PYTHON_SERVER_NAME", server_name)
+        .replace("PYTHON_PASSWORD", password)
+        .replace("PYTHON_PLAYER_AGENT", agent.render_installer(game, server_name))
+    )
+
+
+def instance_options(
+    game: Game,
+    image_id: str,
+    user_data: str,
+    tags: Dict[str, str],
+    region: Optional[str] = None,
+    count: int = 1,
+    keep_volume: bool = True,
+) -> dict:
+    """RunInstances arguments for `count` servers of `game`, less the security
+    group. Servers keep their volume when terminated, unless told otherwise."""
+    tags = dict(tags)
+    options = {}
+    # The instance profile lets Sigrun reach the server over SSM, e.g. for copy-world
+    if os.environ.get("SERVER_INSTANCE_PROFILE"):
+        options["IamInstanceProfile"] = {"Name": os.environ["SERVER_INSTANCE_PROFILE"]}
+
+    volume = {
+        "DeleteOnTermination": not keep_volume,
+        "VolumeSize": game.storage,
+        "VolumeType": "gp3",
+    }
+    if game.hibernate:
+        # Hibernation writes memory to the root volume, which has to be
+        # encrypted and have room for it
+        memory = ec2.get_hibernation_memory(game.instance_type, region)
+        if memory is None:
+            logger.warning(
+                f"{game.instance_type} can't hibernate, launching {game} without it."
+            )
+        else:
+            volume.update(VolumeSize=game.storage + memory, Encrypted=True)
+            options["HibernationOptions"] = {"Configured": True}
+            tags[ec2.HIBERNATE_TAG] = "true"
+
+    return dict(
+        BlockDeviceMappings=[
+            {
+                # DeviceName needs to match device name in AMI
+                # or will create a second unmounted device
+                "DeviceName": "/dev/sda1",
+                "Ebs": volume,
+            }
+        ],
+        ImageId=image_id,
+        InstanceType=game.instance_type,
+        MaxCount=count,
+        MinCount=count,
+        UserData=user_data,
+        # Tagging at launch saves a separate CreateTags round trip
+        TagSpecifications=[
+            {
+                "ResourceType": "instance",
+                "Tags": [{"Key": key, "Value": value} for key, value in tags.items()],
+            }
+        ],
+        **options,
+    )
+
+
+def server_tags(
+    game: Game, server_name: str, password: str, region: Optional[str] = None
+) -> Dict[str, str]:
+    """The tags that make an instance a Sigrun server."""
+    return {
+        "game": game.name,
+        "pretty_game": game.pretty_name,
+        "server_name": server_name,
+        "password": password,
+        ec2.SIGRUN_TAG: "",
+        "region": region or default_region(),
+        # This will be the instance's visible name in the console
+        "Name": f"{game.pretty_name}-{server_name}",
+    }
+
+
+def run_instances(
+    game: Game,
+    security_group_id: str,
+    options: dict,
+    region: Optional[str] = None,
+    client_token: Optional[str] = None,
+) -> List[str]:
+    """Launch instances and return their IDs. If the game's cached security
+    group was deleted out from under us, it's recreated and the launch retried."""
+    client = get_ec2_client(region)
+    token = {"ClientToken": client_token[:64]} if client_token else {}
+    try:
+        response = client.run_instances(
+            SecurityGroupIds=[security_group_id], **token, **options
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "InvalidGroup.NotFound":
+            raise
+        infrastructure.invalidate_security_group(game, region)
+        security_group_id = infrastructure.ensure_security_group(game, region)
+        # A token can't be reused with different parameters
+        token = {"ClientToken": f"{client_token[:58]}-retry"} if client_token else {}
+        response = client.run_instances(
+            SecurityGroupIds=[security_group_id], **token, **options
+        )
+    return [instance["InstanceId"] for instance in response["Instances"]]
@@ -0,0 +1,183 @@
+"""Tells people when the servers they started are up. Starting a server only
+registers the interaction that asked for it against the instance; nothing
+waits on the instance. When EC2 reports the instance running with a public
+address, the inventory Lambda posts the address as a follow-up to every
+interaction registered for it (see `lambda_/inventory.py`). The periodic
+reconciliation catches instances whose event was missed, e.g. in regions
+other than the stack's.
+
+Registrations last as long as Discord accepts follow-ups. The store is
+chosen with `SIGRUN_NOTIFICATIONS`:
+- unset: no notifications, users check `list-servers`
+- `memory`: a process-local dict, the stand-in for local runs
+- `dynamodb:<table>`: a DynamoDB table shared by the Lambdas
+"""
+
+import functools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+from sigrun.cloud import concurrency
+from sigrun.cloud.ec2 import ServerRecord
+from sigrun.cloud.session import default_region, get_resource
+from sigrun.model.messenger import Interaction, WebhookMessenger, get_interaction
+
+# Follow-ups are accepted for 15 minutes after the interaction
+REGISTRATION_TTL_SECONDS = 14 * 60
+
+# Instance IDs registered in this context, so coalesced requests can be
+# registered against the same instances (see `sigrun.cloud.idempotency`).
+registered: ContextVar[Optional[List[str]]] = ContextVar("registered", default=None)
+
+
+class NotificationStore:
+    """The interface every notification backend implements."""
+
+    def register(self, instance_id: str, interaction: Interaction, ttl: float):
+        raise NotImplementedError
+
+    def take(self, instance_id: str) -> List[Interaction]:
+        """Remove and return the unexpired registrations for an instance."""
+        raise NotImplementedError
+
+    def pending(self) -> Set[str]:
+        """The instance IDs with registrations."""
+        raise NotImplementedError
+
+
+class MemoryNotificationStore(NotificationStore):
+
+    def __init__(self):
+        self.registrations: Dict[str, List[tuple]] = {}
+        self.lock = threading.Lock()
+
+    def register(self, instance_id: str, interaction: Interaction, ttl: float):
+        with self.lock:
+            self.registrations.setdefault(instance_id, []).append(
+                (interaction, time.time() + ttl)
+            )
+
+    def take(self, instance_id: str) -> List[Interaction]:
+        with self.lock:
+            registrations = self.registrations.pop(instance_id, [])
+        return [i for i, expires_at in registrations if expires_at > time.time()]
+
+    def pending(self) -> Set[str]:
+        with self.lock:
+            return set(self.registrations)
+
+
+class DynamoNotificationStore(NotificationStore):
+    """Registrations are items keyed by `instance_id`. The table should expire
+    them through a TTL on `expires_at`."""
+
+    def __init__(self, table_name: str):
+        self.table = get_resource("dynamodb", default_region()).Table(table_name)
+
+    def register(self, instance_id: str, interaction: Interaction, ttl: float):
+        self.table.update_item(
+            Key={"instance_id": instance_id},
+            UpdateExpression=(
+                "SET interactions = list_append(if_not_exists(interactions, :none), :new), "
+                "expires_at = :expires_at"
+            ),
+            ExpressionAttributeValues={
+                ":none": [],
+                ":new": [
+                    {
+                        "application_id": interaction.application_id,
+                        "interaction_token": interaction.interaction_token,
+                        "expires_at": int(time.time() + ttl),
+                    }
+                ],
+                ":expires_at": int(time.time() + ttl),
+            },
+        )
+
+    def take(self, instance_id: str) -> List[Interaction]:
+        response = self.table.delete_item(
+            Key={"instance_id": instance_id}, ReturnValues="ALL_OLD"
+        )
+        return [
+            Interaction(i["application_id"], i["interaction_token"])
+            for i in response.get("Attributes", {}).get("interactions", [])
+            if i["expires_at"] > time.time()
+        ]
+
+    def pending(self) -> Set[str]:
+        ids = set()
+        kwargs = {"ProjectionExpression": "instance_id"}
+        while True:
+            response = self.table.scan(**kwargs)
+            ids.update(item["instance_id"] for item in response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return ids
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+@functools.cache
+def get_store() -> Optional[NotificationStore]:
+    """The configured notification backend, or None if there isn't one."""
+    setting = os.environ.get("SIGRUN_NOTIFICATIONS", "")
+    backend, _, location = setting.partition(":")
+    if not backend:
+        return None
+    if backend == "memory":
+        return MemoryNotificationStore()
+    if backend == "dynamodb":
+        return DynamoNotificationStore(location)
+    raise RuntimeError(f"Unsupported notification backend {backend}.")
+
+
+def register(
+    instance_ids: Iterable[str], interaction: Optional[Interaction] = None
+) -> bool:
+    """Have the interaction told when these instances are up, by default the
+    one being answered. False if nobody can be told, e.g. on the CLI."""
+    store = get_store()
+    interaction = interaction or get_interaction()
+    if store is None or interaction is None:
+        return False
+
+    instance_ids = list(instance_ids)
+    for instance_id in instance_ids:
+        store.register(instance_id, interaction, REGISTRATION_TTL_SECONDS)
+    collected = registered.get()
+    if collected is not None:
+        collected.extend(instance_ids)
+    return True
+
+
+def notify_ready(records: Iterable[ServerRecord]):
+    """Post the address of every server that's up to whoever registered for it."""
+    store = get_store()
+    if store is None:
+        return
+    ready = [r for r in records if r.state == "running" and r.public_ip]
+    if len(ready) > 1:
+        # Cheaper than trying every running server during a full sweep
+        pending = store.pending()
+        ready = [r for r in ready if r.instance_id in pending]
+    if ready:
+        concurrency.gather(*[partial(notify, store, record) for record in ready])
+
+
+def notify(store: NotificationStore, record: ServerRecord):
+    interactions = store.take(record.instance_id)
+    if not interactions:
+        return
+    logger.info(f"{record.instance_id} is up, telling {len(interactions)} interactions.")
+    for interaction in interactions:
+        messenger = WebhookMessenger(
+            interaction.application_id, interaction.interaction_token
+        )
+        messenger(
+            f"The {record.pretty_game} server {record.server_name} is up at {record.public_ip}!"
+        )
+        messenger.flush()
@@ -0,0 +1,171 @@
+"""Warm pools of spare servers. A game with `warm_pool` in its metadata keeps
+that many instances with the game installed, stopped, in its region. Creating
+a server claims a spare instead of launching one, so the new server only has
+to boot and run its per-server configuration.
+
+Spares run the install section on their first boot, then clear cloud-init's
+state and power off. Claiming one swaps its user data for the per-server
+configuration, which cloud-init runs on the next boot as if it were the
+first, retags it as a server and starts it. Claims are conditional writes to
+the idempotency store, so two requests never get the same spare.
+
+Spares aren't tagged `sigrun`, so they're never listed as servers.
+`replenish` tops the pools back up and runs on a schedule in
+`lambda_/pool.py`."""
+
+import uuid
+from functools import partial
+from typing import List, Optional, Sequence
+
+from loguru import logger
+
+from sigrun.cloud import concurrency, ec2, idempotency, images, infrastructure, launch
+from sigrun.cloud.ec2 import ServerRecord
+from sigrun.cloud.session import default_region, get_ec2_client
+from sigrun.model.game import Game, get_games
+
+POOL_TAG = "sigrun-pool"
+# Spares still installing count towards their pool
+POOL_STATES = ("pending", "running", "stopping", "stopped")
+# Long enough for a claimed spare to be retagged out of the pool
+CLAIM_SECONDS = 10 * 60
+# Appended to the install so the next boot runs whatever user data is set then
+SPARE_SHUTDOWN = "\ncloud-init clean --logs\nshutdown -h now\n"
+
+
+def get_spares(
+    game: Game, region: Optional[str] = None, states: Sequence[str] = ("stopped",)
+) -> List[ServerRecord]:
+    """A game's spares in its region, by default the ones ready to claim."""
+    filters = [
+        {"Name": "instance-state-name", "Values": list(states)},
+        {"Name": f"tag:{POOL_TAG}", "Values": [game.name]},
+    ]
+    return ec2.describe_servers(region or game.region or default_region(), Filters=filters)
+
+
+def claim(
+    game: Game,
+    server_name: str,
+    password: str,
+    spares: List[ServerRecord],
+    region: Optional[str] = None,
+) -> Optional[str]:
+    """Turn one of `spares` into the server `server_name` and start it. Returns
+    its instance ID, or None if every spare was taken by someone else."""
+    for spare in spares:
+        if not take(spare.instance_id):
+            continue
+        logger.info(f"Claimed {game} spare {spare.instance_id} for {server_name}.")
+        prepare(game, spare.instance_id, server_name, password, region)
+        ec2.start_instances([spare.instance_id], region)
+        return spare.instance_id
+    return None
+
+
+def take(instance_id: str) -> bool:
+    store = idempotency.get_store()
+    if store is None:
+        # Without a store there's nothing shared to claim through
+        return True
+    owner = idempotency.request_token.get() or str(uuid.uuid4())
+    return store.claim(f"pool/{instance_id}", owner, CLAIM_SECONDS)
+
+
+def prepare(
+    game: Game,
+    instance_id: str,
+    server_name: str,
+    password: str,
+    region: Optional[str] = None,
+):
+    """Configure a stopped spare as the server `server_name`."""
+    client = get_ec2_client(region)
+    user_data = launch.render_user_data(
+        game.configure_script, game, server_name, password
+    )
+    concurrency.gather(
+        partial(
+            client.modify_instance_attribute,
+            InstanceId=instance_id,
+            UserData={"Value": user_data.encode()},
+        ),
+        # Spares' volumes go with them, servers' outlive them
+        partial(
+            client.modify_instance_attribute,
+            InstanceId=instance_id,
+            BlockDeviceMappings=[
+                {"DeviceName": "/dev/sda1", "Ebs": {"DeleteOnTermination": False}}
+            ],
+        ),
+        partial(
+            ec2.tag_instances,
+            [instance_id],
+            launch.server_tags(game, server_name, password, region),
+            region,
+        ),
+    )
+    client.delete_tags(Resources=[instance_id], Tags=[{"Key": POOL_TAG}])
+
+
+def replenish():
+    """Launch or retire spares so every pool is at its target size."""
+    # Games without a pool are checked too, so turning one off empties it
+    concurrency.gather(
+        *[partial(replenish_pool, game) for game in get_games().values()]
+    )
+
+
+def replenish_pool(game: Game):
+    if not game.supports_image:
+        if game.warm_pool:
+            logger.warning(f"{game} has no install section to pre-install, skipping its pool.")
+        return
+    region = game.region or default_region()
+    spares = get_spares(game, region, POOL_STATES)
+    shortfall = game.warm_pool - len(spares)
+    if shortfall > 0:
+        instance_ids = launch_spares(game, shortfall, region)
+        logger.info(f"Launched {game} spares {instance_ids} in {region}.")
+    elif shortfall < 0:
+        retire_spares(game, spares, -shortfall, region)
+
+
+def launch_spares(game: Game, count: int, region: str) -> List[str]:
+    security_group_id, image = concurrency.gather(
+        partial(infrastructure.ensure_security_group, game, region),
+        partial(images.get_latest_image, game, region),
+    )
+    # Spares launched from the game's image have nothing left to install
+    if image is not None:
+        image_id, script = image.image_id, "#!/bin/bash\n"
+    else:
+        image_id, script = images.get_base_image_id(region), game.install_script
+    options = launch.instance_options(
+        game,
+        image_id,
+        script + SPARE_SHUTDOWN,
+        {POOL_TAG: game.name, "Name": f"{game.pretty_name}-spare"},
+        region,
+        count=count,
+        keep_volume=False,
+    )
+    return launch.run_instances(
+        game,
+        security_group_id,
+        {**options, "InstanceInitiatedShutdownBehavior": "stop"},
+        region,
+    )
+
+
+def retire_spares(game: Game, spares: List[ServerRecord], count: int, region: str):
+    """Terminate up to `count` stopped spares nobody is claiming."""
+    surplus = []
+    for spare in spares:
+        if len(surplus) == count:
+            break
+        if spare.state == "stopped" and take(spare.instance_id):
+            surplus.append(spare.instance_id)
+    if surplus:
+        logger.info(f"Retiring {game} spares {surplus} in {region}.")
+        get_ec2_client(region).terminate_instances(InstanceIds=surplus)
@@ -1,4 +1,94 @@
-import boto3
+"""Lazily created, process-wide AWS clients, one per service and region.
+Nothing is constructed at import time so that code paths which never touch
+EC2 don't pay for boto3 setup. Every client records its calls with
+`sigrun.telemetry` and checks the command's deadline before making it, see
+`sigrun.cloud.concurrency`.
 
-ec2_resource = boto3.resource("ec2")
-ec2_client = boto3.client("ec2")
+The fleet may span several regions, listed in `SIGRUN_REGIONS` (comma
+separated). Without it, the fleet lives in the default region."""
+
+import functools
+import os
+import threading
+from typing import Optional, Tuple
+
+from sigrun import telemetry
+
+# Creating clients from boto3's default session isn't thread safe
+creation_lock = threading.Lock()
+
+
+@functools.cache
+def default_region() -> str:
+    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+    if region:
+        return region
+    import boto3
+
+    return boto3.session.Session().region_name
+
+
+@functools.cache
+def get_regions() -> Tuple[str, ...]:
+    """Every region Sigrun's servers may be in."""
+    configured = os.environ.get("SIGRUN_REGIONS", "")
+    regions = tuple(r.strip() for r in configured.split(",") if r.strip())
+    return regions or (default_region(),)
+
+
+@functools.cache
+def get_client(service: str, region: str):
+    import boto3
+
+    with creation_lock:
+        client = boto3.client(
+            service, region_name=region, config=client_config(service)
+        )
+    return watch_deadline(telemetry.instrument(client))
+
+
+def client_config(service: str):
+    if service != "s3":
+        return None
+    from botocore.config import Config
+
+    # Presigned links name the bucket's region, or S3 redirects them to it
+    # and the redirect breaks their signature
+    return Config(signature_version="s3v4", s3={"addressing_style": "virtual"})
+
+
+@functools.cache
+def get_resource(service: str, region: str):
+    import boto3
+
+    with creation_lock:
+        resource = boto3.resource(service, region_name=region)
+    watch_deadline(telemetry.instrument(resource.meta.client))
+    return resource
+
+
+def watch_deadline(client):
+    from sigrun.cloud.concurrency import check_deadline
+
+    client.meta.events.register("before-call.*.*", check_deadline)
+    return client
+
+
+def get_ec2_resource(region: Optional[str] = None):
+    return get_resource("ec2", region or default_region())
+
+
+def get_ec2_client(region: Optional[str] = None):
+    return get_client("ec2", region or default_region())
+
+
+def get_cloudwatch_client(region: Optional[str] = None):
+    return get_client("cloudwatch", region or default_region())
+
+
+def get_ssm_client(region: Optional[str] = None):
+    return get_client("ssm", region or default_region())
+
+
+def get_s3_client(region: Optional[str] = None):
+    return get_client("s3", region or default_region())
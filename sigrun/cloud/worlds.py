@@ -0,0 +1,93 @@
+"""World exports. The game server archives its own world and streams it
+straight to S3 as a parallel multipart upload, so the archive is never held
+in memory or written to disk on either end. Sigrun only orchestrates the
+export over SSM and hands out a presigned link to the result.
+
+Servers need the instance profile in SERVER_INSTANCE_PROFILE for this to
+work, and the bucket in WORLD_BUCKET is expected to expire old exports. The
+bucket is in WORLD_BUCKET_REGION, or the default region if that isn't set;
+servers in other regions upload across to it."""
+
+import os
+import shlex
+from typing import Optional
+
+from loguru import logger
+
+from sigrun.cloud.session import default_region, get_s3_client, get_ssm_client
+
+WORLD_BUCKET = os.environ.get("WORLD_BUCKET", "")
+WORLD_BUCKET_REGION = os.environ.get("WORLD_BUCKET_REGION", "")
+URL_EXPIRY_SECONDS = int(os.environ.get("WORLD_URL_EXPIRY_SECONDS", 24 * 3600))
+# The deferred Lambda has five minutes, leave it room to report back
+EXPORT_TIMEOUT_SECONDS = 240
+# Upload memory on the server is bounded by chunk size times concurrency
+MULTIPART_CHUNK_SIZE = "64MB"
+MULTIPART_CONCURRENCY = 8
+
+
+class WorldExportError(Exception):
+    pass
+
+
+def get_bucket_region() -> str:
+    return WORLD_BUCKET_REGION or default_region()
+
+
+def export_script(world_dir: str, bucket: str, key: str, bucket_region: str) -> list:
+    world_dir, destination = shlex.quote(world_dir), shlex.quote(f"s3://{bucket}/{key}")
+    bucket_region = shlex.quote(bucket_region)
+    script = "\n".join(
+        [
+            "set -euo pipefail",
+            "command -v aws || snap install aws-cli --classic",
+            f"aws configure set default.s3.multipart_chunksize {MULTIPART_CHUNK_SIZE}",
+            f"aws configure set default.s3.max_concurrent_requests {MULTIPART_CONCURRENCY}",
+            'COMPRESS="$(command -v pigz || echo gzip)"',
+            f'tar -C {world_dir} -cf - . | "$COMPRESS" -c | aws s3 cp - {destination} --region {bucket_region}',
+        ]
+    )
+    # AWS-RunShellScript runs commands with sh, which is dash on Ubuntu and has
+    # no pipefail, so the export runs under bash
+    return [f"bash -c {shlex.quote(script)}"]
+
+
+def export_world(
+    instance_id: str, world_dir: str, key: str, region: Optional[str] = None
+):
+    """Have the server upload its world to `key`. Blocks until it's done."""
+    ssm = get_ssm_client(region)
+    command_id = ssm.send_command(
+        InstanceIds=[instance_id],
+        DocumentName="AWS-RunShellScript",
+        Parameters={
+            "commands": export_script(
+                world_dir, WORLD_BUCKET, key, get_bucket_region()
+            ),
+            "executionTimeout": [str(EXPORT_TIMEOUT_SECONDS)],
+        },
+        TimeoutSeconds=60,
+    )["Command"]["CommandId"]
+    logger.info(f"Exporting {world_dir} from {instance_id} with command {command_id}")
+
+    try:
+        ssm.get_waiter("command_executed").wait(
+            CommandId=command_id,
+            InstanceId=instance_id,
+            WaiterConfig={"Delay": 5, "MaxAttempts": EXPORT_TIMEOUT_SECONDS // 5},
+        )
+    except Exception as e:
+        invocation = ssm.get_command_invocation(
+            CommandId=command_id, InstanceId=instance_id
+        )
+        logger.error(f"World export failed: {invocation.get('StandardErrorContent')}")
+        raise WorldExportError(invocation.get("StatusDetails", str(e))) from e
+
+
+def get_download_url(key: str) -> str:
+    # Links are only valid when signed for the bucket's own region
+    return get_s3_client(get_bucket_region()).generate_presigned_url(
+        "get_object",
+        Params={"Bucket": WORLD_BUCKET, "Key": key},
+        ExpiresIn=URL_EXPIRY_SECONDS,
+    )
@@ -1,3 +1,4 @@
+from .copy_world import CopyWorld
 from .create_server import CreateServer
 from .list_games import ListGames
 from .list_servers import ListServers
@@ -6,6 +7,7 @@ from .start_server import StartServer
 from .stop_server import StopServer
 
 COMMANDS = {
+    CopyWorld.get_discord_name(): CopyWorld,
     CreateServer.get_discord_name(): CreateServer,
     ListGames.get_discord_name(): ListGames,
     ListServers.get_discord_name(): ListServers,
@@ -1,4 +1,13 @@
-from typing import Optional
+from enum import IntEnum
+from typing import List, Optional
+
+
+class Cost(IntEnum):
+    """Roughly how expensive a command is to run."""
+
+    CHEAP = 1  # No AWS calls
+    MODERATE = 2  # A handful of read-only AWS calls
+    EXPENSIVE = 3  # Changes infrastructure or takes a while
 
 
 class Command:
@@ -9,18 +18,26 @@ class Command:
         """The name of this comand."""
         raise NotImplementedError
 
-    # @staticmethod
-    # def is_deferred() -> bool:
-    #     """Discord interactions must be responded to within 3 seconds. If your command takes longer than this, indicate it is
-    #     deferred by overriding this method. A deferred command will be acknlowedged by `get_ack_message` and then executed
-    #     asynchronously by a second Lambda function."""
-    #     return False
+    @staticmethod
+    def get_expected_cost() -> Cost:
+        """Discord interactions must be responded to within 3 seconds. Commands cheap enough to fit
+        are executed inline by the interactions Lambda. Anything else is acknowledged by `get_ack_message`
+        and then executed asynchronously by a second Lambda function. An inline command that runs out
+        of time is re-run deferred, so only read-only commands should declare less than EXPENSIVE."""
+        return Cost.EXPENSIVE
 
     @staticmethod
     def get_ack_message() -> str:
         """The message an interaction is responded to with immediately."""
         return "I got your request. This is going to take a second."
 
+    @staticmethod
+    def get_coalescing_options(options: dict) -> Optional[dict]:
+        """The options that identify what a deferred run of this command does.
+        Identical requests in flight at the same time share a single run, see
+        `sigrun.cloud.idempotency`. None if the command shouldn't coalesce."""
+        return None
+
     @staticmethod
     def get_cli_description() -> str:
         """A description for the command line interface. You should probably use the same as
@@ -37,3 +54,15 @@ class Command:
         """The handler for the command when it is invoked by the Lambda. This
         needs to return in 3 seconds."""
         raise NotImplementedError
+
+
+def parse_instance_ids(*values) -> List[str]:
+    """Instance IDs from Discord arrive as one string separated by spaces or
+    commas; from the command line they're already a sequence. Several values,
+    e.g. an option and its older alias, are merged in order."""
+    instance_ids = []
+    for value in values:
+        if isinstance(value, str):
+            value = value.replace(",", " ").split()
+        instance_ids.extend(value)
+    return [i for i in dict.fromkeys(instance_ids) if i]
@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from sigrun.cloud import ec2, worlds
+from sigrun.commands.base import Command
+from sigrun.exceptions import GameNotFoundError
+from sigrun.model.discord import CHAT_INPUT_TYPE, STRING_OPTION_TYPE
+from sigrun.model.game import get_game
+from sigrun.model.messenger import get_messenger
+
+
+class CopyWorld(Command):
+
+    def __init__(self, game: str, server_name: str):
+        self.game_name = game
+        self.server_name = server_name
+
+    @staticmethod
+    def get_discord_name():
+        return "copy-world"
+
+    @staticmethod
+    def get_cli_description():
+        return "Copy a server's world to S3 and get a temporary download link."
+
+    @staticmethod
+    def get_coalescing_options(options: dict) -> dict:
+        return {"game": options["game"], "server_name": options["server_name"]}
+
+    @staticmethod
+    def get_discord_metadata() -> dict:
+        return {
+            "type": CHAT_INPUT_TYPE,
+            "name": CopyWorld.get_discord_name(),
+            "description": CopyWorld.get_cli_description(),
+            "default_permission": True,
+            "options": [
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "game",
+                    "description": "The game the server is running.",
+                    "required": True,
+                },
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "server_name",
+                    "description": "The name of the server.",
+                    "required": True,
+                },
+            ],
+        }
+
+    def handler(self):
+        try:
+            game = get_game(self.game_name)
+        except GameNotFoundError:
+            logger.error(f"Invalid game name {self.game_name}")
+            get_messenger()(f"I'm sorry, I don't support {self.game_name}.")
+            return
+
+        if not game.world_dir:
+            get_messenger()(f"I don't know where {game} keeps its worlds, sorry!")
+            return
+
+        if not worlds.WORLD_BUCKET:
+            logger.error("WORLD_BUCKET isn't set, there's nowhere to copy worlds to.")
+            get_messenger()(
+                "Copying worlds isn't set up here: there's no bucket to copy them to."
+            )
+            return
+
+        instance = ec2.get_non_terminated_instances(game.name, self.server_name)
+        if not instance:
+            get_messenger()(f"I couldn't find a {game} server named {self.server_name}!")
+            return
+        instance = instance.pop()
+
+        if instance.state != "running":
+            get_messenger()(
+                f"The {game} server {self.server_name} needs to be running to copy its world. Start it with `start-server`."
+            )
+            return
+
+        created = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        key = f"worlds/{game.name}/{self.server_name}/{created}.tar.gz"
+        try:
+            worlds.export_world(
+                instance.instance_id, game.world_dir, key, instance.region
+            )
+        except ClientError as e:
+            logger.error(f"Failed to reach {instance.instance_id}: {e}")
+            get_messenger()(
+                f"I couldn't reach {self.server_name}. Servers created before copy-world was supported can't export their worlds."
+            )
+            return
+        except worlds.WorldExportError as e:
+            get_messenger()(f"Copying the world failed: {e}")
+            return
+
+        hours = worlds.URL_EXPIRY_SECONDS // 3600
+        get_messenger()(
+            f"Here's the {game} world for {self.server_name}. The link works for {hours} hours:\n{worlds.get_download_url(key)}"
+        )
+
+    def __str__(self):
+        return "CopyWorld"
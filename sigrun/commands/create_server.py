@@ -1,23 +1,36 @@
 from datetime import datetime, timezone
-from typing import List, Dict
+from functools import partial
+from typing import Optional
 
 from loguru import logger
 
-from sigrun.cloud import ec2
-from sigrun.cloud.session import ec2_client, ec2_resource
+from sigrun.cloud import (
+    concurrency,
+    ec2,
+    idempotency,
+    images,
+    infrastructure,
+    inventory,
+    launch,
+    notifications,
+    pool,
+)
+from sigrun.cloud.images import GameImage
+from sigrun.cloud.session import default_region
 from sigrun.commands.base import Command
 from sigrun.exceptions import GameNotFoundError, PasswordTooShortError
 from sigrun.model.discord import CHAT_INPUT_TYPE, STRING_OPTION_TYPE
-from sigrun.model.game import Game
+from sigrun.model.game import Game, get_game
 from sigrun.model.messenger import get_messenger
 
 
 class CreateServer(Command):
 
-    def __init__(self, game: str, server_name: str, password: str):
+    def __init__(self, game: str, server_name: str, password: str, region: str = ""):
         self.game_name = game
         self.server_name = server_name
         self.password = password
+        self.region = region
 
     @staticmethod
     def get_discord_name():
@@ -27,6 +40,12 @@ class CreateServer(Command):
     def get_cli_description():
         return """Create an instance of a game server. Use it's unique id to start and stop the instance."""
 
+    @staticmethod
+    def get_coalescing_options(options: dict) -> dict:
+        # A server is identified by its game and name, so requests for the same
+        # server coalesce even if their passwords or regions differ
+        return {"game": options["game"], "server_name": options["server_name"]}
+
     @staticmethod
     def get_discord_metadata() -> dict:
         return {
@@ -53,134 +72,113 @@ class CreateServer(Command):
                     "description": "The server password.",
                     "required": True,
                 },
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "region",
+                    "description": "The AWS region to create it in, if not the game's usual one.",
+                    "required": False,
+                },
             ],
         }
 
     def handler(self):
         try:
-            game = Game(self.game_name)
+            game = get_game(self.game_name)
         except GameNotFoundError:
             logger.error(f"Invalid game name {self.game_name}")
             get_messenger()(f"I'm sorry, I don't support {self.game_name}.")
             return
+        region = self.region or game.region or default_region()
+        if game.name == "valheim" and len(self.password) < 5:
+            get_messenger()(
+                f"A Valheim server requires a password at least 5 characters long!"
+            )
+            raise PasswordTooShortError
 
-        instance = ec2.get_non_terminated_instances(game.name, self.server_name)
+        # The image and spares are only needed if we end up creating an
+        # instance, but looking them up alongside the instance saves round
+        # trips. Names are unique across regions, so the lookup covers all of them.
+        instance, image, spares = concurrency.gather(
+            partial(ec2.get_non_terminated_instances, game.name, self.server_name),
+            partial(images.get_latest_image, game, region),
+            partial(pool.get_spares, game, region) if game.warm_pool else list,
+        )
 
         if not instance:
             get_messenger()(
-                f"Ok, I'll create a {game} server named {self.server_name}."
+                f"Ok, I'll create a {game} server named {self.server_name} in {region}."
+            )
+            instance_id = pool.claim(
+                game, self.server_name, self.password, spares, region
+            ) or self.create_instance(
+                game, self.server_name, self.password, image, region
+            )
+            get_messenger()(
+                f"{self.server_name} has been initialized. It's ID is {instance_id}."
             )
-            self.create_instance(game, self.server_name, self.password)
+            if notifications.register([instance_id]):
+                get_messenger()("I'll post its address here once it's up.")
             return
         instance = instance.pop()
 
-        if instance.state["Name"] == "running":
+        if instance.state == "running":
             get_messenger()(f"The {game} server {self.server_name} is already running!")
             return
 
-        if instance.state["Name"] == "stopped":
+        if instance.state == "stopped":
             get_messenger()(
-                f"I'm restarting {game} server {self.server_name}: {instance}."
-            )
-            response = instance.start()
-            response = instance.create_tags(
-                Tags=[
-                    {
-                        "Key": "start_time",
-                        "Value": datetime.now(timezone.utc).isoformat(),
-                    },
-                ]
+                f"I'm restarting {game} server {self.server_name}: {instance.instance_id}."
             )
+            ec2.start_servers([instance])
+            inventory.record_state([instance], "pending")
+            if notifications.register([instance.instance_id]):
+                get_messenger()("I'll post its address here once it's up.")
             return
 
         get_messenger()(
-            f"I found an existing instance, but it's in an unsupported state: {instance.state['Name'].upper()}. Please try again"
-        )
-
-    def create_instance(self, game: Game, server_name: str, password: str):
-        if game.name == "valheim" and len(password) < 5:
-            get_messenger()(
-                f"A Valheim server requires a password at least 5 characters long!"
-            )
-            raise PasswordTooShortError
-
-        security_group_id = self.create_security_group(game.pretty_name, game.ports)
-
-        instance = ec2_resource.create_instances(
-            BlockDeviceMappings=[
-                {
-                    # DeviceName needs to match device name in AMI
-                    # or will create a second unmounted device
-                    "DeviceName": "/dev/sda1",
-                    "Ebs": {
-                        "DeleteOnTermination": False,
-                        "VolumeSize": game.storage,
-                        "VolumeType": "gp3",
-                    },
-                }
-            ],
-            ImageId="ami-008fe2fc65df48dac",
-            InstanceType=game.instance_type,
-            MaxCount=1,
-            MinCount=1,
-            SecurityGroupIds=[security_group_id],
-            UserData=game.start_script.replace(
-                "PYTHON_SERVER_NAME", server_name
-            ).replace("PYTHON_PASSWORD", password),
-        ).pop()
-
-        response = instance.create_tags(
-            Tags=[
-                {"Key": "game", "Value": game.name},
-                {"Key": "pretty_game", "Value": game.pretty_name},
-                {
-                    "Key": "server_name",
-                    "Value": server_name,
-                },
-                {"Key": "password", "Value": password},
-                {"Key": "start_time", "Value": datetime.now(timezone.utc).isoformat()},
-                {"Key": "sigrun", "Value": ""},
-                # This will be the instance's visible name in the console
-                {"Key": "Name", "Value": f"{game.pretty_name}-{server_name}"},
-            ]
-        )
-
-        get_messenger()(
-            f"{server_name} has been initialized. It's ID is {instance.id}."
-        )
-
-    @staticmethod
-    def create_security_group(name: str, ports: List[Dict]):
-        response = ec2_client.describe_security_groups(
-            Filters=[{"Name": "group-name", "Values": [name]}]
-        )
-
-        if response["SecurityGroups"]:
-            sg_id = response["SecurityGroups"].pop()["GroupId"]
-            logger.info(f"Found existing security group {sg_id}")
-            return sg_id
-
-        security_group = ec2_resource.create_security_group(
-            GroupName=name,
-            Description="Security group for allowing inbound traffic",
+            f"I found an existing instance, but it's in an unsupported state: {instance.state.upper()}. Please try again"
         )
 
-        logger.info(f"Security Group Created: {security_group.group_id}")
-
-        ports.append({"port": 22, "protocol": "tcp"})
-        permissions = [
+    def create_instance(
+        self,
+        game: Game,
+        server_name: str,
+        password: str,
+        image: Optional[GameImage] = None,
+        region: Optional[str] = None,
+    ) -> str:
+        # The group usually comes straight from the resource cache
+        security_group_id = infrastructure.ensure_security_group(game, region)
+        # Servers launched from the game's image skip the install section
+        if image is not None:
+            logger.info(f"Launching {game} from image {image.image_id}")
+            image_id, script = image.image_id, game.configure_script
+        else:
+            image_id, script = images.get_base_image_id(region), game.start_script
+
+        options = launch.instance_options(
+            game,
+            image_id,
+            launch.render_user_data(script, game, server_name, password),
             {
-                "IpProtocol": p["protocol"],
-                "FromPort": p["port"],
-                "ToPort": p["port"],
-                "IpRanges": [{"CidrIp": "0.0.0.0/0"}],
-            }
-            for p in ports
-        ]
-
-        security_group.authorize_ingress(IpPermissions=permissions)
-
-        return security_group.group_id
+                **launch.server_tags(game, server_name, password, region),
+                "start_time": datetime.now(timezone.utc).isoformat(),
+            },
+            region,
+        )
+        return launch.run_instances(
+            game, security_group_id, options, region, client_token(server_name)
+        ).pop()
 
     def __str__(self):
         return "StartServer"
+
+
+def client_token(*parts: str) -> Optional[str]:
+    """RunInstances' ClientToken for this interaction, if it has one. EC2
+    launches at most one instance per token, so a retried interaction can't
+    create a second server."""
+    request_token = idempotency.request_token.get()
+    if request_token is None:
+        return None
+    return "-".join((request_token, *parts))
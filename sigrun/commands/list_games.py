@@ -1,8 +1,6 @@
-import json
-from importlib import resources
-
-from sigrun.commands.base import Command
+from sigrun.commands.base import Command, Cost
 from sigrun.model.discord import CHAT_INPUT_TYPE
+from sigrun.model.game import get_games
 from sigrun.model.messenger import get_messenger
 
 
@@ -12,6 +10,10 @@ class ListGames(Command):
     def get_discord_name():
         return "list-games"
 
+    @staticmethod
+    def get_expected_cost():
+        return Cost.CHEAP
+
     @staticmethod
     def get_cli_description():
         return "List supported games."
@@ -26,13 +28,7 @@ class ListGames(Command):
         }
 
     def handler(self):
-        games = {}
-        for short_name in resources.contents("sigrun.games"):
-            with resources.open_text(
-                f"sigrun.games.{short_name}", "metadata.json"
-            ) as f:
-                metadata = json.loads(f.read())
-                games.update({metadata["pretty_name"]: short_name})
+        games = {game.pretty_name: game.name for game in get_games().values()}
 
         format_name = lambda name, short: f"- '{short}': {name}"
         game_list = "\n".join(
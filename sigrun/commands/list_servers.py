@@ -1,24 +1,57 @@
 from datetime import datetime, timezone
+from itertools import chain
+from typing import Optional
 
 from loguru import logger
 
-from sigrun.cloud import ec2
-from sigrun.commands.base import Command
+from sigrun import agent
+from sigrun.cloud import ec2, inventory
+from sigrun.cloud.session import get_regions
+from sigrun.commands.base import Command, Cost
 from sigrun.exceptions import GameNotFoundError
-from sigrun.model.discord import CHAT_INPUT_TYPE, STRING_OPTION_TYPE
-from sigrun.model.game import Game
+from sigrun.model.discord import (
+    BOOLEAN_OPTION_TYPE,
+    CHAT_INPUT_TYPE,
+    STRING_OPTION_TYPE,
+)
+from sigrun.model.game import get_game, get_games
 from sigrun.model.messenger import get_messenger
 
 
+# How servers can be ordered. Sorting needs the whole fleet in hand, so sorted
+# lists are only sent once every page is in.
+SORT_KEYS = {
+    "name": lambda server: server.server_name,
+    "game": lambda server: (server.game, server.server_name),
+    "state": lambda server: (server.state, server.server_name),
+    "created": lambda server: server.launch_time,
+}
+
+
 class ListServers(Command):
 
-    def __init__(self, game: str = ""):
+    def __init__(
+        self,
+        game: str = "",
+        fresh: bool = False,
+        state: str = "",
+        name_prefix: str = "",
+        sort: str = "",
+    ):
         self.game_name = game
+        self.fresh = fresh
+        self.state = state
+        self.name_prefix = name_prefix
+        self.sort = sort
 
     @staticmethod
     def get_discord_name():
         return "list-servers"
 
+    @staticmethod
+    def get_expected_cost():
+        return Cost.MODERATE
+
     @staticmethod
     def get_cli_description():
         return "List existing servers for a game."
@@ -38,6 +71,35 @@ class ListServers(Command):
                     "description": "Only list servers of this game.",
                     "required": False,
                 },
+                {
+                    "type": BOOLEAN_OPTION_TYPE,
+                    "name": "fresh",
+                    "description": "Query AWS directly instead of using the cached inventory.",
+                    "required": False,
+                },
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "state",
+                    "description": "Only list servers in this state.",
+                    "required": False,
+                    "choices": [
+                        {"name": state, "value": state}
+                        for state in ec2.NON_TERMINATED_STATES
+                    ],
+                },
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "name_prefix",
+                    "description": "Only list servers whose name starts with this.",
+                    "required": False,
+                },
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "sort",
+                    "description": "Order the servers by this.",
+                    "required": False,
+                    "choices": [{"name": key, "value": key} for key in SORT_KEYS],
+                },
             ],
         }
 
@@ -45,41 +107,66 @@ class ListServers(Command):
         game = None
         if self.game_name:
             try:
-                game = Game(self.game_name)
+                game = get_game(self.game_name)
             except GameNotFoundError:
                 logger.error(f"Invalid game name {self.game_name}")
                 get_messenger()(f"I'm sorry, I don't support {self.game_name}.")
                 return
 
-        instances = []
+        if self.state and self.state not in ec2.NON_TERMINATED_STATES:
+            get_messenger()(f"I don't know the state {self.state}, sorry!")
+            return
+        if self.sort and self.sort not in SORT_KEYS:
+            get_messenger()(f"I can't sort by {self.sort}, sorry!")
+            return
+
         if game:
             get_messenger()(f"Fetching your {game} servers now!")
-            instances = ec2.get_non_terminated_instances(game.name)
         else:
             get_messenger()("Fetching your game servers now!")
-            instances = ec2.get_non_terminated_instances()
-
-        if not instances:
-            get_messenger()("I don't see any instances... Why don't you create one?")
-            return
 
-        get_messenger()(
-            "Here are your servers!\n"
-            + "\n".join([self.format_instance(i) for i in instances])
+        pages = inventory.stream_servers(
+            game.name if game else "",
+            (self.state,) if self.state else ec2.NON_TERMINATED_STATES,
+            self.name_prefix,
+            fresh=self.fresh,
         )
+        if self.sort:
+            pages = [sorted(chain.from_iterable(pages), key=SORT_KEYS[self.sort])]
+
+        # Each page is sent as soon as it's in, one message per server, and
+        # the messenger packs them into follow-ups that fit Discord's limit.
+        # Servers described just now already carry their current rosters.
+        from_inventory = inventory.get_store() is not None and not self.fresh
+        found = 0
+        for page in pages:
+            if not page:
+                continue
+            players = agent.get_players(page, get_games(), refresh=from_inventory)
+            if not found:
+                get_messenger()("Here are your servers!")
+            found += len(page)
+            for instance in page:
+                get_messenger()(
+                    self.format_instance(instance, players.get(instance.instance_id))
+                )
+
+        if not found:
+            get_messenger()("I don't see any instances... Why don't you create one?")
 
-    def format_instance(self, instance) -> str:
-        # TODO: monitoring: cpu, mem, connections
+    def format_instance(
+        self, instance: ec2.ServerRecord, players: Optional[dict] = None
+    ) -> str:
+        # TODO: monitoring: cpu, mem
         # TODO: monthly cost to date
         # TODO: instance type, storage size
         launch_time = instance.launch_time.strftime("%m/%d/%y %H:%M:%S %Z")
-        instance_id = instance.id
-        public_ip = instance.public_ip_address
-        state = instance.state["Name"].upper()
-        tags = {tag["Key"]: tag["Value"] for tag in instance.tags}
-        game = tags["pretty_game"]
-        server_name = tags["server_name"]
-        password = tags["password"]
+        instance_id = instance.instance_id
+        public_ip = instance.public_ip
+        state = instance.state.upper()
+        game = instance.pretty_game
+        server_name = instance.server_name
+        password = instance.password
 
         descriptors = []
         descriptors.append(f"Server: {server_name}")
@@ -87,11 +174,18 @@ class ListServers(Command):
         descriptors.append(f"Created: {launch_time}")
         descriptors.append(f"Instance ID: {instance_id}")
         descriptors.append(f"State: {state}")
+        if len(get_regions()) > 1 and instance.region:
+            descriptors.append(f"Region: {instance.region}")
         if public_ip:
             descriptors.append(f"Public IP: {public_ip}")
-        if "start_time" in tags:
-            uptime = self.calculate_uptime(datetime.fromisoformat(tags["start_time"]))
+        if instance.start_time:
+            uptime = self.calculate_uptime(instance.start_time)
             descriptors.append(f"Uptime: {uptime}")
+        if players is not None:
+            names = ", ".join(players["players"])
+            descriptors.append(
+                f"Players: {players['count']}" + (f" ({names})" if names else "")
+            )
 
         prefix = "\n  ... "
         return f"[{game}]" + "".join([prefix + d for d in descriptors])
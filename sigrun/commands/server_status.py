@@ -1,19 +1,23 @@
-from sigrun.commands.base import Command
+from sigrun.commands.base import Command, Cost
 from sigrun.model.discord import CHAT_INPUT_TYPE, STRING_OPTION_TYPE
-from sigrun.model.game import Game
+from sigrun.model.game import get_game
 from sigrun.model.messenger import get_messenger
 
 
 class ServerStatus(Command):
 
     def __init__(self, game: str, server_name: str):
-        self.game = Game(game)
+        self.game = get_game(game)
         self.server_name = server_name
 
     @staticmethod
     def get_discord_name():
         return "server-status"
 
+    @staticmethod
+    def get_expected_cost():
+        return Cost.CHEAP
+
     @staticmethod
     def get_cli_description():
         return "List information about a game server."
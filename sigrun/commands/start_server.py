@@ -1,17 +1,30 @@
-from datetime import datetime, timezone
+from typing import Iterable, Union
 
-from botocore.exceptions import ClientError
-
-from sigrun.cloud import ec2
-from sigrun.commands.base import Command
-from sigrun.model.discord import CHAT_INPUT_TYPE, STRING_OPTION_TYPE
+from sigrun.cloud import ec2, inventory, notifications
+from sigrun.commands.base import Command, parse_instance_ids
+from sigrun.model.discord import (
+    BOOLEAN_OPTION_TYPE,
+    CHAT_INPUT_TYPE,
+    STRING_OPTION_TYPE,
+)
 from sigrun.model.messenger import get_messenger
 
 
 class StartServer(Command):
 
-    def __init__(self, instance_id: str):
-        self.instance_id = instance_id
+    def __init__(
+        self,
+        instance_ids: Union[str, Iterable[str]] = "",
+        game: str = "",
+        confirm: bool = False,
+        fresh: bool = False,
+        instance_id: Union[str, Iterable[str]] = "",
+    ):
+        # instance_id is what the option was called before it took several
+        self.instance_ids = parse_instance_ids(instance_ids, instance_id)
+        self.game_name = game
+        self.confirm = confirm
+        self.fresh = fresh
 
     @staticmethod
     def get_discord_name():
@@ -19,8 +32,19 @@ class StartServer(Command):
 
     @staticmethod
     def get_cli_description():
-        return """Start an instance of a game server. Will create if one doesn't
-        currently eixst."""
+        return """Start one or more game servers by instance ID, or every server of a game."""
+
+    @staticmethod
+    def get_coalescing_options(options: dict) -> dict:
+        return {
+            "instance_ids": sorted(
+                parse_instance_ids(
+                    options.get("instance_ids", ""), options.get("instance_id", "")
+                )
+            ),
+            "game": options.get("game", ""),
+            "confirm": bool(options.get("confirm")),
+        }
 
     @staticmethod
     def get_discord_metadata() -> dict:
@@ -30,56 +54,83 @@ class StartServer(Command):
             "description": StartServer.get_cli_description(),
             "default_permission": True,
             "options": [
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "instance_ids",
+                    "description": "The instance ids of the servers you want to start, separated by spaces. You can get these by using `list-servers`.",
+                    "required": False,
+                },
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "game",
+                    "description": "Start every server of this game.",
+                    "required": False,
+                },
+                {
+                    "type": BOOLEAN_OPTION_TYPE,
+                    "name": "confirm",
+                    "description": "Go ahead when the game has more than one server.",
+                    "required": False,
+                },
+                {
+                    "type": BOOLEAN_OPTION_TYPE,
+                    "name": "fresh",
+                    "description": "Query AWS directly instead of using the cached inventory.",
+                    "required": False,
+                },
                 {
                     "type": STRING_OPTION_TYPE,
                     "name": "instance_id",
-                    "description": "The instance id of the server you want to start. You can get this by using `list-servers`.",
-                    "required": True,
-                }
+                    "description": "Same as instance_ids.",
+                    "required": False,
+                },
             ],
         }
 
     def handler(self):
-        instance = []
-        try:
-            instance = ec2.get_instance_by_id(self.instance_id)
-        except ClientError as e:
-            if e.response["Error"]["Code"] != "InvalidInstanceID.Malformed":
-                raise e
-
-        if not instance:
-            get_messenger()("I couldn't find an instance with that ID!")
+        if not (self.instance_ids or self.game_name):
+            get_messenger()("Tell me which servers to start, by instance ID or game.")
             return
 
-        instance = instance.pop()
-        state = instance.state["Name"]
-        tags = {tag["Key"]: tag["Value"] for tag in instance.tags}
-        game = tags["pretty_game"]
-        server_name = tags["server_name"]
-        password = tags["password"]
-
-        if state == "running":
-            get_messenger()(f"The {game} server {server_name} is already running!")
+        instances, missing = inventory.select_servers(
+            self.instance_ids, self.game_name, fresh=self.fresh
+        )
+        if not instances and not missing:
+            get_messenger()("I couldn't find any servers matching that!")
             return
-
-        if state == "stopped":
+        # A game alone can match a whole fleet, so that has to be asked for
+        if not self.instance_ids and len(instances) > 1 and not self.confirm:
             get_messenger()(
-                f"Booting up {game} server {server_name} now! The password is {password}. Use `list-servers` to monitor its status."
-            )
-            response = instance.start()
-            response = instance.create_tags(
-                Tags=[
-                    {
-                        "Key": "start_time",
-                        "Value": datetime.now(timezone.utc).isoformat(),
-                    },
-                ]
+                f"That's {len(instances)} {self.game_name} servers. Add `confirm` "
+                f"to start all of them, or pick them by instance ID."
             )
             return
 
-        get_messenger()(
-            f"I found an existing instance, but it's in an unsupported state: {instance.state['Name'].upper()}. Please try again"
-        )
+        results = [f"- I couldn't find an instance with ID {i}!" for i in missing]
+        to_start = []
+        for instance in instances:
+            label = f"{instance.pretty_game} server {instance.server_name} ({instance.instance_id})"
+            if instance.state == "running":
+                results.append(f"- The {label} is already running!")
+            elif instance.state == "stopped":
+                to_start.append(instance)
+                results.append(
+                    f"- Booting up {label} now! The password is {instance.password}."
+                )
+            else:
+                results.append(
+                    f"- The {label} is in an unsupported state: {instance.state.upper()}. Please try again"
+                )
+
+        if to_start:
+            ec2.start_servers(to_start)
+            inventory.record_state(to_start, "pending")
+            if notifications.register(i.instance_id for i in to_start):
+                results.append("I'll post their addresses here once they're up.")
+            else:
+                results.append("Use `list-servers` to monitor their status.")
+
+        get_messenger()("\n".join(results))
 
     def __str__(self):
         return "StartServer"
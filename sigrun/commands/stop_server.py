@@ -1,15 +1,30 @@
-from botocore.exceptions import ClientError
+from typing import Iterable, Set, Union
 
-from sigrun.cloud import ec2
-from sigrun.commands.base import Command
-from sigrun.model.discord import CHAT_INPUT_TYPE, STRING_OPTION_TYPE
+from sigrun.cloud import ec2, inventory
+from sigrun.commands.base import Command, parse_instance_ids
+from sigrun.model.discord import (
+    BOOLEAN_OPTION_TYPE,
+    CHAT_INPUT_TYPE,
+    STRING_OPTION_TYPE,
+)
 from sigrun.model.messenger import get_messenger
 
 
 class StopServer(Command):
 
-    def __init__(self, instance_id: str):
-        self.instance_id = instance_id
+    def __init__(
+        self,
+        instance_ids: Union[str, Iterable[str]] = "",
+        game: str = "",
+        confirm: bool = False,
+        fresh: bool = False,
+        instance_id: Union[str, Iterable[str]] = "",
+    ):
+        # instance_id is what the option was called before it took several
+        self.instance_ids = parse_instance_ids(instance_ids, instance_id)
+        self.game_name = game
+        self.confirm = confirm
+        self.fresh = fresh
 
     @staticmethod
     def get_discord_name():
@@ -17,7 +32,19 @@ class StopServer(Command):
 
     @staticmethod
     def get_cli_description():
-        return "Stop an instance of a game server."
+        return "Stop one or more game servers by instance ID, or every server of a game."
+
+    @staticmethod
+    def get_coalescing_options(options: dict) -> dict:
+        return {
+            "instance_ids": sorted(
+                parse_instance_ids(
+                    options.get("instance_ids", ""), options.get("instance_id", "")
+                )
+            ),
+            "game": options.get("game", ""),
+            "confirm": bool(options.get("confirm")),
+        }
 
     @staticmethod
     def get_discord_metadata():
@@ -27,50 +54,97 @@ class StopServer(Command):
             "description": StopServer.get_cli_description(),
             "default_permission": True,
             "options": [
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "instance_ids",
+                    "description": "The instance ids of the servers you want to stop, separated by spaces. You can get these by using `list-servers`.",
+                    "required": False,
+                },
+                {
+                    "type": STRING_OPTION_TYPE,
+                    "name": "game",
+                    "description": "Stop every server of this game.",
+                    "required": False,
+                },
+                {
+                    "type": BOOLEAN_OPTION_TYPE,
+                    "name": "confirm",
+                    "description": "Go ahead when the game has more than one server.",
+                    "required": False,
+                },
+                {
+                    "type": BOOLEAN_OPTION_TYPE,
+                    "name": "fresh",
+                    "description": "Query AWS directly instead of using the cached inventory.",
+                    "required": False,
+                },
                 {
                     "type": STRING_OPTION_TYPE,
                     "name": "instance_id",
-                    "description": "The instance id of the server you want to stop. You can get this by using `list-servers`.",
-                    "required": True,
-                }
+                    "description": "Same as instance_ids.",
+                    "required": False,
+                },
             ],
         }
 
     def handler(self):
-        instance = []
-        try:
-            instance = ec2.get_instance_by_id(self.instance_id)
-        except ClientError as e:
-            if e.response["Error"]["Code"] != "InvalidInstanceID.Malformed":
-                raise e
-
-        if not instance:
-            get_messenger()("I couldn't find an instance with that ID!")
+        if not (self.instance_ids or self.game_name):
+            get_messenger()("Tell me which servers to stop, by instance ID or game.")
             return
 
-        instance = instance.pop()
-        state = instance.state["Name"]
-        tags = {tag["Key"]: tag["Value"] for tag in instance.tags}
-        game = tags["pretty_game"]
-        server_name = tags["server_name"]
-
-        if state == "stopped":
-            get_messenger()(f"The {game} server {server_name} is already stopped!")
+        instances, missing = inventory.select_servers(
+            self.instance_ids, self.game_name, fresh=self.fresh
+        )
+        if not instances and not missing:
+            get_messenger()("I couldn't find any servers matching that!")
             return
-
-        if instance.state["Name"] == "running":
-            response = instance.stop()
-            response = instance.delete_tags(
-                Tags=[
-                    {"Key": "start_time"},
-                ]
+        # A game alone can match a whole fleet, so that has to be asked for
+        if not self.instance_ids and len(instances) > 1 and not self.confirm:
+            get_messenger()(
+                f"That's {len(instances)} {self.game_name} servers. Add `confirm` "
+                f"to stop all of them, or pick them by instance ID."
             )
-            get_messenger()(f"I've stopped the {game} server {server_name} for you.")
             return
 
+        # Servers being stopped are described once we know how they stopped
+        results = [f"- I couldn't find an instance with ID {i}!" for i in missing]
+        to_stop = []
+        for instance in instances:
+            label = self.label(instance)
+            if instance.state == "stopped":
+                results.append(f"- The {label} is already stopped!")
+            elif instance.state == "running":
+                to_stop.append(instance)
+                results.append(instance)
+            else:
+                results.append(
+                    f"- The {label} is in an unsupported state: {instance.state.upper()}. Please try again"
+                )
+
+        hibernated = set()
+        if to_stop:
+            hibernated = ec2.stop_servers(to_stop)
+            inventory.record_state(to_stop, "stopping")
+
         get_messenger()(
-            f"I found an existing instance, but it's in an unsupported state: {instance.state['Name'].upper()}. Please try again"
+            "\n".join(
+                self.describe_stop(result, hibernated)
+                if isinstance(result, ec2.ServerRecord)
+                else result
+                for result in results
+            )
         )
 
+    @staticmethod
+    def label(instance: ec2.ServerRecord) -> str:
+        return f"{instance.pretty_game} server {instance.server_name} ({instance.instance_id})"
+
+    @staticmethod
+    def describe_stop(instance: ec2.ServerRecord, hibernated: Set[str]) -> str:
+        label = StopServer.label(instance)
+        if instance.instance_id in hibernated:
+            return f"- I've put the {label} into hibernation, it'll pick up where it left off."
+        return f"- I've stopped the {label} for you."
+
     def __str__(self):
         return "StopServer"
@@ -1,12 +1,14 @@
 import os
 import pprint
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import httpx
 from loguru import logger
 
 from sigrun.commands import COMMANDS
+from sigrun.model.discord import CHAT_INPUT_TYPE
+from sigrun.model.messenger import request_with_rate_limit
 
 APPLICATION_ID = os.getenv("APPLICATION_ID")
 GUILD_ID = os.getenv("GUILD_ID")
@@ -20,6 +22,19 @@ GUILD_COMMANDS_URL = (
     f"{BASE_URL}/applications/{APPLICATION_ID}/guilds/{GUILD_ID}/commands"
 )
 AUTH_HEADERS = {"Authorization": f"Bot {BOT_TOKEN}"}
+MAX_PARALLEL_DELETES = 4
+
+# Fields Discord sets on a registered command, rather than ones we define
+ASSIGNED_FIELDS = ("id", "application_id", "guild_id", "version")
+# What Discord fills in for fields a command or option leaves out
+COMMAND_DEFAULTS = {
+    "type": CHAT_INPUT_TYPE,
+    "default_permission": True,
+    "dm_permission": True,
+    "nsfw": False,
+    "integration_types": [0],
+}
+OPTION_DEFAULTS = {"required": False, "autocomplete": False}
 
 
 @click.group()
@@ -47,30 +62,94 @@ def list(v: bool = False):
 @discord.command()
 def register():
     """DISCORD API: Register Sigrun's commands with your application. This only needs to
-    be run once. It's idempotent, you can run it repeatedly."""
-    for command in COMMANDS.values():
-        time.sleep(1)  # Avoiding rate limiting
-        logger.debug(f"Registering command {command.get_discord_metadata()}")
-        r = httpx.post(
-            COMMANDS_URL, json=command.get_discord_metadata(), headers=AUTH_HEADERS
+    be run once. It's idempotent, you can run it repeatedly. Only commands that changed
+    are sent, and commands Sigrun no longer has are removed."""
+    r = httpx.get(COMMANDS_URL, headers=AUTH_HEADERS)
+    if r.status_code != 200:
+        logger.error(f"Failed to get registered commands: {pprint.pformat(r.json())}")
+        return
+    registered = {command["name"]: command for command in r.json()}
+    desired = {
+        name: command.get_discord_metadata() for name, command in COMMANDS.items()
+    }
+
+    changed = [
+        name
+        for name, metadata in desired.items()
+        if name not in registered
+        or normalize_command(registered[name]) != normalize_command(metadata)
+    ]
+    removed = [name for name in registered if name not in desired]
+    if not (changed or removed):
+        logger.info("All commands are up to date.")
+        return
+    logger.info(f"Changed: {changed or 'none'}. Removed: {removed or 'none'}.")
+
+    # Bulk overwrite replaces the whole set in one call.
+    r = request_with_rate_limit(
+        "PUT", COMMANDS_URL, json=[*desired.values()], headers=AUTH_HEADERS
+    )
+    if r.status_code == 200:
+        logger.info(f"Registered {len(desired)} commands.")
+        return
+
+    logger.warning(
+        f"Bulk overwrite failed with {r.status_code}, falling back to individual calls."
+    )
+    for name in changed:
+        r = request_with_rate_limit(
+            "POST", COMMANDS_URL, json=desired[name], headers=AUTH_HEADERS
         )
         if not (r.status_code == 201 or r.status_code == 200):
             logger.error(
-                f"Failed to register {command.get_discord_name()}: {r.status_code} {pprint.pformat(r.json())}"
+                f"Failed to register {name}: {r.status_code} {pprint.pformat(r.json())}"
             )
         else:
-            logger.info(f"Registered {command.get_discord_name()}.")
+            logger.info(f"Registered {name}.")
+    delete_commands([registered[name]["id"] for name in removed])
+
+
+def normalize_command(metadata: dict) -> dict:
+    """A command's full definition, in a form that compares equal whether it
+    came from Sigrun or back from Discord. Fields Discord assigns are dropped,
+    as are fields left at Discord's defaults, so sending a default and leaving
+    it out compare equal."""
+    return normalize(
+        {k: v for k, v in metadata.items() if k not in ASSIGNED_FIELDS},
+        COMMAND_DEFAULTS,
+    )
+
+
+def normalize(payload: dict, defaults: dict) -> dict:
+    normalized = {}
+    for key, value in payload.items():
+        if key in ("options", "choices"):
+            value = [normalize(item, OPTION_DEFAULTS) for item in value or []]
+        if value is None or value == [] or (key in defaults and defaults[key] == value):
+            continue
+        normalized[key] = value
+    return normalized
 
 
 @discord.command()
 @click.argument("command_ids", nargs=-1)
 def delete(command_ids: str):
     """DISCORD API: Delete the Sigrun command referenced by COMMAND_ID."""
-    for command_id in command_ids:
-        r = httpx.delete(COMMANDS_URL + f"/{command_id}", headers=AUTH_HEADERS)
-        if r.status_code != 204:
-            logger.error(
-                f"Failed to delete {command_id}: {r.status_code} {pprint.pformat(r.json())}"
-            )
-        else:
-            logger.info(f"Deleted {command_id}.")
+    delete_commands(command_ids)
+
+
+def delete_commands(command_ids):
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_DELETES) as executor:
+        responses = executor.map(
+            lambda command_id: request_with_rate_limit(
+                "DELETE", COMMANDS_URL + f"/{command_id}", headers=AUTH_HEADERS
+            ),
+            command_ids,
+        )
+        for command_id, r in zip(command_ids, responses):
+            if r.status_code != 204:
+                logger.error(
+                    f"Failed to delete {command_id}: {r.status_code} {pprint.pformat(r.json())}"
+                )
+            else:
+                logger.info(f"Deleted {command_id}.")
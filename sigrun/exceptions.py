@@ -8,3 +8,11 @@ class MissingStartupScriptError(Exception):
 
 class PasswordTooShortError(Exception):
     pass
+
+
+class InvalidGameMetadataError(Exception):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
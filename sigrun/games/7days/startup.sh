@@ -6,6 +6,13 @@ echo ">>> Performing one-time Seven Days to Die setup <<<"
 SERVER_NAME=PYTHON_SERVER_NAME
 PASSWORD=PYTHON_PASSWORD
 
+STEAMCMD="/usr/games/steamcmd"
+GAME_ROOT="/usr/games/sevendaystodie"
+APP_ID=294420
+
+# Everything between the install markers is baked into the game's image by
+# `sigrun bake-image`, and skipped when a server launches from that image.
+# sigrun:install-begin
 echo ">>> Installing Steam <<<"
 sudo add-apt-repository multiverse -y
 sudo dpkg --add-architecture i386
@@ -19,11 +26,8 @@ echo steam steam/question select "I AGREE" | debconf-set-selections && \
     echo steam steam/license note '' | debconf-set-selections && \
     DEBIAN_FRONTEND=noninteractive apt-get install -q -y --no-install-recommends \
       libatomic1 libpulse-dev libpulse0 steamcmd net-tools ca-certificates gosu
-STEAMCMD="/usr/games/steamcmd"
 
-echo ">>> Installing 7 Days to Die under ${SEVEN_DAYS_ROOT} <<<"
-GAME_ROOT="/usr/games/sevendaystodie"
-APP_ID=294420
+echo ">>> Installing 7 Days to Die under ${GAME_ROOT} <<<"
 
 mkdir -p ${GAME_ROOT} \
     && chown -R steam:steam ${GAME_ROOT}
@@ -32,6 +36,7 @@ ${STEAMCMD} +force_install_dir ${GAME_ROOT} \
             +login anonymous \
             +app_update ${APP_ID} \
             +quit
+# sigrun:install-end
 
 echo ">>> Configuring server behavior <<<"
 xmlstarlet ed -L -u "//property[@name='ServerName']/@value" -v "${SERVER_NAME}" serverconfig.xml
@@ -71,5 +76,8 @@ chmod +x ${SYSTEMD_SERVICE_FILE}
 systemctl daemon-reload
 systemctl enable sevendaystodie.service
 
+# Inserted by Python: installs the player activity agent
+PYTHON_PLAYER_AGENT
+
 echo ">>> Starting the server <<<"
 systemctl start sevendaystodie.service
\ No newline at end of file
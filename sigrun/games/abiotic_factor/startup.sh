@@ -6,14 +6,19 @@ echo ">>> Performing one-time Abiotic Factor server setup <<<"
 SERVER_NAME=PYTHON_SERVER_NAME
 PASSWORD=PYTHON_PASSWORD
 
+GAME_ROOT="/usr/games/abiotic_factor"
+
+# Everything between the install markers is baked into the game's image by
+# `sigrun bake-image`, and skipped when a server launches from that image.
+# sigrun:install-begin
 echo ">>> Installing Docker <<<"
 sudo add-apt-repository multiverse -y
 sudo dpkg --add-architecture i386
 sudo apt -q -y update
 sudo apt -q -y upgrade
 curl -sSL https://get.docker.com | sh
+# sigrun:install-end
 
-GAME_ROOT="/usr/games/abiotic_factor"
 mkdir -p ${GAME_ROOT}
 
 echo ">>> Configuring server startup behavior <<<"
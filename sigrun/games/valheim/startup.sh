@@ -6,6 +6,13 @@ echo ">>> Performing one-time Valheim server setup <<<"
 SERVER_NAME=PYTHON_SERVER_NAME
 PASSWORD=PYTHON_PASSWORD
 
+STEAMCMD="/usr/games/steamcmd"
+GAME_ROOT="/usr/games/valheim"
+APP_ID=896660
+
+# Everything between the install markers is baked into the game's image by
+# `sigrun bake-image`, and skipped when a server launches from that image.
+# sigrun:install-begin
 echo ">>> Installing Steam <<<"
 sudo add-apt-repository multiverse -y
 sudo dpkg --add-architecture i386
@@ -16,10 +23,7 @@ echo steam steam/question select "I AGREE" | debconf-set-selections && \
     echo steam steam/license note '' | debconf-set-selections && \
     DEBIAN_FRONTEND=noninteractive apt-get install -q -y --no-install-recommends \
       libatomic1 libpulse-dev libpulse0 steamcmd net-tools ca-certificates gosu
-STEAMCMD="/usr/games/steamcmd"
 
-GAME_ROOT="/usr/games/valheim"
-APP_ID=896660
 echo ">>> Installing Valheim under ${GAME_ROOT} <<<"
 
 mkdir -p ${GAME_ROOT} \
@@ -29,6 +33,7 @@ ${STEAMCMD} +force_install_dir ${GAME_ROOT} \
                 +login anonymous \
                 +app_update ${APP_ID} \
                 +quit
+# sigrun:install-end
 
 echo ">>> Configuring server startup behavior <<<"
 
@@ -85,5 +90,8 @@ chmod +x ${SYSTEMD_SERVICE_FILE}
 systemctl daemon-reload
 systemctl enable valheim.service
 
+# Inserted by Python: installs the player activity agent
+PYTHON_PLAYER_AGENT
+
 echo ">>> Starting the server <<<"
 systemctl start valheim.service
\ No newline at end of file
@@ -1,2 +1,3 @@
 CHAT_INPUT_TYPE = 1
 STRING_OPTION_TYPE = 3
+BOOLEAN_OPTION_TYPE = 5
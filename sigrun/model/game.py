@@ -1,43 +1,242 @@
-import json
+"""The catalog of games Sigrun supports. Each game is a directory under
+`sigrun.games` containing a `metadata.json` and a `startup.sh`. The catalog
+is read once per process and then served from memory."""
 
-from dataclasses import dataclass
+import functools
+import json
+import re
+from dataclasses import dataclass, field
 from importlib import resources
-from typing import List, Dict
+from typing import Dict, Optional, Tuple
+
+from sigrun.exceptions import (
+    GameNotFoundError,
+    InvalidGameMetadataError,
+    MissingStartupScriptError,
+)
+
+GAMES_PACKAGE = "sigrun.games"
+METADATA_FILE = "metadata.json"
+STARTUP_SCRIPT_FILE = "startup.sh"
+
+# Required metadata keys and their types.
+METADATA_SCHEMA = {
+    "pretty_name": str,
+    "storage": int,
+    "instance_type": str,
+    "ports": list,
+}
+# Optional metadata keys and their types.
+OPTIONAL_METADATA_SCHEMA = {
+    "idle_policy": dict,
+    "image_max_age_days": int,
+    "world_dir": str,
+    "player_log": dict,
+    "region": str,
+    "hibernate": bool,
+    "warm_pool": int,
+}
+PLAYER_LOG_SCHEMA = {"path": str, "join": str, "leave": str}
+PORT_SCHEMA = {"port": int, "protocol": str}
+PORT_PROTOCOLS = ("tcp", "udp")
+
+# Startup scripts mark the part that can be baked into an image with these.
+INSTALL_BEGIN_MARKER = "# sigrun:install-begin\n"
+INSTALL_END_MARKER = "# sigrun:install-end\n"
+
+
+@dataclass(frozen=True, slots=True)
+class IdlePolicy:
+    """When the watchdog considers a server idle. A server is idle once every
+    sample over the last `idle_minutes` is under both thresholds. Servers up for
+    longer than `max_uptime_hours` are stopped regardless, if it's set."""
+
+    idle_minutes: int = 60
+    max_cpu_percent: float = 5.0
+    max_network_in_bytes: int = 500_000  # Per 5 minute sample
+    max_uptime_hours: Optional[float] = None
+
+
+@dataclass(frozen=True, slots=True)
+class PlayerLog:
+    """How the player agent reads a game's log. `path` may be a glob and may
+    contain `{server_name}`. The regexes capture an `id` and optionally a `name`."""
 
-from sigrun.exceptions import GameNotFoundError, MissingStartupScriptError
+    path: str
+    join: str
+    leave: str
 
 
-@dataclass
+IDLE_POLICY_SCHEMA = {
+    "idle_minutes": (int,),
+    "max_cpu_percent": (int, float),
+    "max_network_in_bytes": (int,),
+    "max_uptime_hours": (int, float, type(None)),
+}
+
+
+@dataclass(frozen=True, slots=True)
 class Game:
-    start_script: str
+    # NOTE: The name that a user can use for a particular game in an argument
+    #       corresponds to the dir name containing the game's metadata.
     name: str
     pretty_name: str
     storage: int
     instance_type: str
-    ports: List[Dict[str, str]]
+    ports: Tuple[Dict, ...]
+    idle_policy: IdlePolicy = field(default_factory=IdlePolicy)
+    image_max_age_days: int = 14
+    # Where the server keeps its world saves, for copy-world
+    world_dir: Optional[str] = None
+    player_log: Optional[PlayerLog] = None
+    # Where new servers are created, if not the default region
+    region: Optional[str] = None
+    # Stopped servers keep their memory, so they resume without booting
+    hibernate: bool = False
+    # How many spares with the game installed are kept stopped, see sigrun.cloud.pool
+    warm_pool: int = 0
 
-    def __init__(self, name: str):
-        # NOTE: The name that a user can use for a particular game in an argument
-        #       corresponds to the dir name containing the game's metadata.
-        try:
-            with resources.open_text(f"sigrun.games.{name}", "metadata.json") as f:
-                self.name = name
-                metadata = json.loads(f.read())
-                for key, value in metadata.items():
-                    setattr(self, key, value)
-        except ModuleNotFoundError:
-            raise GameNotFoundError
-
-        with resources.open_text(f"sigrun.games.{name}", "startup.sh") as f:
-            self.start_script = f.read()
-
-        if not hasattr(self, "start_script") or not hasattr(self, "name"):
-            raise MissingStartupScriptError(
-                f"Game {name} does not have valid metadata."
-            )
+    @property
+    def start_script(self) -> str:
+        """The game's startup script. It's only read when a server is created."""
+        return load_start_script(self.name)
+
+    @property
+    def supports_image(self) -> bool:
+        """Whether the startup script marks an install section to bake."""
+        script = self.start_script
+        return INSTALL_BEGIN_MARKER in script and INSTALL_END_MARKER in script
+
+    @property
+    def install_script(self) -> str:
+        """The startup script up to the end of its install section."""
+        script = self.start_script
+        return script[: script.index(INSTALL_END_MARKER)]
+
+    @property
+    def configure_script(self) -> str:
+        """The startup script without its install section, for servers launched
+        from an image that already has the game installed."""
+        script = self.start_script
+        begin = script.index(INSTALL_BEGIN_MARKER)
+        end = script.index(INSTALL_END_MARKER) + len(INSTALL_END_MARKER)
+        return script[:begin] + script[end:]
 
     def __str__(self) -> str:
         return self.pretty_name
 
     def __repr__(self) -> str:
         return f"Game({self.name})"
+
+
+def get_game(name: str) -> Game:
+    """Look up a supported game by its argument name."""
+    try:
+        return get_games()[name]
+    except KeyError:
+        raise GameNotFoundError(name)
+
+
+@functools.cache
+def get_games() -> Dict[str, Game]:
+    """Every supported game keyed by name. Built on first use and memoized for
+    the life of the process."""
+    games = {}
+    for name in sorted(resources.contents(GAMES_PACKAGE)):
+        package = f"{GAMES_PACKAGE}.{name}"
+        try:
+            if not resources.is_resource(package, METADATA_FILE):
+                continue
+        except (ModuleNotFoundError, TypeError):
+            continue
+        metadata = json.loads(resources.read_text(package, METADATA_FILE))
+        games[name] = parse_game(name, metadata)
+    return games
+
+
+def parse_game(name: str, metadata: dict) -> Game:
+    """Validate a game's metadata against the schema and build its record."""
+    validate_metadata(name, metadata)
+    return Game(
+        name=name,
+        pretty_name=metadata["pretty_name"],
+        storage=metadata["storage"],
+        instance_type=metadata["instance_type"],
+        ports=tuple(dict(p) for p in metadata["ports"]),
+        idle_policy=IdlePolicy(**metadata.get("idle_policy", {})),
+        image_max_age_days=metadata.get("image_max_age_days", 14),
+        world_dir=metadata.get("world_dir"),
+        player_log=(
+            PlayerLog(**metadata["player_log"]) if "player_log" in metadata else None
+        ),
+        region=metadata.get("region"),
+        hibernate=metadata.get("hibernate", False),
+        warm_pool=metadata.get("warm_pool", 0),
+    )
+
+
+def validate_metadata(name: str, metadata: dict):
+    for key, expected_type in METADATA_SCHEMA.items():
+        if not isinstance(metadata.get(key), expected_type):
+            raise InvalidGameMetadataError(
+                f"Game {name} metadata requires '{key}' of type {expected_type.__name__}."
+            )
+
+    for key, expected_type in OPTIONAL_METADATA_SCHEMA.items():
+        if key in metadata and not isinstance(metadata[key], expected_type):
+            raise InvalidGameMetadataError(
+                f"Game {name} metadata '{key}' must be of type {expected_type.__name__}."
+            )
+
+    for port in metadata["ports"]:
+        for key, expected_type in PORT_SCHEMA.items():
+            if not isinstance(port.get(key), expected_type):
+                raise InvalidGameMetadataError(
+                    f"Game {name} has a port without a valid '{key}': {port}"
+                )
+        if port["protocol"] not in PORT_PROTOCOLS:
+            raise InvalidGameMetadataError(
+                f"Game {name} has a port with an unsupported protocol: {port}"
+            )
+
+    if metadata.get("warm_pool", 0) < 0:
+        raise InvalidGameMetadataError(f"Game {name} warm_pool can't be negative.")
+
+    if "player_log" in metadata:
+        validate_player_log(name, metadata["player_log"])
+
+    for key, value in metadata.get("idle_policy", {}).items():
+        if key not in IDLE_POLICY_SCHEMA:
+            raise InvalidGameMetadataError(
+                f"Game {name} has an unknown idle policy setting '{key}'."
+            )
+        if not isinstance(value, IDLE_POLICY_SCHEMA[key]):
+            raise InvalidGameMetadataError(
+                f"Game {name} has an invalid idle policy setting '{key}': {value}"
+            )
+
+
+def validate_player_log(name: str, player_log: dict):
+    for key, expected_type in PLAYER_LOG_SCHEMA.items():
+        if not isinstance(player_log.get(key), expected_type):
+            raise InvalidGameMetadataError(
+                f"Game {name} player_log requires '{key}' of type {expected_type.__name__}."
+            )
+    for key in ("join", "leave"):
+        try:
+            groups = re.compile(player_log[key]).groupindex
+        except re.error as e:
+            raise InvalidGameMetadataError(f"Game {name} has an invalid '{key}' regex: {e}")
+        if "id" not in groups:
+            raise InvalidGameMetadataError(
+                f"Game {name} player_log '{key}' must capture an 'id' group."
+            )
+
+
+@functools.cache
+def load_start_script(name: str) -> str:
+    package = f"{GAMES_PACKAGE}.{name}"
+    try:
+        return resources.read_text(package, STARTUP_SCRIPT_FILE)
+    except (FileNotFoundError, ModuleNotFoundError):
+        raise MissingStartupScriptError(f"Game {name} does not have a startup script.")
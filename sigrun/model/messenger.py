@@ -1,18 +1,188 @@
 """This is a global configuration module for dictating where
-messages are sent by Sigrun's commands."""
+messages are sent by Sigrun's commands.
 
-from typing import Callable
+The messenger is held in a context variable, so a command run inside its own
+context (e.g. on a worker thread) can be given a messenger of its own without
+affecting anything else in the process."""
+
+import functools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 
 from loguru import logger
 
+from sigrun import telemetry
 
-messenger = logger.info
+messenger: ContextVar[Callable[[str], None]] = ContextVar(
+    "messenger", default=logger.info
+)
 
 
 def set_messenger(callable: Callable[[str], None]):
-    global messenger
-    messenger = callable
+    messenger.set(callable)
 
 
 def get_messenger() -> Callable[[str], None]:
-    return messenger
+    return messenger.get()
+
+
+@dataclass(frozen=True, slots=True)
+class Interaction:
+    """A Discord interaction that can still be followed up on."""
+
+    application_id: str
+    interaction_token: str
+
+
+# The interaction the current command is answering, if it came from Discord
+interaction: ContextVar[Optional[Interaction]] = ContextVar(
+    "interaction", default=None
+)
+
+
+def set_interaction(value: Optional[Interaction]):
+    interaction.set(value)
+
+
+def get_interaction() -> Optional[Interaction]:
+    return interaction.get()
+
+
+DISCORD_API_URL = os.environ.get("DISCORD_API_URL", "https://discord.com/api/v10")
+MAX_MESSAGE_LENGTH = 2000
+COALESCE_WINDOW_SECONDS = float(os.environ.get("COALESCE_WINDOW_SECONDS", 0.25))
+MAX_RETRIES = 5
+
+
+@functools.cache
+def get_http_client():
+    """One pooled HTTP client for the life of the process."""
+    import httpx
+
+    return httpx.Client(timeout=10.0)
+
+
+def split_message(content: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split content into chunks Discord will accept, preferring line breaks."""
+    chunks = []
+    while len(content) > limit:
+        cut = content.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(content[:cut])
+        content = content[cut:].lstrip("\n")
+    if content:
+        chunks.append(content)
+    return chunks
+
+
+def pack_messages(messages: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Join messages, one per line, into as few chunks under the limit as
+    possible. A message is only split if it doesn't fit in a chunk on its own."""
+    chunks = []
+    current = ""
+    for message in messages:
+        for piece in split_message(message, limit):
+            if current and len(current) + 1 + len(piece) > limit:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class RateLimiter:
+    """Tracks Discord's per-route rate limit buckets from response headers."""
+
+    def __init__(self):
+        self.route_buckets: Dict[str, str] = {}
+        self.buckets: Dict[str, Tuple[int, float]] = {}
+
+    def wait(self, route: str):
+        bucket = self.route_buckets.get(route)
+        if bucket is None or bucket not in self.buckets:
+            return
+        remaining, reset_at = self.buckets[bucket]
+        delay = reset_at - time.monotonic()
+        if remaining <= 0 and delay > 0:
+            logger.info(f"Rate limit bucket {bucket} is empty, waiting {delay:.2f}s.")
+            time.sleep(delay)
+
+    def update(self, route: str, headers):
+        bucket = headers.get("x-ratelimit-bucket")
+        if bucket is None:
+            return
+        self.route_buckets[route] = bucket
+        remaining = int(headers.get("x-ratelimit-remaining", 1))
+        reset_after = float(headers.get("x-ratelimit-reset-after", 0))
+        self.buckets[bucket] = (remaining, time.monotonic() + reset_after)
+
+
+rate_limiter = RateLimiter()
+
+
+def post_with_rate_limit(url: str, payload: dict):
+    return request_with_rate_limit("POST", url, json=payload)
+
+
+def request_with_rate_limit(method: str, url: str, **kwargs):
+    """Call a Discord route, honoring its bucket and any 429 Retry-After."""
+    for _ in range(MAX_RETRIES):
+        rate_limiter.wait(url)
+        with telemetry.span("discord.webhook"):
+            r = get_http_client().request(method, url, **kwargs)
+        rate_limiter.update(url, r.headers)
+        if r.status_code != 429:
+            logger.debug(f"Https response: {r}")
+            return r
+        retry_after = float(r.headers.get("retry-after", 1))
+        logger.warning(f"Rate limited by Discord, retrying in {retry_after}s.")
+        time.sleep(retry_after)
+    logger.error(f"Gave up calling {method} {url} after {MAX_RETRIES} attempts.")
+    return r
+
+
+class WebhookMessenger:
+    """A messenger that sends interaction follow-ups. Messages sent within a
+    short window of each other are coalesced into as few follow-ups as fit
+    under Discord's length limit, without splitting a message across two
+    unless it's too long on its own. Call `flush` before the Lambda returns."""
+
+    def __init__(
+        self,
+        application_id: str,
+        interaction_token: str,
+        window: float = COALESCE_WINDOW_SECONDS,
+    ):
+        self.url = f"{DISCORD_API_URL}/webhooks/{application_id}/{interaction_token}"
+        self.window = window
+        self.buffer: List[str] = []
+        self.buffer_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.timer: Optional[threading.Timer] = None
+
+    def __call__(self, content: str):
+        with self.buffer_lock:
+            self.buffer.append(content)
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.send_lock:
+            with self.buffer_lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                messages, self.buffer = self.buffer, []
+            if not messages:
+                return
+            for chunk in pack_messages(messages):
+                post_with_rate_limit(self.url, {"content": chunk})
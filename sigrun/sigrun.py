@@ -1,8 +1,14 @@
+import contextlib
 import sys
+from typing import Optional, Tuple
 
 import click
+from loguru import logger
 
+from sigrun import telemetry
+from sigrun.cloud.ec2 import NON_TERMINATED_STATES
 from sigrun.commands import (
+    CopyWorld,
     CreateServer,
     ListGames,
     ListServers,
@@ -10,13 +16,26 @@ from sigrun.commands import (
     StartServer,
     StopServer,
 )
+from sigrun.commands.list_servers import SORT_KEYS
 from sigrun.exceptions import GameNotFoundError
+from sigrun.model.game import get_game, get_games
 
 
 @click.group(invoke_without_command=True)
-def sigrun():
+@click.option("--timings", is_flag=True, help="Log where the command's time went.")
+@click.pass_context
+def sigrun(ctx: click.Context, timings: bool = False):
     """The Sigrun Discord bot command line interface.
     Used to list and register commands with your application."""
+    if ctx.invoked_subcommand is None:
+        return
+    telemetry.begin(ctx.invoked_subcommand)
+    # Click 7 has no Context.with_resource, so close the profile by hand
+    resources = contextlib.ExitStack()
+    resources.enter_context(telemetry.profiled(ctx.invoked_subcommand))
+    ctx.call_on_close(resources.close)
+    if timings:
+        ctx.call_on_close(telemetry.flush)
 
 
 @sigrun.command(help=ListGames.get_cli_description())
@@ -33,28 +52,119 @@ def server_status(game: str, server_name: str):
 
 @sigrun.command(help=ListServers.get_cli_description())
 @click.option("-g", "--game")
-def list_servers(game: str = ""):
-    ListServers(game).handler()
+@click.option(
+    "--fresh", is_flag=True, help="Query AWS directly instead of the inventory."
+)
+@click.option(
+    "--state",
+    type=click.Choice(NON_TERMINATED_STATES),
+    help="Only list servers in this state.",
+)
+@click.option("--name-prefix", default="", help="Only list servers named like this.")
+@click.option(
+    "--sort",
+    type=click.Choice(list(SORT_KEYS)),
+    help="Order the servers by this.",
+)
+def list_servers(
+    game: str = "",
+    fresh: bool = False,
+    state: Optional[str] = None,
+    name_prefix: str = "",
+    sort: Optional[str] = None,
+):
+    ListServers(game, fresh, state or "", name_prefix, sort or "").handler()
 
 
 @sigrun.command(help=CreateServer.get_cli_description())
 @click.argument("game")
 @click.argument("server_name")
 @click.argument("password")
-def create_server(game: str, server_name: str, password: str):
+@click.option("--region", default="", help="Create it in this AWS region.")
+def create_server(game: str, server_name: str, password: str, region: str = ""):
     try:
-        CreateServer(game, server_name, password).handler()
+        CreateServer(game, server_name, password, region).handler()
     except GameNotFoundError:
         sys.exit(1)
 
 
+@sigrun.command(help=CopyWorld.get_cli_description())
+@click.argument("game")
+@click.argument("server_name")
+def copy_world(game: str, server_name: str):
+    CopyWorld(game, server_name).handler()
+
+
 @sigrun.command(help=StartServer.get_cli_description())
-@click.argument("instance_id")
-def start_server(instance_id: str):
-    StartServer(instance_id).handler()
+@click.argument("instance_ids", nargs=-1)
+@click.option("-g", "--game", default="")
+@click.option(
+    "--confirm", is_flag=True, help="Go ahead when the game has several servers."
+)
+@click.option(
+    "--fresh", is_flag=True, help="Query AWS directly instead of the inventory."
+)
+@click.option("--instance-id", multiple=True, help="Same as the positional IDs.")
+def start_server(
+    instance_ids: Tuple[str, ...],
+    game: str = "",
+    confirm: bool = False,
+    fresh: bool = False,
+    instance_id: Tuple[str, ...] = (),
+):
+    StartServer(instance_ids, game, confirm, fresh, instance_id).handler()
 
 
 @sigrun.command(help=StopServer.get_cli_description())
-@click.argument("instance_id")
-def stop_server(instance_id: str):
-    StopServer(instance_id).handler()
+@click.argument("instance_ids", nargs=-1)
+@click.option("-g", "--game", default="")
+@click.option(
+    "--confirm", is_flag=True, help="Go ahead when the game has several servers."
+)
+@click.option(
+    "--fresh", is_flag=True, help="Query AWS directly instead of the inventory."
+)
+@click.option("--instance-id", multiple=True, help="Same as the positional IDs.")
+def stop_server(
+    instance_ids: Tuple[str, ...],
+    game: str = "",
+    confirm: bool = False,
+    fresh: bool = False,
+    instance_id: Tuple[str, ...] = (),
+):
+    StopServer(instance_ids, game, confirm, fresh, instance_id).handler()
+
+
+@sigrun.command()
+@click.argument("games", nargs=-1)
+@click.option("--force", is_flag=True, help="Bake even if the image is fresh.")
+@click.option("--region", default="", help="Bake in this region, not the game's.")
+def bake_image(games: Tuple[str, ...], force: bool = False, region: str = ""):
+    """Bake images with GAMES pre-installed so new servers start faster. Bakes
+    every game with a missing or stale image when no games are given."""
+    from sigrun.cloud import images
+
+    try:
+        selected = [get_game(name) for name in games] or get_games().values()
+    except GameNotFoundError as e:
+        logger.error(f"I don't support {e}.")
+        sys.exit(1)
+
+    for game in selected:
+        if not game.supports_image:
+            logger.info(f"{game} can't be baked into an image, skipping it.")
+            continue
+        game_region = region or game.region
+        if not force and not images.needs_bake(game, game_region):
+            logger.info(f"The {game} image is up to date.")
+            continue
+        images.bake_image(game, game_region)
+
+
+@sigrun.command()
+def replenish_pools():
+    """Launch or retire spares so every game's warm pool is at its target size.
+    The deployed stack does this every 10 minutes."""
+    from sigrun.cloud import pool
+
+    pool.replenish()
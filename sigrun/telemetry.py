@@ -0,0 +1,175 @@
+"""Timing spans for the request hot path, emitted as CloudWatch Embedded Metric
+Format (EMF) lines so CloudWatch turns them into metrics without any API calls.
+
+A request is bracketed by `begin` and `flush`. Spans recorded in between, from
+any thread, are collected per name and written out as a single EMF line along
+with the number of AWS calls the command made. CloudWatch computes percentiles
+from the raw values; each process also keeps a window of recent durations and
+logs its own p50/p99 alongside them.
+
+Setting SIGRUN_PROFILE to a sample rate between 0 and 1 runs that fraction of
+command handlers under cProfile. Profiles are written to SIGRUN_PROFILE_DEST,
+a directory (default /tmp) or an `s3://bucket/prefix`.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, List
+
+from loguru import logger
+
+NAMESPACE = os.environ.get("SIGRUN_METRICS_NAMESPACE", "Sigrun")
+PROFILE_SAMPLE_RATE = float(os.environ.get("SIGRUN_PROFILE", 0) or 0)
+PROFILE_DEST = os.environ.get("SIGRUN_PROFILE_DEST", "/tmp")
+# Full events are large and slow to format, so only a sample of them are logged
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get("SIGRUN_EVENT_LOG_SAMPLE_RATE", 0.01))
+ROLLUP_WINDOW = 1000
+
+
+class Trace:
+    """The spans recorded for the request in flight."""
+
+    def __init__(self, command: str = ""):
+        self.command = command
+        self.spans: Dict[str, List[float]] = defaultdict(list)
+        self.aws_calls = 0
+        self.lock = threading.Lock()
+
+    def record(self, name: str, milliseconds: float):
+        with self.lock:
+            self.spans[name].append(milliseconds)
+
+
+trace = Trace()
+rollups: Dict[str, deque] = defaultdict(lambda: deque(maxlen=ROLLUP_WINDOW))
+
+
+def begin(command: str = ""):
+    """Start a new trace. Anything recorded before is discarded."""
+    global trace
+    trace = Trace(command)
+
+
+def set_command(command: str):
+    trace.command = command
+
+
+@contextlib.contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(name, (time.perf_counter() - start) * 1000)
+
+
+def sampled(rate: float = EVENT_LOG_SAMPLE_RATE) -> bool:
+    return rate > 0 and random.random() < rate
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def flush():
+    """Write the current trace out as an EMF line."""
+    with trace.lock:
+        spans = {name: list(values) for name, values in trace.spans.items()}
+        aws_calls = trace.aws_calls
+
+    record = {"Command": trace.command or "none", "AwsCalls": aws_calls}
+    metrics = [{"Name": "AwsCalls", "Unit": "Count"}]
+    for name, values in spans.items():
+        metric = f"{name}_ms"
+        record[metric] = [round(value, 2) for value in values]
+        metrics.append({"Name": metric, "Unit": "Milliseconds"})
+        window = rollups[name]
+        window.extend(values)
+        record[f"{metric}_p50"] = round(percentile(window, 0.5), 2)
+        record[f"{metric}_p99"] = round(percentile(window, 0.99), 2)
+
+    record["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [
+            {
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Command"]],
+                "Metrics": metrics,
+            }
+        ],
+    }
+    logger.bind(emf=True).info(json.dumps(record))
+
+
+def install_emf_sink():
+    """Route EMF records to stdout as bare JSON lines, which is what CloudWatch
+    expects, and keep them out of the regular log."""
+    logger.remove()
+    logger.add(sys.stderr, filter=lambda r: "emf" not in r["extra"])
+    logger.add(sys.stdout, filter=lambda r: "emf" in r["extra"], format="{message}")
+
+
+def instrument(client):
+    """Record a span and count a call for every request a boto3 client makes."""
+    starts = threading.local()
+
+    def before_call(model, **kwargs):
+        starts.value = time.perf_counter()
+
+    def after_call(model, **kwargs):
+        with trace.lock:
+            trace.aws_calls += 1
+        elapsed = time.perf_counter() - getattr(starts, "value", time.perf_counter())
+        service = model.service_model.service_name
+        trace.record(f"aws.{service}.{model.name}", elapsed * 1000)
+
+    client.meta.events.register("before-call.*.*", before_call)
+    client.meta.events.register("after-call.*.*", after_call)
+    return client
+
+
+@contextlib.contextmanager
+def profiled(name: str):
+    """Run the block under cProfile if this request is sampled."""
+    if not sampled(PROFILE_SAMPLE_RATE):
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        save_profile(profile, f"{name}-{int(time.time() * 1000)}.prof")
+
+
+def save_profile(profile: cProfile.Profile, filename: str):
+    if not PROFILE_DEST.startswith("s3://"):
+        path = Path(PROFILE_DEST) / filename
+        profile.dump_stats(str(path))
+        logger.info(f"Wrote profile {path}")
+        return
+
+    from sigrun.cloud.session import get_s3_client
+
+    bucket, _, prefix = PROFILE_DEST[len("s3://") :].partition("/")
+    local = Path("/tmp") / filename
+    profile.dump_stats(str(local))
+    key = f"{prefix.rstrip('/')}/{filename}" if prefix else filename
+    try:
+        get_s3_client().upload_file(str(local), bucket, key)
+        logger.info(f"Uploaded profile to s3://{bucket}/{key}")
+    except Exception as e:
+        logger.warning(f"Couldn't upload profile {filename}: {e}")
+    finally:
+        local.unlink(missing_ok=True)
@@ -0,0 +1,92 @@
+"""The idle-shutdown watchdog. Each sweep lists every running Sigrun server,
+fetches their recent activity in one batched metrics query per region, and
+stops the ones their game's idle policy says are idle with one batched call
+per region. The number of AWS calls stays flat as the fleet grows."""
+
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from sigrun.cloud import cloudwatch, concurrency, ec2
+from sigrun.cloud.cloudwatch import Activity
+from sigrun.cloud.ec2 import ServerRecord
+from sigrun.exceptions import GameNotFoundError
+from sigrun.model.game import IdlePolicy, get_game
+
+
+def sweep() -> List[str]:
+    """Stop idle servers. Returns a line describing each server stopped."""
+    now = datetime.now(timezone.utc)
+    servers = ec2.get_running_instances()
+    if not servers:
+        logger.info("No running servers to check.")
+        return []
+
+    policies = {server.instance_id: get_policy(server) for server in servers}
+    window = max(policy.idle_minutes for policy in policies.values())
+    activity = get_activity(servers, now - timedelta(minutes=window), now)
+
+    to_stop = []
+    summary = []
+    for server in servers:
+        policy = policies[server.instance_id]
+        reason = stop_reason(server, policy, activity[server.instance_id], now)
+        if reason:
+            to_stop.append(server)
+            summary.append(
+                f"- {server.pretty_game} server {server.server_name} ({server.instance_id}): {reason}"
+            )
+
+    logger.info(f"Checked {len(servers)} servers, {len(to_stop)} to stop.")
+    if to_stop:
+        ec2.stop_servers(to_stop)
+    return summary
+
+
+def get_activity(
+    servers: List[ServerRecord], start: datetime, end: datetime
+) -> Dict[str, Activity]:
+    """Every server's activity, queried in each of their regions concurrently."""
+    by_region = ec2.group_by_region(servers)
+    results = concurrency.gather(
+        *[
+            partial(cloudwatch.get_activity, ids, start, end, region)
+            for region, ids in by_region.items()
+        ]
+    )
+    return {k: v for result in results for k, v in result.items()}
+
+
+def get_policy(server: ServerRecord) -> IdlePolicy:
+    try:
+        return get_game(server.game).idle_policy
+    except GameNotFoundError:
+        return IdlePolicy()
+
+
+def stop_reason(
+    server: ServerRecord, policy: IdlePolicy, activity: Activity, now: datetime
+) -> Optional[str]:
+    """Why a server should be stopped, or None if it should keep running."""
+    uptime = now - (server.start_time or server.launch_time)
+
+    if policy.max_uptime_hours is not None and uptime > timedelta(
+        hours=policy.max_uptime_hours
+    ):
+        return f"up for more than {policy.max_uptime_hours} hours"
+
+    # Give freshly started servers a full window before judging them
+    idle_window = timedelta(minutes=policy.idle_minutes)
+    if uptime < idle_window:
+        return None
+
+    recent = activity.since(now - idle_window)
+    if not (recent.cpu_percent and recent.network_in_bytes):
+        return None
+    if max(recent.cpu_percent.values()) >= policy.max_cpu_percent:
+        return None
+    if max(recent.network_in_bytes.values()) >= policy.max_network_in_bytes:
+        return None
+    return f"idle for the last {policy.idle_minutes} minutes"
@@ -0,0 +1,60 @@
+import contextvars
+import time
+from dataclasses import replace
+from datetime import datetime, timezone
+
+from sigrun import agent
+from sigrun.cloud import concurrency, ec2
+from sigrun.cloud.ec2 import ServerRecord
+from sigrun.model.game import Game, PlayerLog
+
+GAME = Game(
+    name="valheim",
+    pretty_name="Valheim",
+    storage=8,
+    instance_type="t3.medium",
+    ports=(),
+    player_log=PlayerLog(path="log", join="(?P<id>.+)", leave="(?P<id>.+)"),
+)
+SERVER = ServerRecord(
+    instance_id="i-running",
+    state="running",
+    launch_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    public_ip="203.0.113.1",
+    instance_type="t3.medium",
+    tags={"game": "valheim"},
+    region="us-east-1",
+)
+TAGGED = replace(
+    SERVER,
+    tags={"game": "valheim", "sigrun-players": "1", "sigrun-player-names": "bob"},
+)
+
+
+def test_rosters_are_read_afresh_from_tags(monkeypatch):
+    described = []
+
+    def describe_by_id(instance_ids, region):
+        described.append((instance_ids, region))
+        return [TAGGED]
+
+    monkeypatch.setattr(ec2, "describe_by_id", describe_by_id)
+
+    def run():
+        concurrency.set_deadline(time.perf_counter() + 0.75)
+        return agent.get_players([SERVER], {"valheim": GAME})
+
+    assert contextvars.Context().run(run) == {
+        "i-running": {"count": 1, "players": ["bob"]}
+    }
+    assert described == [(["i-running"], "us-east-1")]
+
+
+def test_rosters_are_skipped_without_time_to_spare(monkeypatch):
+    monkeypatch.setattr(ec2, "describe_by_id", lambda *args: [TAGGED])
+
+    def run():
+        concurrency.set_deadline(time.perf_counter() + 0.1)
+        return agent.get_players([SERVER], {"valheim": GAME})
+
+    assert contextvars.Context().run(run) == {}
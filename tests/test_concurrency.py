@@ -0,0 +1,66 @@
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+from sigrun.cloud import concurrency
+from sigrun.exceptions import DeadlineExceededError
+
+
+def in_own_context(call):
+    """Run `call` in a fresh context, so a deadline it sets doesn't leak."""
+    return contextvars.Context().run(call)
+
+
+def test_no_deadline_by_default():
+    concurrency.check_deadline()
+    assert concurrency.remaining(5.0) == 5.0
+
+
+def test_check_deadline_raises_once_out_of_time():
+    def run():
+        concurrency.set_deadline(time.perf_counter() - 1)
+        with pytest.raises(DeadlineExceededError):
+            concurrency.check_deadline()
+        assert concurrency.remaining(5.0) == 0.0
+
+    in_own_context(run)
+
+
+def test_submitted_calls_inherit_the_deadline():
+    def run():
+        concurrency.set_deadline(time.perf_counter() - 1)
+        future = concurrency.submit(concurrency.check_deadline)
+        assert isinstance(future.exception(timeout=5), DeadlineExceededError)
+
+    in_own_context(run)
+
+
+def test_gather_waits_no_longer_than_the_deadline():
+    release = threading.Event()
+
+    def run():
+        concurrency.set_deadline(time.perf_counter() + 0.1)
+        start = time.perf_counter()
+        with pytest.raises(FutureTimeoutError):
+            concurrency.gather(lambda: release.wait(5))
+        return time.perf_counter() - start
+
+    try:
+        assert in_own_context(run) < 1
+    finally:
+        release.set()
+
+
+def test_nested_fan_out_doesnt_exhaust_the_pool():
+    # Every worker is taken by an outer call that fans out again
+    def outer(i):
+        return sum(concurrency.gather(*[lambda: i] * concurrency.MAX_WORKERS))
+
+    calls = [functools.partial(outer, i) for i in range(concurrency.MAX_WORKERS * 2)]
+    results = concurrency.gather(*calls, timeout=5)
+
+    assert results == [i * concurrency.MAX_WORKERS for i in range(len(calls))]
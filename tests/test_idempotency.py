@@ -0,0 +1,113 @@
+import contextvars
+
+import pytest
+
+from sigrun.cloud import idempotency
+from sigrun.model.messenger import Interaction, get_messenger, set_messenger
+
+
+class StartThing:
+    @staticmethod
+    def get_discord_name():
+        return "start-thing"
+
+    @staticmethod
+    def get_coalescing_options(options: dict):
+        return {"thing": options["thing"]}
+
+
+def event(interaction_id: str, thing: str = "alpha") -> dict:
+    return {
+        "interaction_id": interaction_id,
+        "application_id": "app",
+        "interaction_token": f"token-{interaction_id}",
+        "options": {"thing": thing},
+    }
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setenv("SIGRUN_IDEMPOTENCY", "memory")
+    idempotency.get_store.cache_clear()
+    yield idempotency.get_store()
+    idempotency.get_store.cache_clear()
+
+
+@pytest.fixture
+def relayed(monkeypatch):
+    sent = []
+    monkeypatch.setattr(
+        idempotency, "relay_to", lambda waiter, messages: sent.append((waiter, messages))
+    )
+    return sent
+
+
+def run_once(command, event: dict, run) -> list:
+    """run_once in its own context, returning what it sent to the messenger."""
+    messages = []
+
+    def call():
+        set_messenger(messages.append)
+        idempotency.run_once(command, event, run)
+
+    contextvars.copy_context().run(call)
+    return messages
+
+
+def test_repeated_interactions_run_once(store):
+    runs = []
+
+    run_once(StartThing, event("1"), lambda: runs.append(1))
+    run_once(StartThing, event("1"), lambda: runs.append(2))
+
+    assert runs == [1]
+
+
+def test_failed_interactions_can_be_retried(store):
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        run_once(StartThing, event("1"), fail)
+
+    runs = []
+    run_once(StartThing, event("1"), lambda: runs.append(1))
+    assert runs == [1]
+
+
+def test_identical_requests_attach_and_are_relayed_the_result(store, relayed):
+    attached = []
+
+    def first_run():
+        get_messenger()("Booting up alpha now!")
+        # An identical request arrives while this one is in flight
+        attached.extend(run_once(StartThing, event("2"), pytest.fail))
+
+    sent = run_once(StartThing, event("1"), first_run)
+
+    assert sent == ["Booting up alpha now!"]
+    assert attached == ["Someone asked for that already, I'll tell you how it goes."]
+    assert relayed == [(Interaction("app", "token-2"), ["Booting up alpha now!"])]
+
+
+def test_different_requests_dont_coalesce(store, relayed):
+    runs = []
+
+    def first_run():
+        runs.append("alpha")
+        run_once(StartThing, event("2", "beta"), lambda: runs.append("beta"))
+
+    run_once(StartThing, event("1"), first_run)
+
+    assert runs == ["alpha", "beta"]
+    assert relayed == []
+
+
+def test_finished_claims_are_taken_afresh(store, relayed):
+    runs = []
+
+    run_once(StartThing, event("1"), lambda: runs.append(1))
+    run_once(StartThing, event("2"), lambda: runs.append(2))
+
+    assert runs == [1, 2]
+    assert relayed == []
@@ -0,0 +1,35 @@
+from sigrun.cloud import infrastructure
+from sigrun.cloud.infrastructure import FileResourceCache, MemoryResourceCache
+
+
+def test_file_cache_round_trips(tmp_path):
+    cache = FileResourceCache(tmp_path / "resources.json")
+    cache.put("security-group/us-east-1/valheim", {"group_id": "sg-1"})
+
+    reopened = FileResourceCache(tmp_path / "resources.json")
+    assert reopened.get("security-group/us-east-1/valheim") == {"group_id": "sg-1"}
+
+
+def test_unwritable_file_cache_falls_back_to_memory(tmp_path):
+    # A file where the cache's directory should be can't be written through,
+    # even by root
+    (tmp_path / "sigrun").write_text("")
+    cache = FileResourceCache(tmp_path / "sigrun" / "resources.json")
+
+    cache.put("a", {"group_id": "sg-1"})
+    cache.put("b", {"group_id": "sg-2"})
+    cache.delete("a")
+
+    assert cache.in_memory is not None
+    assert cache.get("a") is None
+    assert cache.get("b") == {"group_id": "sg-2"}
+
+
+def test_lambda_defaults_to_memory(monkeypatch):
+    monkeypatch.delenv("SIGRUN_RESOURCE_CACHE", raising=False)
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "sigrun-deferred")
+    infrastructure.get_cache.cache_clear()
+    try:
+        assert isinstance(infrastructure.get_cache(), MemoryResourceCache)
+    finally:
+        infrastructure.get_cache.cache_clear()
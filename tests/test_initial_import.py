@@ -0,0 +1,60 @@
+"""Cold start regression tests for the interactions Lambda. Discord gives it
+3 seconds to answer, so importing the handler must stay cheap: no AWS clients
+and no command modules until a request needs them."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# About twice what the import takes today, and short of what it takes once
+# boto3 is pulled in. Override it for slow machines.
+IMPORT_BUDGET_MS = float(os.environ.get("SIGRUN_IMPORT_BUDGET_MS", 200))
+
+# Imports the handler the way Lambda does, from a fresh interpreter, and
+# reports what the import cost and loaded
+PROBE = """
+import json, sys
+import initial
+print(json.dumps({
+    "timings": initial.init_timings,
+    "boto3": "boto3" in sys.modules,
+    "commands": "sigrun.commands" in sys.modules,
+}))
+"""
+
+
+def import_handler() -> dict:
+    env = {
+        "PATH": os.environ.get("PATH", ""),
+        "PYTHONPATH": os.pathsep.join(
+            [str(REPO_ROOT / "lambda_"), str(REPO_ROOT)]
+        ),
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "test",
+        "AWS_SECRET_ACCESS_KEY": "test",
+        "DEFERRED_LAMBDA_NAME": "sigrun-deferred",
+    }
+    # The first import also compiles bytecode, which Lambda's package ships with
+    subprocess.run([sys.executable, "-c", "import initial"], env=env, check=True)
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_is_within_budget():
+    probe = import_handler()
+    assert probe["timings"]["import_ms"] < IMPORT_BUDGET_MS
+
+
+def test_import_defers_aws_and_commands():
+    probe = import_handler()
+    assert not probe["boto3"]
+    assert not probe["commands"]
@@ -0,0 +1,84 @@
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import pytest
+
+from sigrun.cloud import ec2, inventory
+from sigrun.commands.start_server import StartServer
+from sigrun.commands.stop_server import StopServer
+
+RUNNING = ec2.ServerRecord(
+    instance_id="i-running",
+    state="running",
+    launch_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    public_ip="203.0.113.1",
+    instance_type="t3.medium",
+    tags={"game": "valheim", "server_name": "alpha"},
+    region="us-east-1",
+)
+STOPPED = replace(RUNNING, instance_id="i-stopped", state="stopped", public_ip=None)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """A fresh memory inventory holding RUNNING and STOPPED."""
+    monkeypatch.setenv("SIGRUN_INVENTORY", "memory")
+    inventory.get_store.cache_clear()
+    store = inventory.get_store()
+    store.replace_all([RUNNING, STOPPED])
+    yield store
+    inventory.get_store.cache_clear()
+
+
+def test_start_and_stop_write_through(store, monkeypatch):
+    monkeypatch.setattr(ec2, "start_servers", lambda records: None)
+    monkeypatch.setattr(ec2, "stop_servers", lambda records: set())
+    monkeypatch.setattr(
+        "sigrun.commands.start_server.notifications.register", lambda ids: False
+    )
+
+    StartServer("i-stopped").handler()
+    StopServer("i-running").handler()
+
+    assert store.get("i-stopped").state == "pending"
+    assert store.get("i-running").state == "stopping"
+
+
+def test_fresh_inventory_is_served_without_ec2(store, monkeypatch):
+    monkeypatch.setattr(ec2, "get_non_terminated_instances", pytest.fail)
+
+    assert inventory.get_servers() == [RUNNING, STOPPED]
+    assert inventory.get_servers_by_id(["i-stopped"]) == [STOPPED]
+
+
+def test_stale_inventory_is_reconciled(store, monkeypatch):
+    live = [replace(RUNNING, state="stopped")]
+    monkeypatch.setattr(ec2, "get_non_terminated_instances", lambda game="": live)
+    store.last_reconciled -= inventory.MAX_STALENESS_SECONDS + 1
+    assert not inventory.is_fresh(store)
+
+    assert inventory.get_servers() == live
+    assert store.list() == live
+    assert inventory.is_fresh(store)
+
+
+def test_fresh_is_always_live(store, monkeypatch):
+    live = [RUNNING]
+    monkeypatch.setattr(ec2, "get_non_terminated_instances", lambda game="": live)
+
+    assert inventory.get_servers(fresh=True) == live
+    assert store.list() == live
+
+
+def test_unknown_ids_go_to_ec2(store, monkeypatch):
+    created = replace(RUNNING, instance_id="i-created")
+    monkeypatch.setattr(
+        ec2,
+        "get_instances_by_id",
+        lambda ids: [r for r in (RUNNING, created) if r.instance_id in ids],
+    )
+
+    servers, missing = inventory.select_servers(["i-running", "i-created", "i-gone"])
+
+    assert servers == [RUNNING, created]
+    assert missing == ["i-gone"]
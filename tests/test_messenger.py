@@ -0,0 +1,107 @@
+import httpx
+import pytest
+
+from sigrun.model import messenger
+from sigrun.model.messenger import MAX_MESSAGE_LENGTH, WebhookMessenger, pack_messages
+
+
+class FakeDiscord:
+    """Answers webhook calls from a script of responses, then with 200s."""
+
+    def __init__(self, *responses: httpx.Response):
+        self.responses = list(responses)
+        self.posts = []
+
+    def request(self, method, url, **kwargs):
+        self.posts.append(kwargs["json"]["content"])
+        return self.responses.pop(0) if self.responses else httpx.Response(200)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(messenger.time, "sleep", slept.append)
+    monkeypatch.setattr(messenger, "rate_limiter", messenger.RateLimiter())
+    return slept
+
+
+def use(monkeypatch, discord: FakeDiscord):
+    monkeypatch.setattr(messenger, "get_http_client", lambda: discord)
+
+
+def test_messages_in_a_window_are_coalesced(monkeypatch, sleeps):
+    discord = FakeDiscord()
+    use(monkeypatch, discord)
+    send = WebhookMessenger("app", "token", window=60)
+
+    send("one")
+    send("two")
+    send("three")
+    assert discord.posts == []
+    send.flush()
+
+    assert discord.posts == ["one\ntwo\nthree"]
+    assert send.timer is None
+
+
+def test_window_flushes_on_its_own(monkeypatch, sleeps):
+    discord = FakeDiscord()
+    use(monkeypatch, discord)
+    send = WebhookMessenger("app", "token", window=0.05)
+
+    send("one")
+    send("two")
+    send.timer.join(5)
+
+    assert discord.posts == ["one\ntwo"]
+
+
+def test_coalescing_respects_the_length_limit():
+    long = "x" * (MAX_MESSAGE_LENGTH - 10)
+
+    chunks = pack_messages(["short", long, "tail"])
+
+    assert chunks == [f"short\n{long}", "tail"]
+    assert all(len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+
+
+def test_429_is_retried_after_discords_delay(monkeypatch, sleeps):
+    discord = FakeDiscord(httpx.Response(429, headers={"retry-after": "1.5"}))
+    use(monkeypatch, discord)
+    send = WebhookMessenger("app", "token", window=60)
+
+    send("hello")
+    send.flush()
+
+    assert discord.posts == ["hello", "hello"]
+    assert sleeps == [1.5]
+
+
+def test_empty_bucket_waits_for_its_reset(monkeypatch, sleeps):
+    exhausted = {
+        "x-ratelimit-bucket": "webhook",
+        "x-ratelimit-remaining": "0",
+        "x-ratelimit-reset-after": "30",
+    }
+    discord = FakeDiscord(httpx.Response(200, headers=exhausted))
+    use(monkeypatch, discord)
+    send = WebhookMessenger("app", "token", window=60)
+
+    send("first")
+    send.flush()
+    send("second")
+    send.flush()
+
+    assert discord.posts == ["first", "second"]
+    assert len(sleeps) == 1 and 29 < sleeps[0] <= 30
+
+
+def test_gives_up_after_repeated_429s(monkeypatch, sleeps):
+    limited = [httpx.Response(429, headers={"retry-after": "0"})] * messenger.MAX_RETRIES
+    discord = FakeDiscord(*limited)
+    use(monkeypatch, discord)
+
+    response = messenger.post_with_rate_limit("https://discord/webhook", {"content": "hi"})
+
+    assert response.status_code == 429
+    assert len(discord.posts) == messenger.MAX_RETRIES
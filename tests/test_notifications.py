@@ -0,0 +1,121 @@
+import contextvars
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import pytest
+
+from sigrun.cloud import ec2, notifications
+from sigrun.model.messenger import Interaction, set_interaction
+
+ASKER = Interaction("app", "token-1")
+OTHER = Interaction("app", "token-2")
+UP = ec2.ServerRecord(
+    instance_id="i-up",
+    state="running",
+    launch_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    public_ip="203.0.113.1",
+    instance_type="t3.medium",
+    tags={"pretty_game": "Valheim", "server_name": "alpha"},
+    region="us-east-1",
+)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setenv("SIGRUN_NOTIFICATIONS", "memory")
+    notifications.get_store.cache_clear()
+    yield notifications.get_store()
+    notifications.get_store.cache_clear()
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    """Follow-ups sent, as (interaction token, content) pairs."""
+    sent = []
+
+    class FakeMessenger:
+        def __init__(self, application_id, interaction_token):
+            self.token = interaction_token
+
+        def __call__(self, content):
+            sent.append((self.token, content))
+
+        def flush(self):
+            pass
+
+    monkeypatch.setattr(notifications, "WebhookMessenger", FakeMessenger)
+    return sent
+
+
+def in_own_context(call):
+    return contextvars.copy_context().run(call)
+
+
+def test_nobody_to_tell_without_a_store_or_interaction(monkeypatch):
+    monkeypatch.delenv("SIGRUN_NOTIFICATIONS", raising=False)
+    notifications.get_store.cache_clear()
+    assert not notifications.register(["i-up"], ASKER)
+    notifications.get_store.cache_clear()
+
+
+def test_nobody_to_tell_from_the_cli(store):
+    assert not in_own_context(lambda: notifications.register(["i-up"]))
+    assert store.pending() == set()
+
+
+def test_registers_the_interaction_being_answered(store):
+    def run():
+        set_interaction(ASKER)
+        return notifications.register(["i-up", "i-other"])
+
+    assert in_own_context(run)
+    assert store.pending() == {"i-up", "i-other"}
+
+
+def test_ready_servers_are_announced_once(store, posted):
+    notifications.register(["i-up"], ASKER)
+    notifications.register(["i-up"], OTHER)
+
+    notifications.notify_ready([UP])
+    notifications.notify_ready([UP])
+
+    message = "The Valheim server alpha is up at 203.0.113.1!"
+    assert sorted(posted) == [("token-1", message), ("token-2", message)]
+    assert store.pending() == set()
+
+
+def test_servers_without_an_address_wait(store, posted):
+    notifications.register(["i-up"], ASKER)
+
+    notifications.notify_ready([replace(UP, state="pending", public_ip=None)])
+
+    assert posted == []
+    assert store.pending() == {"i-up"}
+
+
+def test_sweeps_only_announce_registered_servers(store, posted):
+    notifications.register(["i-up"], ASKER)
+    unregistered = replace(UP, instance_id="i-else")
+
+    notifications.notify_ready([UP, unregistered])
+
+    assert [token for token, _ in posted] == ["token-1"]
+
+
+def test_expired_registrations_are_dropped(store, posted, monkeypatch):
+    monkeypatch.setattr(notifications, "REGISTRATION_TTL_SECONDS", -1)
+    notifications.register(["i-up"], ASKER)
+
+    notifications.notify_ready([UP])
+
+    assert posted == []
+
+
+def test_registrations_are_collected_for_coalesced_requests(store):
+    def run():
+        collected = []
+        notifications.registered.set(collected)
+        notifications.register(["i-up"], ASKER)
+        return collected
+
+    assert in_own_context(run) == ["i-up"]
@@ -0,0 +1,57 @@
+"""The agent signs its own requests, since it can't use boto3 on the server, so
+its signatures are checked against botocore's."""
+
+import datetime
+
+from botocore import auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+from sigrun.agent import player_agent, read_roster
+
+CREDENTIALS = {
+    "AccessKeyId": "AKIDEXAMPLE",
+    "SecretAccessKey": "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY",
+    "Token": "session-token",
+}
+NOW = datetime.datetime(2024, 5, 1, 12, 30, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_signature_matches_botocore(monkeypatch):
+    host = "ec2.eu-north-1.amazonaws.com"
+    body = b"Action=CreateTags&ResourceId.1=i-0123&Tag.1.Key=sigrun-players&Tag.1.Value=2"
+    headers = player_agent.sign(
+        "POST", host, "eu-north-1", "ec2", body, CREDENTIALS, NOW.timestamp()
+    )
+
+    monkeypatch.setattr(auth, "get_current_datetime", lambda: NOW.replace(tzinfo=None))
+    request = AWSRequest(
+        method="POST",
+        url=f"https://{host}/",
+        data=body,
+        headers={"content-type": headers["content-type"]},
+    )
+    auth.SigV4Auth(
+        Credentials(
+            CREDENTIALS["AccessKeyId"],
+            CREDENTIALS["SecretAccessKey"],
+            CREDENTIALS["Token"],
+        ),
+        "ec2",
+        "eu-north-1",
+    ).add_auth(request)
+
+    assert headers["authorization"] == request.headers["Authorization"]
+
+
+def test_roster_tags_round_trip():
+    roster = player_agent.Roster()
+    roster.join("76561198000000001", "bob")
+    roster.join("76561198000000002", None)
+    roster.leave("76561198000000003")
+
+    assert read_roster(roster.tags()) == {
+        "count": 2,
+        "players": ["76561198000000002", "bob"],
+    }
+    assert read_roster({}) is None
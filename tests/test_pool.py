@@ -0,0 +1,73 @@
+import threading
+from collections import Counter
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import pytest
+
+from sigrun.cloud import ec2, idempotency, pool
+from sigrun.model.game import Game
+
+GAME = Game(
+    name="valheim",
+    pretty_name="Valheim",
+    storage=8,
+    instance_type="t3.medium",
+    ports=(),
+    warm_pool=3,
+)
+SPARE = ec2.ServerRecord(
+    instance_id="i-spare-0",
+    state="stopped",
+    launch_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    public_ip=None,
+    instance_type="t3.medium",
+    tags={pool.POOL_TAG: "valheim"},
+    region="us-east-1",
+)
+SPARES = [replace(SPARE, instance_id=f"i-spare-{i}") for i in range(3)]
+
+
+@pytest.fixture
+def started(monkeypatch):
+    """The spares started, in place of configuring and starting them in EC2."""
+    monkeypatch.setenv("SIGRUN_IDEMPOTENCY", "memory")
+    idempotency.get_store.cache_clear()
+    started = []
+    monkeypatch.setattr(pool, "prepare", lambda *args: None)
+    monkeypatch.setattr(
+        ec2, "start_instances", lambda ids, region=None: started.extend(ids)
+    )
+    yield started
+    idempotency.get_store.cache_clear()
+
+
+def test_each_spare_is_claimed_once_under_contention(started):
+    requests = 12
+    barrier = threading.Barrier(requests)
+    claimed = [None] * requests
+
+    def create(i: int):
+        idempotency.request_token.set(f"interaction-{i}")
+        barrier.wait()
+        claimed[i] = pool.claim(GAME, f"server-{i}", "password", SPARES)
+
+    threads = [threading.Thread(target=create, args=(i,)) for i in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    winners = [instance_id for instance_id in claimed if instance_id is not None]
+    assert sorted(winners) == [spare.instance_id for spare in SPARES]
+    assert claimed.count(None) == requests - len(SPARES)
+    assert Counter(started) == Counter(winners)
+
+
+def test_taken_spares_are_skipped(started):
+    claims = [
+        pool.claim(GAME, f"server-{i}", "password", SPARES) for i in range(4)
+    ]
+
+    assert claims == ["i-spare-0", "i-spare-1", "i-spare-2", None]
+    assert started == claims[:3]
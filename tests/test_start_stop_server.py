@@ -0,0 +1,102 @@
+"""start-server and stop-server act on a mix of servers in one go and report on
+each, so these pin down what happens to every kind of ID they can be given."""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from sigrun.cloud import ec2
+from sigrun.commands import start_server, stop_server
+from sigrun.commands.start_server import StartServer
+from sigrun.commands.stop_server import StopServer
+
+
+def server(instance_id: str, state: str, name: str) -> ec2.ServerRecord:
+    return ec2.ServerRecord(
+        instance_id=instance_id,
+        state=state,
+        launch_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        public_ip=None,
+        instance_type="t3.medium",
+        tags={"game": "valheim", "pretty_game": "Valheim", "server_name": name},
+        region="us-east-1",
+    )
+
+
+FLEET = {
+    "i-running": server("i-running", "running", "alpha"),
+    "i-stopped": server("i-stopped", "stopped", "beta"),
+    "i-pending": server("i-pending", "pending", "gamma"),
+}
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    """Serves FLEET in place of the inventory and records what's acted on."""
+    calls = {"messages": [], "started": [], "stopped": []}
+
+    def select_servers(instance_ids, game="", fresh=False):
+        if not instance_ids:
+            return [s for s in FLEET.values() if s.game == game], []
+        found = [FLEET[i] for i in instance_ids if i in FLEET]
+        return found, [i for i in instance_ids if i not in FLEET]
+
+    def stop_servers(records):
+        calls["stopped"].extend(r.instance_id for r in records)
+        return set()
+
+    for module in (start_server, stop_server):
+        monkeypatch.setattr(module.inventory, "select_servers", select_servers)
+        monkeypatch.setattr(module, "get_messenger", lambda: calls["messages"].append)
+    monkeypatch.setattr(
+        ec2, "start_servers", lambda records: calls["started"].extend(
+            r.instance_id for r in records
+        )
+    )
+    monkeypatch.setattr(ec2, "stop_servers", stop_servers)
+    monkeypatch.setattr(start_server.notifications, "register", lambda ids: False)
+    return calls
+
+
+MIXED = "i-running i-stopped,i-pending i-missing"
+
+
+def test_start_reports_on_every_id(fleet):
+    StartServer(MIXED).handler()
+
+    assert fleet["started"] == ["i-stopped"]
+    (message,) = fleet["messages"]
+    assert "couldn't find an instance with ID i-missing" in message
+    assert "server alpha (i-running) is already running" in message
+    assert "Booting up Valheim server beta (i-stopped)" in message
+    assert "(i-pending) is in an unsupported state: PENDING" in message
+
+
+def test_stop_reports_on_every_id(fleet):
+    StopServer(MIXED).handler()
+
+    assert fleet["stopped"] == ["i-running"]
+    (message,) = fleet["messages"]
+    assert "couldn't find an instance with ID i-missing" in message
+    assert "stopped the Valheim server alpha (i-running)" in message
+    assert "server beta (i-stopped) is already stopped" in message
+    assert "(i-pending) is in an unsupported state: PENDING" in message
+
+
+def test_instance_id_is_an_alias(fleet):
+    StartServer(instance_id="i-stopped").handler()
+    StopServer(instance_ids="i-running", instance_id=["i-running"]).handler()
+
+    assert fleet["started"] == ["i-stopped"]
+    assert fleet["stopped"] == ["i-running"]
+
+
+def test_game_needs_confirm_for_several_servers(fleet):
+    StartServer(game="valheim").handler()
+    StopServer(game="valheim").handler()
+
+    assert fleet["started"] == fleet["stopped"] == []
+    assert all("Add `confirm`" in message for message in fleet["messages"])
+
+    StartServer(game="valheim", confirm=True).handler()
+    assert fleet["started"] == ["i-stopped"]
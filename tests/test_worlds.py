@@ -0,0 +1,22 @@
+from urllib.parse import parse_qs, urlparse
+
+from sigrun.cloud import worlds
+
+
+def test_download_links_are_signed_for_the_buckets_region(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(worlds, "WORLD_BUCKET", "worlds")
+    monkeypatch.setattr(worlds, "WORLD_BUCKET_REGION", "eu-north-1")
+
+    url = urlparse(worlds.get_download_url("worlds/valheim/alpha/1.tar.gz"))
+
+    (credential,) = parse_qs(url.query)["X-Amz-Credential"]
+    assert credential.split("/")[2] == "eu-north-1"
+    assert "eu-north-1" in url.netloc
+
+
+def test_export_uploads_to_the_buckets_region():
+    (command,) = worlds.export_script("/srv/world", "worlds", "a.tar.gz", "eu-north-1")
+
+    assert "s3://worlds/a.tar.gz --region eu-north-1" in command